@@ -0,0 +1,80 @@
+# Накладные расходы на клавиатуры за один апдейт: сборка InlineKeyboardMarkup
+# заново против KeyboardCache — главное меню, выбор папки из N папок,
+# страница ссылок; время и пик памяти (tracemalloc) на апдейт.
+# Запуск: python benchmarks/bench_keyboards.py [--updates 20000] [--folders 20]
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from loguru import logger
+from callback_codec import pack
+from keyboards import KeyboardCache, build_markup, layout
+
+
+def scenarios(args):
+    menu = [('🔗 Сократить', 'add_link'), ('📋 Ссылки', 'my_links'), ('📁 Папки', 'menu_groups'), ('📊 Статистика', 'stats_menu')]
+    folders = [(f"📁 Папка {gid}", pack('fs', gid)) for gid in range(1, args.folders + 1)]
+    links = [(f"🔗 Ссылка {lid}", pack('la', lid)) for lid in range(1000, 1010)]
+    return {
+        "main menu": lambda: (menu, 2, None),
+        f"folders x{args.folders}": lambda: (folders, 1, [('🏠 Меню', 'menu')]),
+        "links page": lambda: (links + [('◀', pack('pl', 0, 1000, 1)), ('▶', pack('pl', 0, 1009, 0))], 1, [('🏠 Меню', 'menu')]),
+    }
+
+
+def measure(make, updates):
+    for _ in range(100):
+        make()
+    started = time.perf_counter()
+    for _ in range(updates):
+        make()
+    elapsed = time.perf_counter() - started
+    # Пик памяти поверх текущей за один апдейт — сколько живёт одновременно
+    tracemalloc.start()
+    peaks = []
+    for _ in range(1000):
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        make()
+        peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    tracemalloc.stop()
+    return elapsed / updates * 1e6, sum(peaks) / len(peaks)
+
+
+async def bench_folder_rows(args):
+    # Запрос папок из БД против KeyboardCache.user_data
+    async def loader():
+        await asyncio.sleep(0)
+        return [(gid, f"Папка {gid}") for gid in range(args.folders)]
+    kbs = KeyboardCache()
+    for label, load in (("db query", loader), ("user_data", lambda: kbs.user_data(1, 'folders', loader))):
+        started = time.perf_counter()
+        for _ in range(args.updates):
+            await load()
+        print(f"{'folder rows, ' + label:<22} {(time.perf_counter() - started) / args.updates * 1e6:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=20_000)
+    parser.add_argument("--folders", type=int, default=20)
+    args = parser.parse_args()
+    logger.remove()
+    kbs = KeyboardCache()
+    print(f"{'keyboard':<22} {'mode':<8} {'us/update':>10} {'peak, B':>8}")
+    for name, spec in scenarios(args).items():
+        for mode, make in (("fresh", lambda: build_markup(layout(*spec()))), ("cached", lambda: kbs.make_kb(*spec()))):
+            us, peak = measure(make, args.updates)
+            print(f"{name:<22} {mode:<8} {us:>10.2f} {peak:>8.0f}")
+    print(f"\n{'data':<22} {'us/update':>10}")
+    asyncio.run(bench_folder_rows(args))
+    print(f"\n{kbs.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# Цена метрик на горячем пути (inc, observe, HandlerMetrics вокруг пустого
+# обработчика) и время одного запроса /metrics при заданном числе обработчиков.
+# Запуск: python benchmarks/bench_metrics.py [--calls 200000] [--handlers 50]
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from loguru import logger
+from metrics import Metrics, HandlerMetrics
+
+
+class Handler:
+    def __init__(self, name):
+        self.callback = lambda: None
+        self.callback.__name__ = name
+
+
+async def run(args):
+    registry = Metrics()
+    counter = registry.counter("bench_total", "", ("method",))
+    histogram = registry.histogram("bench_seconds", "", ("method",))
+    print(f"{'operation':<28} {'ns/call':>10}")
+    for name, op in (("counter.inc", lambda: counter.inc("utils.getLinkStats")),
+                     ("histogram.observe", lambda: histogram.observe(0.042, "utils.getLinkStats"))):
+        started = time.perf_counter()
+        for _ in range(args.calls):
+            op()
+        print(f"{name:<28} {(time.perf_counter() - started) / args.calls * 1e9:>10.0f}")
+
+    async def handler(event, data):
+        return None
+    middleware = HandlerMetrics()
+    data = {"handler": Handler("show_stats")}
+    for name, call in (("bare handler", lambda: handler(None, data)),
+                       ("HandlerMetrics + handler", lambda: middleware(handler, None, data))):
+        started = time.perf_counter()
+        for _ in range(args.calls):
+            await call()
+        print(f"{name:<28} {(time.perf_counter() - started) / args.calls * 1e9:>10.0f}")
+
+    for i in range(args.handlers):
+        histogram.observe(0.01 * i, f"handler_{i}")
+        counter.inc(f"handler_{i}")
+    started = time.perf_counter()
+    text = await registry.render()
+    print(f"\n/metrics: {len(text.splitlines())} строк, {len(text) / 1024:.1f} KB, {(time.perf_counter() - started) * 1e3:.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=200_000)
+    parser.add_argument("--handlers", type=int, default=50)
+    args = parser.parse_args()
+    logger.remove()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
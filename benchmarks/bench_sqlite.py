@@ -0,0 +1,86 @@
+# Сравнение прежнего пути "connect + commit на каждый запрос" с SqliteStorage.
+# Запуск: python benchmarks/bench_sqlite.py [--links 2000]
+import os
+import sys
+import time
+import asyncio
+import sqlite3
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from loguru import logger
+from storage import SqliteStorage
+
+INSERT = 'INSERT INTO links (user_id, title, short, original, created) VALUES (?, ?, ?, ?, ?)'
+SELECT = 'SELECT title, short FROM links WHERE user_id = ? AND group_id IS NULL ORDER BY id'
+UPDATE = 'UPDATE links SET group_id = ? WHERE user_id = ? AND short = ?'
+
+
+# Так работал Database.execute до перехода на общее соединение
+def connect_per_query(db_name, query, params=()):
+    with sqlite3.connect(db_name) as conn:
+        c = conn.cursor()
+        c.execute(query, params)
+        conn.commit()
+        return c.fetchall() if query.upper().startswith('SELECT') else c.rowcount
+
+
+def row(i):
+    return (i % 50, f"Ссылка {i}", f"https://vk.cc/k{i}", f"https://example.com/{i}", 1751284800)
+
+
+def bench_legacy(db_name, n):
+    conn = sqlite3.connect(db_name)
+    SqliteStorage.init_schema(conn)
+    conn.close()
+    timings = {}
+    started = time.perf_counter()
+    for i in range(n):
+        connect_per_query(db_name, INSERT, row(i))
+    timings["insert"] = time.perf_counter() - started
+    started = time.perf_counter()
+    for i in range(n):
+        connect_per_query(db_name, SELECT, (i % 50,))
+    timings["select"] = time.perf_counter() - started
+    started = time.perf_counter()
+    sum(connect_per_query(db_name, UPDATE, (None, i % 50, f"https://vk.cc/k{i}")) for i in range(n))
+    timings["bulk update"] = time.perf_counter() - started
+    return timings
+
+
+async def bench_storage(db_name, n):
+    db = SqliteStorage(db_name)
+    timings = {}
+    started = time.perf_counter()
+    for i in range(n):
+        await db.execute(INSERT, row(i))
+    timings["insert"] = time.perf_counter() - started
+    started = time.perf_counter()
+    for i in range(n):
+        await db.execute(SELECT, (i % 50,))
+    timings["select"] = time.perf_counter() - started
+    started = time.perf_counter()
+    await db.executemany(UPDATE, [(None, i % 50, f"https://vk.cc/k{i}") for i in range(n)])
+    timings["bulk update"] = time.perf_counter() - started
+    await db.close()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--links", type=int, default=2000)
+    args = parser.parse_args()
+    logger.remove()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy = bench_legacy(os.path.join(tmp, "legacy.db"), args.links)
+        pooled = asyncio.run(bench_storage(os.path.join(tmp, "pooled.db"), args.links))
+    print(f"{'operation':<12} {'connect/query, ms':>18} {'SqliteStorage, ms':>18} {'speedup':>8}")
+    for name in legacy:
+        print(f"{name:<12} {legacy[name] * 1e3:>18.1f} {pooled[name] * 1e3:>18.1f} {legacy[name] / pooled[name]:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# Сводная статистика по большому аккаунту: прежняя агрегация (статистика
+# каждой ссылки + вложенный обход городов) против stats_agg на синтетических
+# данных link_stats_daily (по умолчанию 1000 ссылок x 365 дней).
+# Запуск: python benchmarks/bench_stats_agg.py [--links 1000] [--days 365] [--cities 2000]
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import datetime
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from loguru import logger
+from storage import SqliteStorage
+from stats_warehouse import StatsWarehouse
+from stats_agg import summarize_link_stats
+
+INSERT = 'INSERT INTO link_stats_daily (link, day, views, city_id) VALUES (?, ?, ?, ?)'
+INSERT_LINK = 'INSERT INTO links (user_id, title, short, original, created, canonical) VALUES (1, ?, ?, ?, ?, ?)'
+# Ссылки загружены с начала периода: хранилище отвечает само, без VK
+INSERT_SYNC = 'INSERT INTO link_stats_sync (link, last_day, synced, covered_from) VALUES (?, ?, 0, ?)'
+START = datetime.date(2025, 1, 1)
+
+
+def make_rows(args):
+    rnd = random.Random(1)
+    days = [(START + datetime.timedelta(days=d)).isoformat() for d in range(args.days)]
+    for i in range(args.links):
+        link = f"https://vk.cc/l{i}"
+        for day in days:
+            # У каждой ссылки своя аудитория: города из окна около своего смещения
+            city_views = {(i * 7 + city) % args.cities + 1: rnd.randint(1, 20) for city in rnd.sample(range(args.audience), args.per_day)}
+            yield (link, day, sum(city_views.values()) + rnd.randint(0, 5), 0)
+            yield from ((link, day, views, city) for city, views in city_views.items())
+
+
+# Прежний путь экрана статистики
+def old_aggregate(stats):
+    all_cities = {cid: sum(s['cities'].get(cid, 0) for s in stats) for cid in {c for s in stats for c in s['cities']}}
+    return [s['views'] for s in stats], sum(s['views'] for s in stats), all_cities
+
+
+def timed(label, started, note=""):
+    print(f"{label:<44} {(time.perf_counter() - started) * 1e3:>9.1f} ms  {note}")
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        db = SqliteStorage(os.path.join(tmp, "links.db"))
+        started = time.perf_counter()
+        await db.executemany(INSERT, make_rows(args))
+        shorts = [f"https://vk.cc/l{i}" for i in range(args.links)]
+        created = int(datetime.datetime(START.year, START.month, START.day).timestamp())
+        last_day = (START + datetime.timedelta(days=args.days - 1)).isoformat()
+        await db.executemany(INSERT_LINK, [(short, short, f"https://example.com/{i}", created, f"example.com/{i}") for i, short in enumerate(shorts)])
+        await db.executemany(INSERT_SYNC, [(short, last_day, START.isoformat()) for short in shorts])
+        timed(f"заполнение ({args.links} x {args.days})", started)
+        warehouse = StatsWarehouse(db, vk=None, enabled=False)
+        date_from, date_to = "2025-01-01", "2025-12-31"
+
+        started = time.perf_counter()
+        stats = await warehouse.get_stats_many(shorts, date_from, date_to)
+        views, total, cities = old_aggregate(stats)
+        timed("прежний: get_stats_many + all_cities", started, f"всего {total}, городов {len(cities)}")
+        started = time.perf_counter()
+        old_aggregate(stats)
+        timed("  из них вложенный обход городов", started)
+
+        started = time.perf_counter()
+        summary_from_stats = summarize_link_stats(stats)
+        timed("  summarize_link_stats на тех же данных", started, f"всего {summary_from_stats.total}")
+
+        started = time.perf_counter()
+        summary = await warehouse.get_summary(shorts, date_from, date_to)
+        timed("новый: get_summary (колонки + топ городов)", started,
+              f"всего {summary.total}, городов {summary.city_count}, дней {len(summary.daily)}")
+        assert summary.total == total and summary.link_views == views
+        top = sorted(cities.values(), reverse=True)[:len(summary.top_cities)]
+        assert [v for _, v in summary.top_cities] == top and summary.city_count == len(cities)
+        await db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--links", type=int, default=1000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--cities", type=int, default=2000)
+    parser.add_argument("--audience", type=int, default=30)
+    parser.add_argument("--per-day", type=int, default=3)
+    args = parser.parse_args()
+    logger.remove()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
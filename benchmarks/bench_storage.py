@@ -0,0 +1,48 @@
+# Задержка вставки в JsonStorage при росте числа пользователей до 100k.
+# Запуск: python benchmarks/bench_storage.py [--users 100000] [--fsync]
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from loguru import logger
+from storage import JsonStorage
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = JsonStorage(os.path.join(tmp, "links.json"), fsync=args.fsync)
+        link = {"title": "Название", "short": "https://vk.cc/abcdef", "original": "https://example.com/page", "created": "2025-06-30T12:00:00"}
+        print(f"{'users':>8} {'mean, us':>10} {'p50, us':>10} {'p99, us':>10} {'max, ms':>10}")
+        samples = []
+        for uid in range(args.users):
+            started = time.perf_counter()
+            await storage.add_link(uid, link)
+            samples.append(time.perf_counter() - started)
+            if (uid + 1) % args.step == 0:
+                ordered = sorted(samples)
+                print(f"{uid + 1:>8} {statistics.fmean(samples) * 1e6:>10.1f} "
+                      f"{ordered[len(ordered) // 2] * 1e6:>10.1f} "
+                      f"{ordered[int(len(ordered) * 0.99)] * 1e6:>10.1f} "
+                      f"{ordered[-1] * 1e3:>10.1f}")
+                samples = []
+        await storage.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--step", type=int, default=10_000)
+    parser.add_argument("--fsync", action="store_true")
+    args = parser.parse_args()
+    logger.remove()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
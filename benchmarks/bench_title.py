@@ -0,0 +1,101 @@
+# Получение заголовка страницы: полный resp.text() + BeautifulSoup против
+# потокового чтения начала страницы (page_title.TitleFetcher).
+# Страницы отдаёт локальный aiohttp-сервер, кэш заголовков отключён.
+# Запуск: python benchmarks/bench_title.py [--sizes 1,5,10] [--repeat 5]
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiohttp import web
+from bs4 import BeautifulSoup
+from loguru import logger
+from http_client import http
+from page_title import TitleFetcher
+
+PORT = 8766
+
+
+def make_page(size_mb):
+    head = '<html><head><meta charset="utf-8"><title>Тестовая страница</title></head><body>'
+    row = '<div class="item"><a href="/p">Ссылка</a> <span>текст абзаца</span></div>\n'
+    body = row * (size_mb * 1024 * 1024 // len(row.encode()))
+    return (head + body + '</body></html>').encode()
+
+
+async def old_fetch(url):
+    async with http.session.get(url) as resp:
+        soup = BeautifulSoup(await resp.text(), 'html.parser')
+        return soup.title.string.strip() if soup.title else None
+
+
+# Время и худшая задержка цикла событий за прогоны, затем отдельный прогон
+# под tracemalloc для пика памяти (он сильно замедляет разбор)
+async def measure(fetch, url, repeat):
+    times, lags = [], []
+    for _ in range(repeat):
+        lag = 0.0
+        stop = False
+
+        async def ticker():
+            nonlocal lag
+            while not stop:
+                started = time.perf_counter()
+                await asyncio.sleep(0.001)
+                lag = max(lag, time.perf_counter() - started - 0.001)
+
+        task = asyncio.create_task(ticker())
+        started = time.perf_counter()
+        title = await fetch(url)
+        times.append(time.perf_counter() - started)
+        stop = True
+        await task
+        lags.append(lag)
+    tracemalloc.start()
+    await fetch(url)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return title, statistics.median(times), peak, max(lags)
+
+
+async def run(args):
+    pages = {size: make_page(size) for size in args.sizes}
+
+    async def handler(request):
+        return web.Response(body=pages[int(request.match_info["size"])], content_type="text/html", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/{size}", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+    await http.start()
+    fetcher = TitleFetcher(ttl=0)
+    print(f"{'page, MB':>8} {'method':>10} {'median, ms':>11} {'peak mem, MB':>13} {'max loop lag, ms':>17}  title")
+    try:
+        for size in args.sizes:
+            url = f"http://127.0.0.1:{PORT}/{size}"
+            for name, fetch in (("bs4", old_fetch), ("streaming", fetcher.fetch)):
+                title, median, peak, lag = await measure(fetch, url, args.repeat)
+                print(f"{size:>8} {name:>10} {median * 1e3:>11.1f} {peak / 2**20:>13.1f} {lag * 1e3:>17.1f}  {title}")
+    finally:
+        await http.close()
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=lambda s: [int(x) for x in s.split(",")], default=[1, 5, 10])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    logger.remove()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
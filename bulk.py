@@ -0,0 +1,103 @@
+import os
+import time
+import asyncio
+from loguru import logger
+
+# Сколько ссылок сокращается одновременно; темп запросов к VK всё равно
+# держит общий VkScheduler, параллельность лишь заполняет его очередь
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", "10"))
+# Telegram ограничивает частоту правок сообщения — прогресс не чаще раза в секунду
+BULK_PROGRESS_INTERVAL = float(os.getenv("BULK_PROGRESS_INTERVAL", "1"))
+
+
+# Итог пакетной обработки: успешные, ошибки, отброшенные повторы и мусор
+class BulkReport:
+    def __init__(self, urls=(), invalid=(), duplicates=0):
+        self.urls = list(urls)
+        self.invalid = list(invalid)
+        self.duplicates = duplicates
+        self.success = []
+        self.failed = []
+        self.elapsed = 0.0
+
+    @property
+    def done(self):
+        return len(self.success) + len(self.failed)
+
+
+# Разбор вставленного текста: пустые строки пропускаются, повторы схлопываются
+# с сохранением порядка, невалидные адреса откладываются в отчёт
+def prepare_urls(text, is_valid):
+    seen = set()
+    urls, invalid, duplicates = [], [], 0
+    for line in text.splitlines():
+        url = line.strip()
+        if not url:
+            continue
+        if not is_valid(url):
+            invalid.append(url)
+        elif url in seen:
+            duplicates += 1
+        else:
+            seen.add(url)
+            urls.append(url)
+    return BulkReport(urls, invalid, duplicates)
+
+
+# Вызывает callback(done, total) не чаще interval секунд; финальное
+# состояние (force) отправляется всегда, выждав остаток интервала, но не
+# повторно — Telegram ответит на ту же правку "message is not modified"
+class ProgressThrottle:
+    def __init__(self, callback, interval=BULK_PROGRESS_INTERVAL):
+        self.callback = callback
+        self.interval = interval
+        self._last = 0.0
+        self._shown = None
+
+    async def update(self, done, total, force=False):
+        if self.callback is None or self._shown == (done, total):
+            return
+        now = time.monotonic()
+        if now - self._last < self.interval:
+            if not force:
+                return
+            await asyncio.sleep(self._last + self.interval - now)
+        self._last = time.monotonic()
+        self._shown = (done, total)
+        try:
+            await self.callback(done, total)
+        except Exception as e:
+            # Сбой отображения прогресса не должен прерывать обработку
+            logger.warning(f"Не удалось обновить прогресс: {e}")
+
+
+# Сокращает report.urls параллельно. shorten(url) -> (short, error),
+# как shorten_link_vk; результаты складываются в исходном порядке ссылок
+async def shorten_bulk(report, shorten, progress=None, concurrency=BULK_CONCURRENCY, interval=BULK_PROGRESS_INTERVAL):
+    started = time.monotonic()
+    semaphore = asyncio.Semaphore(concurrency)
+    throttle = ProgressThrottle(progress, interval)
+    total = len(report.urls)
+    results = [None] * total
+    done = 0
+
+    async def worker(index, url):
+        nonlocal done
+        async with semaphore:
+            try:
+                results[index] = await shorten(url)
+            except Exception as e:
+                logger.error(f"Ошибка сокращения {url}: {e}")
+                results[index] = (None, str(e)[:50])
+        done += 1
+        await throttle.update(done, total)
+
+    await asyncio.gather(*(worker(i, url) for i, url in enumerate(report.urls)))
+    for url, (short, error) in zip(report.urls, results):
+        if short:
+            report.success.append({'title': url[:50], 'short': short, 'original': url})
+        else:
+            report.failed.append({'url': url, 'error': error})
+    report.elapsed = time.monotonic() - started
+    await throttle.update(done, total, force=True)
+    return report
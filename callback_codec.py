@@ -0,0 +1,42 @@
+# Компактные callback_data для inline-кнопок: "{версия}{действие}:{id}:{id}…",
+# id — неотрицательные целые в base36 ("1la:2n" — действие la для ссылки 95).
+# Telegram ограничивает callback_data 64 байтами, поэтому кнопки несут id
+# из БД, а не имена папок и позиции в списках. Кнопки другой версии unpack
+# не принимает — после смены формата старые сообщения не попадут в обработчики
+CB_VERSION = "1"
+CB_MAX_BYTES = 64
+DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def _to_base36(n):
+    if n < 0:
+        raise ValueError(f"Отрицательный id в callback_data: {n}")
+    out = ""
+    while True:
+        n, r = divmod(n, 36)
+        out = DIGITS[r] + out
+        if not n:
+            return out
+
+
+def pack(action, *ids):
+    data = CB_VERSION + action + "".join(":" + _to_base36(int(i)) for i in ids)
+    if len(data.encode()) > CB_MAX_BYTES:
+        raise ValueError(f"callback_data длиннее {CB_MAX_BYTES} байт: {data}")
+    return data
+
+
+# Начало callback_data действия — для фильтров F.data.startswith(...)
+def prefix(action):
+    return f"{CB_VERSION}{action}:"
+
+
+# (действие, [id…]) или None для чужой версии и испорченных данных
+def unpack(data):
+    head, *parts = (data or "").split(":")
+    if not head.startswith(CB_VERSION) or not parts:
+        return None
+    try:
+        return head[len(CB_VERSION):], [int(p, 36) for p in parts]
+    except ValueError:
+        return None
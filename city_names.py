@@ -0,0 +1,66 @@
+import os
+import asyncio
+import aiohttp
+from loguru import logger
+from vk_api import VkApiError
+
+# database.getCitiesById принимает до 1000 идентификаторов за вызов
+CITY_CHUNK = min(int(os.getenv("CITY_CHUNK", "1000")), 1000)
+
+
+# Справочник city_id -> название: хранится в таблице cities, целиком
+# загружается при старте; из VK запрашиваются только неизвестные id, а
+# одновременные запросы одного id ждут общий future
+class CityDirectory:
+    def __init__(self, db, vk, chunk=CITY_CHUNK):
+        self.db = db
+        self.vk = vk
+        self.chunk = chunk
+        self._names = {}
+        self._inflight = {}
+        self.hits = 0
+        self.fetched = 0
+
+    def __len__(self):
+        return len(self._names)
+
+    def stats(self):
+        return {"size": len(self), "hits": self.hits, "fetched": self.fetched}
+
+    async def load(self):
+        rows = await self.db.execute('SELECT id, title FROM cities')
+        self._names.update(rows)
+        logger.info(f"Справочник городов: загружено {len(rows)}")
+
+    # Названия для city_ids (строки или числа) в виде {"id": "название"};
+    # неизвестные VK города в ответ не попадают
+    async def get_names(self, city_ids):
+        ids = {int(cid) for cid in city_ids if str(cid).isdigit()}
+        missing = [cid for cid in ids if cid not in self._names and cid not in self._inflight]
+        self.hits += len(ids) - len(missing)
+        if missing:
+            loop = asyncio.get_running_loop()
+            for cid in missing:
+                self._inflight[cid] = loop.create_future()
+            await asyncio.gather(*(self._fetch(missing[i:i + self.chunk]) for i in range(0, len(missing), self.chunk)))
+        waiting = [self._inflight[cid] for cid in ids if cid in self._inflight]
+        if waiting:
+            await asyncio.gather(*(asyncio.shield(f) for f in waiting))
+        return {str(cid): self._names[cid] for cid in ids if self._names.get(cid)}
+
+    async def _fetch(self, chunk):
+        try:
+            data = await self.vk.get_cities_by_id(chunk)
+            titles = {city["id"]: city.get("title") for city in data or []}
+            rows = [(cid, titles.get(cid)) for cid in chunk]
+            await self.db.executemany('INSERT OR REPLACE INTO cities (id, title) VALUES (?, ?)', rows)
+            self._names.update(rows)
+            self.fetched += len(chunk)
+        except (VkApiError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # Не кэшируем: следующий просмотр спросит эти id снова
+            logger.error(f"Не удалось получить названия городов: {e}")
+        finally:
+            for cid in chunk:
+                future = self._inflight.pop(cid, None)
+                if future is not None and not future.done():
+                    future.set_result(None)
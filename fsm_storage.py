@@ -0,0 +1,177 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage
+from loguru import logger
+
+# По умолчанию состояния FSM лежат в том же файле, что и ссылки
+FSM_DB_PATH = os.getenv("FSM_DB_PATH", os.getenv("DB_PATH", "links.db"))
+# Брошенный на середине сценарий живёт сутки, потом считается пустым
+FSM_TTL = int(os.getenv("FSM_TTL", str(24 * 3600)))
+FSM_CLEANUP_INTERVAL = int(os.getenv("FSM_CLEANUP_INTERVAL", "600"))
+FSM_BUSY_TIMEOUT_MS = int(os.getenv("FSM_BUSY_TIMEOUT_MS", "5000"))
+
+
+# Состояния и данные FSM в SQLite: переживают перезапуск и общие для
+# нескольких процессов бота, работающих с одним файлом
+class SqliteFsmStorage(BaseStorage):
+    def __init__(self, db_name=FSM_DB_PATH, ttl=FSM_TTL, cleanup_interval=FSM_CLEANUP_INTERVAL):
+        self.db_name = db_name
+        self.ttl = ttl
+        self.cleanup_interval = cleanup_interval
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=type(self).__name__)
+        self._conn = None
+        self._cleanup_task = None
+        self._executor.submit(self._connect).result()
+
+    def _connect(self):
+        try:
+            # isolation_level=None: транзакции открываются явно
+            self._conn = sqlite3.connect(self.db_name, isolation_level=None)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute(f'PRAGMA busy_timeout={FSM_BUSY_TIMEOUT_MS}')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS fsm_state (key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL, updated INTEGER NOT NULL)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_fsm_state_updated ON fsm_state (updated)')
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка инициализации хранилища FSM: {e}")
+            raise
+
+    async def _run(self, func, *args):
+        if self._cleanup_task is None and self.ttl:
+            self._cleanup_task = asyncio.create_task(self._cleanup_loop())
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    @staticmethod
+    def _key(key):
+        return f"{key.bot_id}:{key.chat_id}:{key.thread_id or ''}:{key.user_id}:{key.destiny}"
+
+    def _alive_since(self):
+        return int(time.time()) - self.ttl if self.ttl else 0
+
+    def _read(self, key):
+        row = self._conn.execute('SELECT state, data FROM fsm_state WHERE key = ? AND updated >= ?', (key, self._alive_since())).fetchone()
+        if row is None:
+            return None, {}
+        return row[0], json.loads(row[1])
+
+    # Пустая запись (нет ни состояния, ни данных) удаляется, а не хранится
+    def _write(self, key, state, data):
+        if state is None and not data:
+            self._conn.execute('DELETE FROM fsm_state WHERE key = ?', (key,))
+            return
+        self._conn.execute(
+            'INSERT INTO fsm_state (key, state, data, updated) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET state = excluded.state, data = excluded.data, updated = excluded.updated',
+            (key, state, json.dumps(data, ensure_ascii=False), int(time.time()))
+        )
+
+    # Чтение и запись в одной транзакции: другой процесс не вклинится между ними
+    def _modify(self, key, state=None, data=None, update=None):
+        try:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                current_state, current_data = self._read(key)
+                if state is not None:
+                    current_state = state[0]
+                if data is not None:
+                    current_data = data
+                if update is not None:
+                    current_data.update(update)
+                self._write(key, current_state, current_data)
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            return current_data
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка записи состояния FSM: {e}")
+            raise
+
+    # Проверка и запись одной транзакцией: изменение применяется, только если
+    # состояние равно expected и поля match в данных совпадают. clear — сбросить
+    # состояние и данные, иначе дописать update. True — изменение применено
+    def _modify_if(self, key, expected, match, update, clear):
+        try:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                current_state, current_data = self._read(key)
+                applied = current_state == expected and all(current_data.get(k) == v for k, v in match.items())
+                if applied:
+                    if clear:
+                        self._write(key, None, {})
+                    else:
+                        current_data.update(update)
+                        self._write(key, current_state, current_data)
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            return applied
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка записи состояния FSM: {e}")
+            raise
+
+    async def update_if(self, key, expected, match, update=None, clear=False):
+        value = expected.state if isinstance(expected, State) else expected
+        return await self._run(self._modify_if, self._key(key), value, dict(match), dict(update or {}), clear)
+
+    async def set_state(self, key, state=None):
+        value = state.state if isinstance(state, State) else state
+        await self._run(self._modify, self._key(key), (value,))
+
+    async def get_state(self, key):
+        state, _ = await self._run(self._read, self._key(key))
+        return state
+
+    async def set_data(self, key, data):
+        await self._run(self._modify, self._key(key), None, dict(data))
+
+    async def get_data(self, key):
+        _, data = await self._run(self._read, self._key(key))
+        return data
+
+    async def update_data(self, key, data):
+        return dict(await self._run(self._modify, self._key(key), None, None, dict(data)))
+
+    def _state_counts(self):
+        rows = self._conn.execute('SELECT state, COUNT(*) FROM fsm_state WHERE updated >= ? GROUP BY state', (self._alive_since(),)).fetchall()
+        return {state or "none": count for state, count in rows}
+
+    # Сколько живых записей FSM в каждом состоянии ("none" — только данные)
+    async def state_counts(self):
+        return await self._run(self._state_counts)
+
+    def _cleanup(self):
+        deleted = self._conn.execute('DELETE FROM fsm_state WHERE updated < ?', (self._alive_since(),)).rowcount
+        if deleted:
+            logger.info(f"Удалено {deleted} просроченных состояний FSM")
+        return deleted
+
+    async def _cleanup_loop(self):
+        while True:
+            try:
+                await asyncio.get_running_loop().run_in_executor(self._executor, self._cleanup)
+            except sqlite3.Error as e:
+                logger.warning(f"Ошибка очистки состояний FSM: {e}")
+            await asyncio.sleep(self.cleanup_interval)
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def close(self):
+        if self._cleanup_task is not None:
+            self._cleanup_task.cancel()
+            try:
+                await self._cleanup_task
+            except asyncio.CancelledError:
+                pass
+            self._cleanup_task = None
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._close)
+        self._executor.shutdown(wait=True)
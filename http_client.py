@@ -0,0 +1,53 @@
+import os
+import aiohttp
+from loguru import logger
+
+# Настройки пула соединений
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "100"))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "20"))
+HTTP_DNS_TTL = int(os.getenv("HTTP_DNS_TTL", "300"))
+HTTP_KEEPALIVE = float(os.getenv("HTTP_KEEPALIVE", "30"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "10"))
+
+
+# Общая HTTP-сессия для всех запросов к VK API и проверок URL
+class HttpClient:
+    def __init__(self, limit=HTTP_POOL_LIMIT, limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+                 dns_ttl=HTTP_DNS_TTL, keepalive=HTTP_KEEPALIVE, timeout=HTTP_TIMEOUT):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_ttl = dns_ttl
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self._session = None
+
+    async def start(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.dns_ttl,
+                keepalive_timeout=self.keepalive,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+            logger.info(f"HTTP-клиент запущен (limit={self.limit}, per_host={self.limit_per_host})")
+        return self._session
+
+    @property
+    def session(self):
+        # Сессия создаётся в main() через start() и живёт до остановки бота
+        if self._session is None or self._session.closed:
+            raise RuntimeError("HTTP-клиент не запущен, вызовите start()")
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info("HTTP-клиент закрыт")
+        self._session = None
+
+
+http = HttpClient()
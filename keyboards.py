@@ -0,0 +1,84 @@
+import os
+import time
+from collections import OrderedDict
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+# Сколько разных клавиатур и пользователей с данными для клавиатур держать в памяти
+KB_CACHE_MAX = int(os.getenv("KB_CACHE_MAX", "4096"))
+
+
+# Ряды кнопок (текст, callback_data): buttons по row_width в ряд,
+# extra_buttons — последним рядом
+def layout(buttons, row_width=2, extra_buttons=None):
+    rows = [tuple(buttons[i:i + row_width]) for i in range(0, len(buttons), row_width)]
+    if extra_buttons:
+        rows.append(tuple(extra_buttons[:row_width]))
+    return rows
+
+
+def build_markup(rows):
+    return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text=text, callback_data=data) for text, data in row] for row in rows])
+
+
+# Клавиатуры по содержимому: ряды кнопок — ключ, одинаковые клавиатуры
+# собираются один раз (типы aiogram неизменяемы, объект можно отдавать
+# повторно). Данные для клавиатур из БД (список папок) кэшируются по
+# пользователю до invalidate(uid); апдейты одного пользователя идут по
+# очереди (UpdateScheduler), так что загрузка и сброс не пересекаются
+class KeyboardCache:
+    def __init__(self, max_entries=KB_CACHE_MAX):
+        self.max_entries = max_entries
+        self._markups = OrderedDict()
+        self._user_data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.buttons_built = 0
+        self.build_time = 0.0
+        self.data_hits = 0
+        self.data_misses = 0
+        self.invalidations = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_ratio": round(self.hits / total, 3) if total else 0.0,
+                "entries": len(self._markups), "buttons_built": self.buttons_built, "build_ms": round(self.build_time * 1e3, 1),
+                "data_hits": self.data_hits, "data_misses": self.data_misses, "invalidations": self.invalidations}
+
+    def markup(self, rows):
+        key = tuple(tuple(row) for row in rows)
+        cached = self._markups.get(key)
+        if cached is not None:
+            self._markups.move_to_end(key)
+            self.hits += 1
+            return cached
+        self.misses += 1
+        started = time.perf_counter()
+        cached = self._markups[key] = build_markup(key)
+        self.build_time += time.perf_counter() - started
+        self.buttons_built += sum(map(len, key))
+        if len(self._markups) > self.max_entries:
+            self._markups.popitem(last=False)
+        return cached
+
+    def make_kb(self, buttons, row_width=2, extra_buttons=None):
+        return self.markup(layout(buttons, row_width, extra_buttons))
+
+    # Данные пользователя под именем tag; loader (корутина) вызывается,
+    # только если их ещё нет или после invalidate(uid)
+    async def user_data(self, uid, tag, loader):
+        entries = self._user_data.get(uid)
+        if entries is not None and tag in entries:
+            self._user_data.move_to_end(uid)
+            self.data_hits += 1
+            return entries[tag]
+        self.data_misses += 1
+        value = await loader()
+        self._user_data.setdefault(uid, {})[tag] = value
+        self._user_data.move_to_end(uid)
+        if len(self._user_data) > self.max_entries:
+            self._user_data.popitem(last=False)
+        return value
+
+    def invalidate(self, uid):
+        if self._user_data.pop(uid, None) is not None:
+            self.invalidations += 1
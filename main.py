@@ -1,17 +1,24 @@
 import os
 import asyncio
-import json
+import functools
 import re
 from datetime import datetime
-from urllib.parse import quote
 from loguru import logger
 import aiohttp
 from aiogram import Bot, Dispatcher, types, Router
 from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from http_client import http
+from vk_api import VkApi, VkApiError, current_user
+from storage import create_storage
+from webhook import BOT_MODE, run_webhook
+from update_scheduler import setup_scheduler
+from fsm_storage import SqliteFsmStorage
+from short_cache import ShortLinkCache
+from reachability import ReachabilityChecker, URL_RE
+from keyboards import KeyboardCache, build_markup, layout
+from metrics import metrics, setup_metrics
 
 # Настройка логгера
 logger.add("bot.log", rotation="1 MB")
@@ -27,7 +34,8 @@ if not BOT_TOKEN or not VK_TOKEN:
 
 # Инициализация бота
 bot = Bot(BOT_TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
+vk = VkApi(VK_TOKEN)
+dp = Dispatcher(storage=SqliteFsmStorage())
 router = Router()
 
 # Класс состояний
@@ -36,125 +44,99 @@ class LinkForm(StatesGroup):
     waiting_for_title = State()
     waiting_for_stats_date = State()
 
-# Класс для работы с JSON
-class JsonStorage:
-    def __init__(self, file_name=os.getenv("LINKS_PATH", "links.json")):
-        self.file_name = file_name
-        self.data = self._load_data()
+storage = create_storage()
+short_cache = ShortLinkCache(storage.find_short)
+reachability = ReachabilityChecker()
+kbs = KeyboardCache()
 
-    def _load_data(self):
-        try:
-            with open(self.file_name, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except FileNotFoundError:
-            logger.info("Файл links.json не найден, создаётся новый")
-            return {}
-        except json.JSONDecodeError as e:
-            logger.error(f"Ошибка чтения JSON: {e}")
-            return {}
-
-    def _save_data(self):
-        try:
-            with open(self.file_name, 'w', encoding='utf-8') as f:
-                json.dump(self.data, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            logger.error(f"Ошибка записи JSON: {e}")
-            raise
-
-    def get_user_links(self, user_id):
-        return self.data.get(str(user_id), [])
-
-    def add_link(self, user_id, link_data):
-        user_id = str(user_id)
-        if user_id not in self.data:
-            self.data[user_id] = []
-        # Ограничение на 50 ссылок
-        if len(self.data[user_id]) >= 50:
-            self.data[user_id].pop(0)  # Удаляем самую старую ссылку
-        self.data[user_id].append(link_data)
-        self._save_data()
-
-storage = JsonStorage()
-
-# Проверка валидности URL
-async def is_valid_url(url):
-    if not re.match(r'^https?://[^\s/$.?#].[^\s]*$', url, re.IGNORECASE):
-        return False
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.head(url, timeout=5) as resp:
-                return resp.status in (200, 301, 302)
-    except aiohttp.ClientError as e:
-        logger.error(f"Ошибка проверки URL {url}: {e}")
-        return False
+# Проверка формата URL; доступность проверяет reachability в shorten_link_vk
+def is_valid_url(url):
+    return bool(URL_RE.match(url))
 
 # Функция сокращения ссылки через VK API
+# Адрес, уже сокращённый кем-либо раньше, проверялся при том сокращении —
+# повторно его не проверяем и во VK не идём
 async def shorten_link_vk(url):
-    if not await is_valid_url(url):
-        return None, "Недействительный или недоступный URL"
-    encoded_url = quote(url, safe='')
+    cached = await short_cache.get(url)
+    if cached:
+        return cached, ""
+    reachable, reason = await reachability.check(url)
+    if not reachable:
+        return None, f"Недоступный URL: {reason}"
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"https://api.vk.com/method/utils.getShortLink?url={encoded_url}&v=5.199&access_token={VK_TOKEN}",
-                timeout=10
-            ) as resp:
-                data = await resp.json()
-                if 'response' in data and 'short_url' in data['response']:
-                    return data['response']['short_url'], ""
-                error_msg = data.get('error', {}).get('error_msg', 'Неизвестная ошибка')
-                logger.error(f"Ошибка VK API: {error_msg}")
-                return None, f"Ошибка: {error_msg}"
+        data = await vk.get_short_link(url)
+        if data and 'short_url' in data:
+            short_cache.set(url, data['short_url'])
+            return data['short_url'], ""
+        logger.error("Ошибка VK API: Неизвестная ошибка")
+        return None, "Ошибка: Неизвестная ошибка"
+    except VkApiError as e:
+        logger.error(f"Ошибка VK API: {e.msg}")
+        return None, f"Ошибка: {e.msg}"
     except aiohttp.ClientError as e:
         logger.error(f"Ошибка при сокращении ссылки: {e}")
         return None, f"Не удалось сократить: {str(e)[:50]}"
 
 # Функция получения статистики по ссылке
+# Запросы одновременно открытых экранов склеиваются в один execute
 async def get_link_stats(key, date_from=None, date_to=None):
-    params = {"access_token": VK_TOKEN, "key": key, "v": "5.199", "extended": 1, "interval": "day"}
-    if date_from and date_to:
-        params.update({"date_from": date_from, "date_to": date_to})
     result = {"views": 0}  # Переименовано в views для точности
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                "https://api.vk.com/method/utils.getLinkStats",
-                params=params,
-                timeout=10
-            ) as resp:
-                data = await resp.json()
-                if "response" in data and "stats" in data["response"]:
-                    for period in data["response"]["stats"]:
-                        result["views"] += period.get("views", 0)
-                    return result
-                logger.error(f"Ошибка VK API: {data.get('error', 'Нет данных')}")
-                return result
+        data = await vk.get_link_stats(key, date_from, date_to)
+    except VkApiError as e:
+        logger.error(f"Ошибка VK API: {e}")
+        return result
     except aiohttp.ClientError as e:
         logger.error(f"Ошибка получения статистики: {e}")
         return result
+    if not data or "stats" not in data:
+        logger.error("Ошибка VK API: Нет данных")
+        return result
+    for period in data["stats"]:
+        result["views"] += period.get("views", 0)
+    return result
 
-# Создание клавиатуры
+# Создание клавиатуры; кнопки — пары (текст, callback_data)
 def make_kb(buttons, row_width=2):
-    keyboard = [buttons[i:i + row_width] for i in range(0, len(buttons), row_width)]
-    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+    return kbs.make_kb(buttons, row_width)
+
+# Главное меню собирается один раз
+main_menu_rows = layout([
+    ('🔗 Сократить ссылку', 'add_link'),
+    ('📊 Статистика переходов', 'stats'),
+    ('📋 Мои ссылки', 'list_links'),
+])
+main_menu = build_markup(main_menu_rows)
 
-# Главное меню
 def get_main_menu():
-    return make_kb([
-        InlineKeyboardButton(text='🔗 Сократить ссылку', callback_data='add_link'),
-        InlineKeyboardButton(text='📊 Статистика переходов', callback_data='stats'),
-        InlineKeyboardButton(text='📋 Мои ссылки', callback_data='list_links'),
-    ])
+    return main_menu
+
+# Страница списка ссылок: текст собирается одним join, над меню — кнопки ◀/▶
+async def render_links_page(uid, cursor=None, backward=False):
+    page = await storage.get_links_page(uid, cursor, backward)
+    if not page.items:
+        return "📋 У вас нет сохранённых ссылок", get_main_menu()
+    text = "📋 Ваши ссылки:\n\n" + "\n\n".join(
+        f"🔗 {link['title']}:\n{link['short']}\nСоздано: {link['created'][:19]}" for link in page.items
+    )
+    nav = []
+    if page.prev_cursor is not None:
+        nav.append(('◀ Назад', f'links_page:<{page.prev_cursor}'))
+    if page.next_cursor is not None:
+        nav.append(('Вперёд ▶', f'links_page:>{page.next_cursor}'))
+    return text, kbs.markup([nav, *main_menu_rows]) if nav else main_menu
 
 # Клавиатура отмены
-cancel_kb = make_kb([
-    InlineKeyboardButton(text='🚫 Отмена', callback_data='cancel')
-])
+cancel_kb = build_markup(layout([('🚫 Отмена', 'cancel')]))
 
-# Декоратор обработки ошибок
+# Декоратор обработки ошибок; wraps: aiogram берёт аргументы из сигнатуры
+# самого обработчика, метрики — его имя
 def handle_error(handler):
+    @functools.wraps(handler)
     async def wrapper(*args, **kwargs):
         try:
+            # Запросы к VK от этого пользователя встают в его очередь планировщика
+            current_user.set(args[0].from_user.id)
             return await handler(*args, **kwargs)
         except Exception as e:
             logger.error(f"Ошибка в {handler.__name__}: {e}")
@@ -183,15 +165,8 @@ async def cmd_start(message: types.Message, state: FSMContext):
 async def cmd_links(message: types.Message, state: FSMContext):
     logger.info(f"Получена команда /links от пользователя {message.from_user.id}")
     await state.clear()
-    uid = str(message.from_user.id)
-    links = storage.get_user_links(uid)
-    if not links:
-        await message.answer("📋 У вас нет сохранённых ссылок", reply_markup=get_main_menu())
-        return
-    text = "📋 Ваши ссылки:\n\n"
-    for link in links:
-        text += f"🔗 {link['title']}:\n{link['short']}\nСоздано: {link['created'][:19]}\n\n"
-    await message.answer(text, reply_markup=get_main_menu())
+    text, kb = await render_links_page(message.from_user.id)
+    await message.answer(text, reply_markup=kb)
 
 @router.callback_query(lambda c: c.data == "cancel")
 @handle_error
@@ -215,8 +190,8 @@ async def add_link(cb: types.CallbackQuery, state: FSMContext):
 @handle_error
 async def process_link(message: types.Message, state: FSMContext):
     url = message.text.strip()
-    if not await is_valid_url(url):
-        await message.answer("❌ Неверный или недоступный URL. Попробуйте снова (пример: https://example.com):", reply_markup=cancel_kb)
+    if not is_valid_url(url):
+        await message.answer("❌ Неверный URL. Попробуйте снова (пример: https://example.com):", reply_markup=cancel_kb)
         return
     loading_msg = await message.answer('⏳ Сокращаю...')
     short_url, error_msg = await shorten_link_vk(url)
@@ -243,7 +218,7 @@ async def process_title(message: types.Message, state: FSMContext):
         "original": data['original'],
         "created": datetime.now().isoformat()
     }
-    storage.add_link(uid, link_data)
+    await storage.add_link(uid, link_data)
     await message.answer(
         f"✅ Ссылка сохранена:\n<b>{title}</b>\n{data['short']}",
         parse_mode="HTML",
@@ -280,7 +255,7 @@ async def process_stats_date(message: types.Message, state: FSMContext):
         await message.answer("❌ Конечная дата не может быть раньше начальной", reply_markup=cancel_kb)
         return
     uid = str(message.from_user.id)
-    links = storage.get_user_links(uid)
+    links = await storage.get_user_links(uid)
     if not links:
         await message.answer("📋 У вас нет ссылок", reply_markup=get_main_menu())
         await state.clear()
@@ -304,21 +279,32 @@ async def process_stats_date(message: types.Message, state: FSMContext):
 @handle_error
 async def list_links(cb: types.CallbackQuery, state: FSMContext):
     await state.clear()
-    uid = str(cb.from_user.id)
-    links = storage.get_user_links(uid)
-    if not links:
-        await cb.message.edit_text("📋 У вас нет сохранённых ссылок", reply_markup=get_main_menu())
-        await cb.answer()
-        return
-    text = "📋 Ваши ссылки:\n\n"
-    for link in links:
-        text += f"🔗 {link['title']}:\n{link['short']}\nСоздано: {link['created'][:19]}\n\n"
-    await cb.message.edit_text(text, reply_markup=get_main_menu())
+    text, kb = await render_links_page(cb.from_user.id)
+    await cb.message.edit_text(text, reply_markup=kb)
+    await cb.answer()
+
+# Листание списка: links_page:>{cursor} — вперёд, links_page:<{cursor} — назад
+@router.callback_query(lambda c: c.data.startswith("links_page:"))
+@handle_error
+async def links_page(cb: types.CallbackQuery, state: FSMContext):
+    token = cb.data.split(':', 1)[1]
+    text, kb = await render_links_page(cb.from_user.id, int(token[1:]), token[0] == '<')
+    await cb.message.edit_text(text, reply_markup=kb)
     await cb.answer()
 
 async def main():
     logger.info("Запуск бота...")
+    await http.start()
     try:
+        dp.include_router(router)  # Подключаем роутер только здесь
+        # Разные пользователи обрабатываются параллельно, апдейты одного — по порядку
+        scheduler = setup_scheduler(dp)
+        setup_metrics(dp, scheduler, vk, short_cache=short_cache, reachability=reachability, keyboards=kbs)
+        await metrics.start()
+        if BOT_MODE == "webhook":
+            logger.info("Запуск в режиме webhook")
+            await run_webhook(dp, bot, scheduler)
+            return
         # Повторные попытки удаления webhook для устранения конфликтов
         for attempt in range(5):
             try:
@@ -332,15 +318,21 @@ async def main():
                 else:
                     logger.error("Не удалось удалить webhook после 5 попыток")
                     raise
-        dp.include_router(router)  # Подключаем роутер только здесь
         logger.info("Начинаем polling")
-        await dp.start_polling(bot, polling_timeout=20, handle_as_tasks=False)
+        await dp.start_polling(bot, polling_timeout=20, handle_as_tasks=True)
     except Exception as e:
         logger.error(f"Ошибка бота: {e}")
         raise
     finally:
         logger.info("Закрытие сессии бота")
+        await metrics.stop()
         await bot.session.close()
+        await http.close()
+        logger.info(f"Кэш коротких ссылок: {short_cache.stats()}")
+        logger.info(f"Проверка ссылок: {reachability.stats()}")
+        logger.info(f"Кэш клавиатур: {kbs.stats()}")
+        await storage.close()
+        await dp.storage.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -1,17 +1,33 @@
+import os
 import asyncio
 import datetime
+import functools
 import logging
 import re
-from urllib.parse import urlparse, quote
+from urllib.parse import urlparse
 import aiohttp
 from aiogram import Bot, Dispatcher, types, Router, F
 from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from bs4 import BeautifulSoup
 import sqlite3
+from http_client import http
+from vk_api import VkApi, VkApiError, current_user
+from stats_cache import StatsCache
+from storage import SqliteStorage
+from webhook import BOT_MODE, run_webhook
+from update_scheduler import setup_scheduler
+from fsm_storage import SqliteFsmStorage
+from bulk import BulkReport, prepare_urls, shorten_bulk
+from short_cache import ShortLinkCache
+from page_title import TitleFetcher
+from reachability import ReachabilityChecker
+from stats_warehouse import StatsWarehouse, link_key, STATS_TZ
+from stats_agg import summarize_link_stats
+from city_names import CityDirectory
+from callback_codec import pack, prefix, unpack
+from keyboards import KeyboardCache, build_markup, layout
+from metrics import metrics, setup_metrics
 
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -23,36 +39,23 @@ if not BOT_TOKEN or not VK_TOKEN:
     raise ValueError("BOT_TOKEN and VK_TOKEN must be set")
 
 bot = Bot(BOT_TOKEN)
-dp = Dispatcher(bot, storage=MemoryStorage())
+vk = VkApi(VK_TOKEN)
+dp = Dispatcher(storage=SqliteFsmStorage())
 router = Router()
 dp.include_router(router)
-stats_cache = {}
-
-class Database:
-    def __init__(self, db_name='links.db'):
-        try:
-            self._init_db()
-        except sqlite3.Error as e:
-            logger.error(f"DB init failed: {e}")
-            raise
-    def _init_db(self):
-        with sqlite3.connect(self.db_name) as conn:
-            c = conn.cursor()
-            c.execute('CREATE TABLE IF NOT EXISTS links (user_id TEXT, title TEXT, short TEXT, original TEXT, group_name TEXT, created TEXT)')
-            c.execute('CREATE TABLE IF NOT EXISTS groups (user_id TEXT, name TEXT)')
-            conn.commit()
-    def execute(self, query, params=()):
-        try:
-            with sqlite3.connect(self.db_name) as conn:
-                c = conn.cursor()
-                c.execute(query, params)
-                conn.commit()
-                return c.fetchall() if query.upper().startswith('SELECT') else c.rowcount
-        except sqlite3.Error as e:
-            logger.error(f"DB execute failed: {e}")
-            raise
-
-db = Database()
+stats_cache = StatsCache()
+
+db = SqliteStorage(os.getenv("DB_PATH", "links.db"))
+short_cache = ShortLinkCache(db.find_short)
+titles = TitleFetcher()
+reachability = ReachabilityChecker()
+warehouse = StatsWarehouse(db, vk)
+cities = CityDirectory(db, vk)
+kbs = KeyboardCache()
+# Сколько ждать заголовок после показа короткой ссылки, с
+TITLE_DEADLINE = float(os.getenv("TITLE_DEADLINE", "3"))
+# Ссылки на фоновые задачи, чтобы их не собрал сборщик мусора
+background_tasks = set()
 
 class LinkForm(StatesGroup):
     waiting_for_link = State()
@@ -67,9 +70,13 @@ class LinkForm(StatesGroup):
     confirm_delete_link = State()
     waiting_for_stats_date = State()
 
+# wraps: aiogram берёт аргументы из сигнатуры самого обработчика, метрики — его имя
 def handle_error(handler):
+    @functools.wraps(handler)
     async def wrapper(*args, **kwargs):
-        try: return await handler(*args, **kwargs)
+        try:
+            current_user.set(args[0].from_user.id)
+            return await handler(*args, **kwargs)
         except Exception as e:
             logger.error(f"Error in {handler.__name__}: {e}")
             reply = get_main_menu()
@@ -82,78 +89,144 @@ def handle_error(handler):
                 await args[0].answer(text, parse_mode="HTML", reply_markup=reply)
     return wrapper
 
+def format_failed(failed):
+    if not failed: return ''
+    return f"\n❌ {len(failed)}\n" + '\n'.join(f"🔗 {f['url']}: {f['error']}" for f in failed)
+
 def sanitize_input(text): return re.sub(r'[^\w\s-]', '', text.strip())[:100]
 
+# Перенос в папку только если папка принадлежит пользователю
+ASSIGN_GROUP_SQL = 'UPDATE links SET group_id = ? WHERE user_id = ? AND short = ? AND ? IN (SELECT id FROM groups WHERE user_id = ?)'
+
+def assign_params(uid, folder_id, short): return (folder_id, uid, short, folder_id, uid)
+
+# Действия кнопок (callback_codec): la — карточка ссылки, ls — её статистика,
+# lr — переименовать, lg — в папку, ld/lx — удалить (вопрос/удаление); fv —
+# папка, fs — статистика папки (0 — корень), fa/fb/fn — перенос в папку одной
+# ссылки, пакета и только что добавленной, fd/fx — удалить папку;
+# pl/ps — листание списка ссылок и выбора ссылки для статистики
+def cb_ids(cb): return unpack(cb.data)[1]
+
+# Ссылки корня (folder_id = 0) или папки по индексу (user_id, group_id, id)
+async def get_scope_links(uid, folder_id, columns='title, short, original'):
+    if not folder_id: return await db.execute(f'SELECT {columns} FROM links WHERE user_id = ? AND group_id IS NULL ORDER BY id', (uid,))
+    return await db.execute(f'SELECT {columns} FROM links WHERE user_id = ? AND group_id = ? ORDER BY id', (uid, folder_id))
+
+# Ссылка пользователя с её папкой — поиск по первичному ключу
+async def get_link(uid, link_id):
+    rows = await db.execute('SELECT l.title, l.short, l.original, l.group_id, g.name FROM links l LEFT JOIN groups g ON g.id = l.group_id WHERE l.id = ? AND l.user_id = ?', (link_id, uid))
+    if not rows: return None
+    title, short, original, folder_id, folder = rows[0]
+    return {'id': link_id, 'title': title, 'short': short, 'original': original, 'folder_id': folder_id or 0, 'folder': folder}
+
+# Папки пользователя (id, name) для клавиатур; при изменении папок — kbs.invalidate(uid)
+async def get_folders(uid):
+    return await kbs.user_data(uid, 'folders', lambda: db.execute('SELECT id, name FROM groups WHERE user_id = ? ORDER BY id', (uid,)))
+
+# Имя папки пользователя по id или None
+async def get_folder(uid, folder_id):
+    rows = await db.execute('SELECT name FROM groups WHERE id = ? AND user_id = ?', (folder_id, uid))
+    return rows[0][0] if rows else None
+
+def folder_back(folder_id): return pack('fv', folder_id) if folder_id else 'my_links'
+
+# Первая страница папки для подтверждений о переносе
+async def format_group_page(uid, folder_id):
+    page = await db.get_links_page(uid, folder=folder_id)
+    text = '\n'.join(f"🔗 {l['title']} → {l['short']}" for l in page.items) or '📚 Пусто.'
+    return text + ('\n…' if page.next_cursor is not None else '')
+
+# Страница списка ссылок. view 'pl' — корень (folder_id = 0) или папка,
+# кнопки действий с просмотрами (статистика грузится только для видимых
+# ссылок); 'ps' — все ссылки для выбора статистики. Листание:
+# pack(view, folder_id, cursor, backward)
+async def render_links_page(uid, view, folder_id=0, folder=None, cursor=None, backward=False):
+    page = await db.get_links_page(uid, cursor, backward, folder=None if view == 'ps' else folder_id)
+    if view == 'ps':
+        rows = [[(f"🔗 {l['title']}", pack('ls', l['id']))] for l in page.items]
+        text, extra = "🔗 Выберите ссылку:", [('🏠 Меню', 'menu')]
+    else:
+        stats = await get_stats_many([l['short'] for l in page.items]) if page.items else []
+        rows = [[(f"🔗 {l['title']} ({stats[i]['views']})", pack('la', l['id']))] for i, l in enumerate(page.items)]
+        if not folder_id:
+            text, extra = "🔗 Ссылки:\nВыберите:", [('📁 Папка', 'select_links_for_group'), ('🏠 Меню', 'menu')]
+        else:
+            text = f"📁 {folder}\n" + ('' if page.items else '📚 Пусто.')
+            extra = [('📊 Статистика', pack('fs', folder_id)), ('🏠 Меню', 'menu'), ('⬅ Назад', 'show_groups')]
+    nav = []
+    if page.prev_cursor is not None: nav.append(('◀', pack(view, folder_id, page.prev_cursor, 1)))
+    if page.next_cursor is not None: nav.append(('▶', pack(view, folder_id, page.next_cursor, 0)))
+    return page, text, kbs.markup([*rows, *([nav] if nav else []), extra])
+
 async def shorten_link_vk(url):
     if not is_valid_url(url): return None, "Недействительный URL."
-    encoded_url = quote(url, safe='')
-    for attempt in range(3):
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(f"https://api.vk.com/method/utils.getShortLink?url={encoded_url}&v=5.199&access_token={VK_TOKEN}", timeout=10) as resp:
-                    data = await resp.json()
-                    if 'response' in data and 'short_url' in data['response']: return data['response']['short_url'], ""
-                    if 'error' in data:
-                        error_code, error_msg = data['error'].get('error_code', 'Unknown'), data['error'].get('error_msg', 'Unknown')
-                        if error_code in [100, 5]: return None, f"Ошибка: {error_msg}"
-                        return None, f"Ошибка VK API: {error_msg}"
-        except aiohttp.ClientError as e:
-            if attempt == 2: return None, f"Не удалось сократить: {str(e)[:50]}"
-            await asyncio.sleep(2 ** attempt)
+    cached = await short_cache.get(url)
+    if cached: return cached, ""
+    try:
+        data = await vk.get_short_link(url)
+        if data and 'short_url' in data:
+            short_cache.set(url, data['short_url'])
+            return data['short_url'], ""
+    except VkApiError as e:
+        if e.code in [100, 5]: return None, f"Ошибка: {e.msg}"
+        return None, f"Ошибка VK API: {e.msg}"
+    except aiohttp.ClientError as e:
+        return None, f"Не удалось сократить: {str(e)[:50]}"
     return None, "Не удалось сократить после попыток."
 
 async def get_link_stats(key, date_from=None, date_to=None):
-    cache_key = f"{key}:{date_from}:{date_to}"
-    if cache_key in stats_cache and (datetime.datetime.now() - stats_cache.get(f"{cache_key}:time", 0)).seconds < 600:
-        return stats_cache[cache_key]
-    params = {"access_token": VK_TOKEN, "key": key, "v": "5.199", "extended": 1, "interval": "day"}
-    if date_from and date_to: params.update({"date_from": date_from, "date_to": date_to})
+    cached = stats_cache.get(key, date_from, date_to)
+    if cached is not None: return cached
     result = {"views": 0, "cities": {}}
-    for attempt in range(3):
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get("https://api.vk.com/method/utils.getLinkStats", params=params, timeout=10) as resp:
-                    data = await resp.json()
-                    if "response" in data and "stats" in data["response"]:
-                        for period in data["response"]["stats"]:
-                            result["views"] += period.get("views", 0)
-                            for city in period.get("cities", []): result["cities"][str(city.get("city_id"))] = result["cities"].get(str(city.get("city_id")), 0) + city.get("views", 0)
-                        stats_cache[cache_key] = result
-                        stats_cache[f"{cache_key}:time"] = datetime.datetime.now()
-                        return result
-                    if "error" in data: logger.error(f"VK API error: {data['error']}")
-        except aiohttp.ClientError as e:
-            if attempt == 2: return result
-            await asyncio.sleep(2 ** attempt)
+    try:
+        data = await vk.get_link_stats(key, date_from, date_to)
+    except VkApiError as e:
+        logger.error(f"VK API error: {e}")
+        return result
+    except aiohttp.ClientError as e:
+        logger.error(f"Failed to fetch link stats: {e}")
+        return result
+    if data and "stats" in data:
+        cities, daily = {}, {}
+        for period in data["stats"]:
+            result["views"] += period.get("views", 0)
+            if "timestamp" in period:
+                day = datetime.datetime.fromtimestamp(period["timestamp"], STATS_TZ).date().isoformat()
+                daily[day] = daily.get(day, 0) + period.get("views", 0)
+            for city in period.get("cities", []): cities[city.get("city_id")] = cities.get(city.get("city_id"), 0) + city.get("views", 0)
+        result["cities"] = {str(cid): views for cid, views in cities.items()}
+        result["daily"] = daily
+        stats_cache.set(key, date_from, date_to, result)
     return result
 
+# Статистика набора ссылок: из локального хранилища, а ссылки и периоды,
+# которых в нём нет (и всё без него), — живыми запросами к VK
+async def get_stats_many(shorts, date_from=None, date_to=None, daily=False):
+    if not warehouse.enabled: return await asyncio.gather(*(get_link_stats(link_key(short), date_from, date_to) for short in shorts))
+    stats = await warehouse.get_stats_many(shorts, date_from, date_to, daily)
+    missing = [i for i, s in enumerate(stats) if s is None]
+    live = await asyncio.gather(*(get_link_stats(link_key(shorts[i]), date_from, date_to) for i in missing))
+    for i, s in zip(missing, live): stats[i] = s
+    return stats
+
+# Сводка по набору ссылок: просмотры каждой, итог, топ городов
+async def get_stats_summary(shorts, date_from=None, date_to=None):
+    summary = await warehouse.get_summary(shorts, date_from, date_to) if warehouse.enabled else None
+    if summary is not None: return summary
+    return summarize_link_stats(await get_stats_many(shorts, date_from, date_to, daily=True))
+
+def format_cities(summary, city_names):
+    if not summary.top_cities: return "\n🏙 Нет данных."
+    text = "\n🏙 Города:\n" + '\n'.join(f'- {city_names.get(cid, "Неизв.")}: {views}' for cid, views in summary.top_cities)
+    if summary.city_count > len(summary.top_cities): text += f"\n… и ещё {summary.city_count - len(summary.top_cities)}"
+    return text
+
 async def get_city_names(city_ids):
     if not city_ids: return {}
-    cache_key = f"cities:{','.join(map(str, city_ids))}"
-    if cache_key in stats_cache: return stats_cache[cache_key]
-    params = {"access_token": VK_TOKEN, "city_ids": ",".join(map(str, city_ids)), "v": "5.199"}
-    result = {}
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get("https://api.vk.com/method/database.getCitiesById", params=params, timeout=10) as resp:
-                data = await resp.json()
-                if "response" in data: result.update({str(city["id"]): city.get("title", "Неизвестный город") for city in data["response"]})
-                stats_cache[cache_key] = result
-                return result
-    except aiohttp.ClientError as e:
-        logger.error(f"Failed to fetch city names: {e}")
-        return result
+    return await cities.get_names(city_ids)
 
 async def fetch_page_title(url):
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, timeout=10) as resp:
-                if resp.status != 200: return None
-                soup = BeautifulSoup(await resp.text(), 'html.parser')
-                return soup.title.string.strip() if soup.title else None
-    except Exception as e:
-        logger.error(f"Failed to fetch page title for {url}: {e}")
-        return None
+    return await titles.fetch(url)
 
 def is_valid_url(url):
     parsed = urlparse(url)
@@ -162,17 +235,21 @@ def is_valid_url(url):
 async def cleanup_chat(message, count=5):
     for i in range(count): await bot.delete_message(message.chat.id, message.message_id - i)
 
-def make_kb(buttons, row_width=2, extra_buttons=None):
-    keyboard = [buttons[i:i + row_width] for i in range(0, len(buttons), row_width)]
-    if extra_buttons: keyboard.append(extra_buttons[:row_width])
-    return InlineKeyboardMarkup(inline_keyboard=keyboard)
-
-def get_main_menu(): return make_kb([InlineKeyboardButton('🔗 Ссылки', callback_data='menu_links'), InlineKeyboardButton('📁 Папки', callback_data='menu_groups'), InlineKeyboardButton('📊 Статистика', callback_data='menu_stats'), InlineKeyboardButton('🗑 Очистить', callback_data='clear_all')])
-def get_links_menu(): return make_kb([InlineKeyboardButton('➕ Одна', callback_data='add_single'), InlineKeyboardButton('➕ Несколько', callback_data='add_bulk'), InlineKeyboardButton('📋 Мои', callback_data='my_links'), InlineKeyboardButton('🏠 Меню', callback_data='menu')], row_width=1)
-def get_groups_menu(): return make_kb([InlineKeyboardButton('➕ Создать', callback_data='create_group'), InlineKeyboardButton('📁 Показать', callback_data='show_groups'), InlineKeyboardButton('🗑 Удалить', callback_data='del_group'), InlineKeyboardButton('🏠 Меню', callback_data='menu')], row_width=1)
-def get_stats_menu(): return make_kb([InlineKeyboardButton('🔗 Все', callback_data='show_stats:root'), InlineKeyboardButton('📅 Период', callback_data='stats_by_date'), InlineKeyboardButton('🔗 Одна', callback_data='select_link_stats'), InlineKeyboardButton('📁 По папкам', callback_data='group_stats_select'), InlineKeyboardButton('🏠 Меню', callback_data='menu')], row_width=1)
-cancel_kb = make_kb([InlineKeyboardButton('🚫 Отмена', callback_data='cancel')], row_width=1)
-def get_post_add_menu(): return make_kb([InlineKeyboardButton('➕ Ещё', callback_data='add_single'), InlineKeyboardButton('📋 Мои', callback_data='my_links'), InlineKeyboardButton('📁 Папка', callback_data='ask_to_group'), InlineKeyboardButton('🏠 Меню', callback_data='menu')])
+# Кнопки — пары (текст, callback_data); одинаковые клавиатуры берутся из kbs
+def make_kb(buttons, row_width=2, extra_buttons=None): return kbs.make_kb(buttons, row_width, extra_buttons)
+
+# Постоянные меню собираются один раз при запуске
+main_menu = build_markup(layout([('🔗 Ссылки', 'menu_links'), ('📁 Папки', 'menu_groups'), ('📊 Статистика', 'menu_stats'), ('🗑 Очистить', 'clear_all')]))
+links_menu = build_markup(layout([('➕ Одна', 'add_single'), ('➕ Несколько', 'add_bulk'), ('📋 Мои', 'my_links'), ('🏠 Меню', 'menu')], row_width=1))
+groups_menu = build_markup(layout([('➕ Создать', 'create_group'), ('📁 Показать', 'show_groups'), ('🗑 Удалить', 'del_group'), ('🏠 Меню', 'menu')], row_width=1))
+stats_menu = build_markup(layout([('🔗 Все', pack('fs', 0)), ('📅 Период', 'stats_by_date'), ('🔗 Одна', 'select_link_stats'), ('📁 По папкам', 'group_stats_select'), ('🏠 Меню', 'menu')], row_width=1))
+cancel_kb = build_markup(layout([('🚫 Отмена', 'cancel')], row_width=1))
+post_add_menu = build_markup(layout([('➕ Ещё', 'add_single'), ('📋 Мои', 'my_links'), ('📁 Папка', 'ask_to_group'), ('🏠 Меню', 'menu')]))
+def get_main_menu(): return main_menu
+def get_links_menu(): return links_menu
+def get_groups_menu(): return groups_menu
+def get_stats_menu(): return stats_menu
+def get_post_add_menu(): return post_add_menu
 
 # Handlers
 @router.message(Command("start"))
@@ -234,7 +311,7 @@ async def menu_stats(cb: types.CallbackQuery, state: FSMContext):
 async def confirm_clear(cb: types.CallbackQuery, state: FSMContext):
     logger.info(f"Handling clear_all for user {cb.from_user.id}")
     await state.clear()
-    kb = make_kb([InlineKeyboardButton('✅ Да', callback_data='confirm_delete_all'), InlineKeyboardButton('🚫 Нет', callback_data='menu')])
+    kb = make_kb([('✅ Да', 'confirm_delete_all'), ('🚫 Нет', 'menu')])
     await cb.message.edit_text("⚠️ Удалить всё? Необратимо.", parse_mode="HTML", reply_markup=kb)
     await cb.answer()
 
@@ -242,37 +319,38 @@ async def confirm_clear(cb: types.CallbackQuery, state: FSMContext):
 @handle_error
 async def do_clear(cb: types.CallbackQuery, state: FSMContext):
     logger.info(f"Handling confirm_delete_all for user {cb.from_user.id}")
-    uid = str(cb.from_user.id)
-    db.execute('DELETE FROM links WHERE user_id = ?', (uid,))
-    db.execute('DELETE FROM groups WHERE user_id = ?', (uid,))
-    stats_cache.clear()
+    uid = cb.from_user.id
+    shorts = await db.execute('SELECT short FROM links WHERE user_id = ?', (uid,))
+    await db.transaction([('DELETE FROM links WHERE user_id = ?', (uid,)), ('DELETE FROM groups WHERE user_id = ?', (uid,))])
+    kbs.invalidate(uid)
+    for (short,) in shorts: stats_cache.invalidate(short.split('/')[-1])
     await cb.message.edit_text("✅ Всё удалено. Выберите:", parse_mode="HTML", reply_markup=get_main_menu())
     await cb.answer()
 
-@router.callback_query(F.data.startswith("show_stats:"))
+@router.callback_query(F.data.startswith(prefix('fs')))
 @handle_error
 async def show_stats(cb: types.CallbackQuery, state: FSMContext):
     logger.info(f"Handling show_stats for user {cb.from_user.id}, data={cb.data}")
     await state.clear()
+    uid, (folder_id,) = cb.from_user.id, cb_ids(cb)
+    folder = await get_folder(uid, folder_id) if folder_id else None
+    if folder_id and folder is None:
+        await cb.message.edit_text("❌ Папка не найдена.", parse_mode="HTML", reply_markup=get_stats_menu())
+        await cb.answer()
+        return
     loading_msg = await bot.send_message(cb.message.chat.id, '⏳ Загружаем...')
-    uid, scope = str(cb.from_user.id), cb.data.split(':')[1]
-    links = db.execute('SELECT title, short, original FROM links WHERE user_id = ? AND group_name IS NULL', (uid,)) if scope == 'root' else db.execute('SELECT title, short, original FROM links WHERE user_id = ? AND group_name = ?', (uid, scope))
-    text = f"📊 Статистика {'всех' if scope == 'root' else scope}\n"
+    links = await get_scope_links(uid, folder_id)
+    text = f"📊 Статистика {folder or 'всех'}\n"
     if not links:
         text += "👁 Нет данных."
-    # ❗ Некорректный else без if — пропущен
+    else:
         link_list = [{'title': r[0], 'short': r[1], 'original': r[2]} for r in links]
-        stats = await asyncio.gather(*(get_link_stats(l['short'].split('/')[-1]) for l in link_list))
-        all_cities = {cid: sum(s['cities'].get(cid, 0) for s in stats) for cid in {c for s in stats for c in s['cities']}}
-        city_names = await get_city_names(list(all_cities))
-        text += '\n'.join(f"🔗 {l['title']} ({l['short']}): {stats[i]['views']}" for i, l in enumerate(link_list))
-        text += f"\n👁 Всего: {sum(s['views'] for s in stats)}"
-        if all_cities:
-            city_lines = [f'- {city_names.get(cid, "Неизв.")}: {views}' for cid, views in all_cities.items()]
-            text += "\n🏙 Города:\n" + '\n'.join(city_lines)
-    # ❗ Некорректный else без if — пропущен
-            text += "\n🏙 Нет данных."
-    kb = make_kb([InlineKeyboardButton('🔗 Одна', callback_data='select_link_stats'), InlineKeyboardButton('🏠 Меню', callback_data='menu')])
+        summary = await get_stats_summary([l['short'] for l in link_list])
+        city_names = await get_city_names([cid for cid, _ in summary.top_cities])
+        text += '\n'.join(f"🔗 {l['title']} ({l['short']}): {summary.link_views[i]}" for i, l in enumerate(link_list))
+        text += f"\n👁 Всего: {summary.total}"
+        text += format_cities(summary, city_names)
+    kb = make_kb([('🔗 Одна', 'select_link_stats'), ('🏠 Меню', 'menu')])
     await loading_msg.delete()
     await cb.message.edit_text(text, parse_mode="HTML", reply_markup=kb)
     await cb.answer()
@@ -297,9 +375,9 @@ async def process_stats_date(message: types.Message, state: FSMContext):
         return
 
     date_from, date_to = dates
-    uid = str(message.from_user.id)
+    uid = message.from_user.id
 
-    links = db.execute('SELECT title, short FROM links WHERE user_id = ?', (uid,))
+    links = await db.execute('SELECT title, short FROM links WHERE user_id = ? ORDER BY id', (uid,))
     if not links:
         await message.answer("📋 Нет ссылок.", reply_markup=get_stats_menu())
         await state.clear()
@@ -307,29 +385,16 @@ async def process_stats_date(message: types.Message, state: FSMContext):
 
     loading_msg = await message.answer('⏳ Загружаем...')
 
-    stats = await asyncio.gather(
-        *(get_link_stats(l[1].split('/')[-1], date_from, date_to) for l in links)
-    )
-
-    all_cities = {
-        cid: sum(s['cities'].get(cid, 0) for s in stats)
-        for cid in {c for s in stats for c in s['cities']}
-    }
-
-    city_names = await get_city_names(list(all_cities))
+    summary = await get_stats_summary([l[1] for l in links], date_from, date_to)
+    city_names = await get_city_names([cid for cid, _ in summary.top_cities])
 
     text = f"📊 Статистика за {date_from}—{date_to}\n"
-    text += '\n'.join(f"🔗 {l[0]}: {stats[i]['views']}" for i, l in enumerate(links))
-    text += f"\n👁 Всего: {sum(s['views'] for s in stats)}"
-
-    if all_cities:
-        city_lines = [
-            f"- {city_names.get(cid, 'Неизв.')}: {views}"
-            for cid, views in all_cities.items()
-        ]
-        text += "\n🏙 Города:\n" + "\n".join(city_lines)
-    # ❗ Некорректный else без if — пропущен
-        text += "\n🏙 Нет данных."
+    text += '\n'.join(f"🔗 {l[0]}: {summary.link_views[i]}" for i, l in enumerate(links))
+    text += f"\n👁 Всего: {summary.total}"
+    if summary.daily:
+        best_day, best_views = max(summary.daily, key=lambda d: d[1])
+        text += f"\n📈 Лучший день: {best_day} ({best_views})"
+    text += format_cities(summary, city_names)
 
     await loading_msg.delete()
     await message.answer(text, parse_mode="HTML", reply_markup=get_stats_menu())
@@ -342,38 +407,36 @@ async def process_stats_date(message: types.Message, state: FSMContext):
 async def select_link_stats(cb: types.CallbackQuery, state: FSMContext):
     logger.info(f"Handling select_link_stats for user {cb.from_user.id}")
     await state.clear()
-    uid = str(cb.from_user.id)
-    links = db.execute('SELECT title, short FROM links WHERE user_id = ?', (uid,))
-    if not links:
+    page, text, kb = await render_links_page(cb.from_user.id, 'ps')
+    if not page.items:
         await cb.message.edit_text("📋 Нет ссылок.\nДобавьте через 'Ссылки'.", parse_mode="HTML", reply_markup=get_stats_menu())
         await cb.answer()
         return
-    buttons = [InlineKeyboardButton(f"🔗 {l[0]}", callback_data=f'single_link_stats:root:{i}') for i, l in enumerate(links)]
-    kb = make_kb(buttons, row_width=1, extra_buttons=[InlineKeyboardButton('🏠 Меню', callback_data='menu')])
-    await cb.message.edit_text("🔗 Выберите ссылку:", parse_mode="HTML", reply_markup=kb)
+    await cb.message.edit_text(text, parse_mode="HTML", reply_markup=kb)
     await cb.answer()
 
-@router.callback_query(F.data.startswith("single_link_stats:"))
+@router.callback_query(F.data.startswith(prefix('ls')))
 @handle_error
 async def single_link_stats(cb: types.CallbackQuery, state: FSMContext):
     logger.info(f"Handling single_link_stats for user {cb.from_user.id}, data={cb.data}")
     await state.clear()
+    link = await get_link(cb.from_user.id, cb_ids(cb)[0])
+    if not link:
+        await cb.message.edit_text("❌ Ссылка не найдена.", parse_mode="HTML", reply_markup=get_stats_menu())
+        await cb.answer()
+        return
     loading_msg = await bot.send_message(cb.message.chat.id, '⏳ Загружаем...')
-    _, scope, idx = cb.data.split(':')
-    idx = int(idx)
-    uid = str(cb.from_user.id)
-    links = db.execute('SELECT title, short, original FROM links WHERE user_id = ? AND group_name IS NULL', (uid,)) if scope == 'root' else db.execute('SELECT title, short, original FROM links WHERE user_id = ? AND group_name = ?', (uid, scope))
-    link = {'title': links[idx][0], 'short': links[idx][1], 'original': links[idx][2]}
-    stats = await get_link_stats(link['short'].split('/')[-1])
+    stats = (await get_stats_many([link['short']]))[0]
     city_names = await get_city_names(list(stats['cities'].keys()))
     text = f"📊 {link['title']}\n{link['short']}\n{link['original']}\n👁 {stats['views']}"
-    city_lines = [
-        f"- {city_names.get(cid, 'Неизв.')}: {views}"
-        for cid, views in stats['cities'].items()
-    ]
-    text += "\n🏙 " + "\n".join(city_lines)
+    if stats['cities']:
+        city_lines = [
+            f"- {city_names.get(cid, 'Неизв.')}: {views}"
+            for cid, views in stats['cities'].items()
+        ]
+        text += "\n🏙 " + "\n".join(city_lines)
     else: text += "\n🏙 Нет данных."
-    kb = make_kb([InlineKeyboardButton('🔄 Обновить', callback_data=f'single_link_stats:{scope}:{idx}'), InlineKeyboardButton('⬅ Назад', callback_data='select_link_stats'), InlineKeyboardButton('🏠 Меню', callback_data='menu')])
+    kb = make_kb([('🔄 Обновить', pack('ls', link['id'])), ('⬅ Назад', 'select_link_stats'), ('🏠 Меню', 'menu')])
     await loading_msg.delete()
     await cb.message.edit_text(text, parse_mode="HTML", reply_markup=kb)
     await cb.answer()
@@ -383,13 +446,13 @@ async def single_link_stats(cb: types.CallbackQuery, state: FSMContext):
 async def group_stats_select(cb: types.CallbackQuery, state: FSMContext):
     logger.info(f"Handling group_stats_select for user {cb.from_user.id}")
     await state.clear()
-    uid = str(cb.from_user.id)
-    groups = db.execute('SELECT name FROM groups WHERE user_id = ?', (uid,))
+    uid = cb.from_user.id
+    groups = await get_folders(uid)
     if not groups:
         await cb.message.edit_text("📁 Нет папок.\nСоздайте через 'Папки'.", parse_mode="HTML", reply_markup=get_stats_menu())
         await cb.answer()
         return
-    kb = make_kb([InlineKeyboardButton(f"📁 {g[0]}", callback_data=f'show_stats:{g[0]}') for g in groups], row_width=1, extra_buttons=[InlineKeyboardButton('🏠 Меню', callback_data='menu')])
+    kb = make_kb([(f"📁 {name}", pack('fs', gid)) for gid, name in groups], row_width=1, extra_buttons=[('🏠 Меню', 'menu')])
     await cb.message.edit_text("📊 Выберите папку:", parse_mode="HTML", reply_markup=kb)
     await cb.answer()
 
@@ -411,27 +474,79 @@ async def process_link(message: types.Message, state: FSMContext):
         await message.answer("❌ Неверный URL.\nПопробуйте снова:", reply_markup=cancel_kb)
         return
     loading_msg = await message.answer('⏳ Сокращаю...')
+    # TITLE_DEADLINE считается с момента запуска, а не после сокращения
+    deadline = asyncio.get_running_loop().time() + TITLE_DEADLINE
+    # Сокращение, заголовок и проверка доступности идут одновременно
+    title_task = asyncio.create_task(fetch_page_title(url))
+    reach_task = asyncio.create_task(reachability.check(url))
     short_url, error_msg = await shorten_link_vk(url)
-    title = await fetch_page_title(url)
     await loading_msg.delete()
     if not short_url:
+        title_task.cancel()
+        reach_task.cancel()
         await message.answer(f"❌ Ошибка: {error_msg}", reply_markup=cancel_kb)
         return
-    await state.update_data(original=url, short=short_url, suggested_title=title)
-    buttons = [InlineKeyboardButton('✏️ Название', callback_data='enter_title'), InlineKeyboardButton('🚫 Отмена', callback_data='cancel')]
-    if title: buttons.insert(0, InlineKeyboardButton('✅ Использовать', callback_data='use_suggested_title'))
-    await message.answer(f"🔗 {short_url}\nНазвание: \"{title or 'Нет'}\"", parse_mode="HTML", reply_markup=make_kb(buttons))
+    await state.update_data(original=url, short=short_url, suggested_title=None)
+    # Упавшая проверка или заголовок — не повод показывать ошибку для уже сохранённой
+    # ссылки: такие случаи разбирает finish_link_preview (проверка считается пройденной)
+    ready = title_task.done() and reach_task.done() and not title_task.exception() and not reach_task.exception()
+    if ready and reach_task.result()[0]:
+        title = title_task.result()
+        await message.answer(f"🔗 {short_url}\nНазвание: \"{title or 'Нет'}\"", parse_mode="HTML", reply_markup=get_title_kb(title))
+        await state.update_data(suggested_title=title)
+    else:
+        preview = await message.answer(f"🔗 {short_url}\nНазвание: ⏳", parse_mode="HTML", reply_markup=get_title_kb(None))
+        # Дожидаемся в фоне: пока обработчик занят, остальные апдейты пользователя стоят в очереди
+        task = asyncio.create_task(finish_link_preview(preview, state, url, short_url, title_task, reach_task, deadline))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
     await cleanup_chat(message, 2)
 
+def get_title_kb(title):
+    buttons = [('✏️ Название', 'enter_title'), ('🚫 Отмена', 'cancel')]
+    if title: buttons.insert(0, ('✅ Использовать', 'use_suggested_title'))
+    return make_kb(buttons)
+
+# Дописывает превью ссылки, когда придёт заголовок (или наступит deadline);
+# недоступный адрес отменяет добавление. Задача идёт мимо очереди апдейтов,
+# поэтому проверка «пользователь ещё ждёт эту ссылку» и запись делаются одной
+# транзакцией хранилища FSM; если он уже нажал кнопку, превью не трогаем
+async def finish_link_preview(preview, state, url, short_url, title_task, reach_task, deadline):
+    try:
+        title = await asyncio.wait_for(title_task, max(0.0, deadline - asyncio.get_running_loop().time()))
+    except asyncio.TimeoutError:
+        logger.info(f"Title for {url} missed the deadline")
+        title = None
+    except Exception as e:
+        logger.error(f"Title fetch failed for {url}: {e}")
+        title = None
+    try:
+        reachable, reason = await reach_task
+    except Exception as e:
+        logger.error(f"Reachability check failed for {url}: {e}")
+        reachable, reason = True, ""
+    guard = {'short': short_url}
+    try:
+        if not reachable:
+            if await state.storage.update_if(state.key, LinkForm.waiting_for_link, guard, clear=True):
+                await preview.edit_text(f"❌ Недоступный URL: {reason}\n{url}", parse_mode="HTML", reply_markup=get_links_menu())
+            return
+        if not await state.storage.update_if(state.key, LinkForm.waiting_for_link, guard, {'suggested_title': title}):
+            return
+        await preview.edit_text(f"🔗 {short_url}\nНазвание: \"{title or 'Нет'}\"", parse_mode="HTML", reply_markup=get_title_kb(title))
+    except Exception as e:
+        logger.error(f"Failed to update link preview: {e}")
+
 @router.callback_query(F.data == "use_suggested_title")
 @handle_error
 async def use_suggested_title(cb: types.CallbackQuery, state: FSMContext):
     logger.info(f"Handling use_suggested_title for user {cb.from_user.id}")
     data = await state.get_data()
     title = sanitize_input(data.get('suggested_title') or data['original'][:50])
-    uid = str(cb.from_user.id)
-    db.execute('INSERT INTO links (user_id, title, short, original, created) VALUES (?, ?, ?, ?, ?)', (uid, title, data['short'], data['original'], datetime.datetime.now().isoformat()))
-    stats_cache.pop(data['short'].split('/')[-1], None)
+    uid = cb.from_user.id
+    await db.insert_link(uid, title, data['short'], data['original'])
+    warehouse.request_sync([data['short']])
+    stats_cache.invalidate(data['short'].split('/')[-1])
     await cb.message.edit_text(f"✅ {title}\n{data['short']}\nЧто дальше?", parse_mode="HTML", reply_markup=get_post_add_menu())
     await state.update_data(last_added_entry={'title': title, 'short': data['short'], 'original': data['original']})
     await state.set_state(LinkForm.choosing_group)
@@ -454,9 +569,10 @@ async def process_title(message: types.Message, state: FSMContext):
         await message.answer("❌ Недействительно.\nПопробуйте снова:", reply_markup=cancel_kb)
         return
     data = await state.get_data()
-    uid = str(message.from_user.id)
-    db.execute('INSERT INTO links (user_id, title, short, original, created) VALUES (?, ?, ?, ?, ?)', (uid, title, data['short'], data['original'], datetime.datetime.now().isoformat()))
-    stats_cache.pop(data['short'].split('/')[-1], None)
+    uid = message.from_user.id
+    await db.insert_link(uid, title, data['short'], data['original'])
+    warehouse.request_sync([data['short']])
+    stats_cache.invalidate(data['short'].split('/')[-1])
     await message.answer(f"✅ {title}\n{data['short']}\nЧто дальше?", parse_mode="HTML", reply_markup=get_post_add_menu())
     await state.update_data(last_added_entry={'title': title, 'short': data['short'], 'original': data['original']})
     await cleanup_chat(message, 2)
@@ -475,13 +591,16 @@ async def add_bulk(cb: types.CallbackQuery, state: FSMContext):
 @handle_error
 async def process_bulk_links(message: types.Message, state: FSMContext):
     logger.info(f"Processing bulk links from user {message.from_user.id}")
-    valid = [l.strip() for l in message.text.splitlines() if l.strip() and is_valid_url(l)]
-    if not valid:
+    prepared = prepare_urls(message.text, is_valid_url)
+    if not prepared.urls:
         await message.answer("❌ Нет валидных ссылок.", reply_markup=cancel_kb)
         return
-    await state.update_data(bulk_links=valid, success=[], failed=[])
-    kb = make_kb([InlineKeyboardButton('📝 Вручную', callback_data='bulk_enter_titles'), InlineKeyboardButton('🔗 URL', callback_data='bulk_use_url'), InlineKeyboardButton('🚫 Отмена', callback_data='cancel')])
-    await message.answer(f"✅ {len(valid)} ссылок.\nВыберите способ:", parse_mode="HTML", reply_markup=kb)
+    await state.update_data(bulk_links=prepared.urls, success=[], failed=[])
+    kb = make_kb([('📝 Вручную', 'bulk_enter_titles'), ('🔗 URL', 'bulk_use_url'), ('🚫 Отмена', 'cancel')])
+    text = f"✅ {len(prepared.urls)} ссылок."
+    if prepared.duplicates: text += f"\n♻️ Повторов пропущено: {prepared.duplicates}"
+    if prepared.invalid: text += f"\n⚠️ Невалидных пропущено: {len(prepared.invalid)}"
+    await message.answer(f"{text}\nВыберите способ:", parse_mode="HTML", reply_markup=kb)
     await cleanup_chat(message)
 
 @router.callback_query(F.data == "bulk_use_url")
@@ -489,18 +608,22 @@ async def process_bulk_links(message: types.Message, state: FSMContext):
 async def bulk_use_url(cb: types.CallbackQuery, state: FSMContext):
     logger.info(f"Handling bulk_use_url for user {cb.from_user.id}")
     data = await state.get_data()
-    uid = str(cb.from_user.id)
+    uid = cb.from_user.id
     loading_msg = await bot.send_message(cb.message.chat.id, '⏳ Обрабатываем...')
-    for url in data['bulk_links']:
-        short, error_msg = await shorten_link_vk(url)
-        if short: db.execute('INSERT INTO links (user_id, title, short, original, created) VALUES (?, ?, ?, ?, ?)', (uid, url[:50], short, url, datetime.datetime.now().isoformat()))
-        else: data['failed'].append({'url': url, 'error': error_msg})
+
+    async def progress(done, total):
+        await loading_msg.edit_text(f'⏳ Обрабатываем... {done}/{total}')
+
+    result = await shorten_bulk(BulkReport(data['bulk_links']), shorten_link_vk, progress)
+    if result.success:
+        await db.insert_links(uid, result.success)
+        warehouse.request_sync([entry['short'] for entry in result.success])
+    logger.info(f"Bulk for user {uid}: {len(result.success)} ok, {len(result.failed)} failed in {result.elapsed:.1f}s")
     await loading_msg.delete()
-    report = f"✅ Обработано: {len(data['bulk_links']) - len(data.get('failed', []))}"
-    if data.get('failed'): report += f"\n❌ {len(data['failed'])}\n{'\n'.join(f'🔗 {f['url']}: {f['error']}' for f in data['failed'])}"
-    kb = make_kb([InlineKeyboardButton('📁 Папка', callback_data='bulk_to_group'), InlineKeyboardButton('🏠 Меню', callback_data='menu')])
+    report = f"✅ Обработано: {len(result.success)}" + format_failed(result.failed)
+    kb = make_kb([('📁 Папка', 'bulk_to_group'), ('🏠 Меню', 'menu')])
     await cb.message.edit_text(f"{report}\nЧто дальше?", parse_mode="HTML", reply_markup=kb)
-    await state.update_data(failed=data.get('failed', []))
+    await state.update_data(success=result.success, failed=result.failed)
     await state.set_state(LinkForm.bulk_to_group)
     await cb.answer()
 
@@ -526,21 +649,22 @@ async def process_bulk_titles(message: types.Message, state: FSMContext):
         await message.answer(f"❌ Недействительно.\n{url}\nПопробуйте:", reply_markup=cancel_kb)
         return
     loading_msg = await message.answer('⏳ Обрабатываем...')
-    uid = str(message.from_user.id)
+    uid = message.from_user.id
     short, error_msg = await shorten_link_vk(url)
     if short:
-        db.execute('INSERT INTO links (user_id, title, short, original, created) VALUES (?, ?, ?, ?, ?)', (uid, title, short, url, datetime.datetime.now().isoformat()))
+        await db.insert_link(uid, title, short, url)
+        warehouse.request_sync([short])
         data['success'].append({'title': title, 'short': short, 'original': url})
-    # ❗ Некорректный else без if — пропущен
+    else:
+        data['failed'].append({'url': url, 'error': error_msg})
     await loading_msg.delete()
     idx += 1
     if idx < len(data['bulk_links']):
         await state.update_data(bulk_index=idx)
         await message.answer(f"✏️ {idx+1}/{len(data['bulk_links'])}\n{data['bulk_links'][idx]}\nВведите:", parse_mode="HTML", reply_markup=cancel_kb)
-    # ❗ Некорректный else без if — пропущен
-        report = f"✅ {len(data['success'])}\n{'\n'.join(f'🔗 {s['title']} → {s['short']}' for s in data['success'])}"
-        if data.get('failed'): report += f"\n❌ {len(data['failed'])}\n{'\n'.join(f'🔗 {f['url']}: {f['error']}' for f in data['failed'])}"
-        kb = make_kb([InlineKeyboardButton('📁 Папка', callback_data='bulk_to_group'), InlineKeyboardButton('🏠 Меню', callback_data='menu')])
+    else:
+        report = f"✅ {len(data['success'])}\n" + '\n'.join(f"🔗 {s['title']} → {s['short']}" for s in data['success']) + format_failed(data['failed'])
+        kb = make_kb([('📁 Папка', 'bulk_to_group'), ('🏠 Меню', 'menu')])
         await message.answer(f"{report}\nЧто дальше?", parse_mode="HTML", reply_markup=kb)
         await cleanup_chat(message, 2)
     await state.update_data(success=data.get('success', []), failed=data.get('failed', []))
@@ -549,13 +673,13 @@ async def process_bulk_titles(message: types.Message, state: FSMContext):
 @handle_error
 async def bulk_to_group(cb: types.CallbackQuery, state: FSMContext):
     logger.info(f"Handling bulk_to_group for user {cb.from_user.id}")
-    uid = str(cb.from_user.id)
-    groups = db.execute('SELECT name FROM groups WHERE user_id = ?', (uid,))
+    uid = cb.from_user.id
+    groups = await get_folders(uid)
     if not groups:
         await cb.message.edit_text("❌ Нет папок.\nСоздайте.", parse_mode="HTML", reply_markup=get_groups_menu())
         await state.clear()
         return
-    kb = make_kb([InlineKeyboardButton(f"📁 {g[0]}", callback_data=f'bulk_assign:{g[0]}') for g in groups], row_width=1, extra_buttons=[InlineKeyboardButton('➕ Новая', callback_data='create_group_in_flow'), InlineKeyboardButton('🚫 Пропустить', callback_data='bulk_skip_group'), InlineKeyboardButton('🏠 Меню', callback_data='menu')])
+    kb = make_kb([(f"📁 {name}", pack('fb', gid)) for gid, name in groups], row_width=1, extra_buttons=[('➕ Новая', 'create_group_in_flow'), ('🚫 Пропустить', 'bulk_skip_group'), ('🏠 Меню', 'menu')])
     await cb.message.edit_text("📁 Выберите папку:", parse_mode="HTML", reply_markup=kb)
     await state.set_state(LinkForm.bulk_to_group)
     await cb.answer()
@@ -568,23 +692,22 @@ async def bulk_skip_group(cb: types.CallbackQuery, state: FSMContext):
     await state.clear()
     await cb.answer()
 
-@router.callback_query(F.data.startswith("bulk_assign:"))
+@router.callback_query(F.data.startswith(prefix('fb')))
 @handle_error
 async def bulk_assign_to_group(cb: types.CallbackQuery, state: FSMContext):
     logger.info(f"Handling bulk_assign for user {cb.from_user.id}, data={cb.data}")
-    group_name = cb.data.split(':')[1]
+    folder_id = cb_ids(cb)[0]
     data = await state.get_data()
-    uid = str(cb.from_user.id)
+    uid = cb.from_user.id
     success = data.get('success', [])
-    if not success:
-        await cb.message.edit_text("❌ Нет ссылок.", parse_mode="HTML", reply_markup=get_links_menu())
+    group_name = await get_folder(uid, folder_id)
+    if not success or group_name is None:
+        await cb.message.edit_text("❌ Нет ссылок." if not success else "❌ Папка не найдена.", parse_mode="HTML", reply_markup=get_links_menu())
         await state.clear()
         return
-    updated = sum(db.execute('UPDATE links SET group_name = ? WHERE user_id = ? AND short = ?', (group_name, uid, entry['short'])) for entry in success)
-    text = f"✅ {updated} в \"{group_name}\"\n"
-    links = db.execute('SELECT title, short FROM links WHERE user_id = ? AND group_name = ?', (uid, group_name))
-    text += '\n'.join(f"🔗 {l[0]} → {l[1]}" for l in links) or '📚 Пусто.'
-    kb = make_kb([InlineKeyboardButton('📁 Папки', callback_data='menu_groups'), InlineKeyboardButton('🏠 Меню', callback_data='menu')])
+    updated = await db.executemany(ASSIGN_GROUP_SQL, [assign_params(uid, folder_id, entry['short']) for entry in success])
+    text = f"✅ {updated} в \"{group_name}\"\n" + await format_group_page(uid, folder_id)
+    kb = make_kb([('📁 Папки', 'menu_groups'), ('🏠 Меню', 'menu')])
     await cb.message.edit_text(text, parse_mode="HTML", reply_markup=kb)
     await state.clear()
     await cb.answer()
@@ -594,82 +717,85 @@ async def bulk_assign_to_group(cb: types.CallbackQuery, state: FSMContext):
 async def my_links(cb: types.CallbackQuery, state: FSMContext):
     logger.info(f"Handling my_links for user {cb.from_user.id}")
     await state.clear()
-    uid = str(cb.from_user.id)
-    links = db.execute('SELECT title, short, original FROM links WHERE user_id = ? AND group_name IS NULL', (uid,))
-    if not links:
+    page, text, kb = await render_links_page(cb.from_user.id, 'pl')
+    if not page.items:
         await cb.message.edit_text("📋 Нет ссылок.\nДобавьте.", parse_mode="HTML", reply_markup=get_links_menu())
         await cb.answer()
         return
-    link_list = [{'title': r[0], 'short': r[1], 'original': r[2]} for r in links]
-    stats = await asyncio.gather(*(get_link_stats(l['short'].split('/')[-1]) for l in link_list))
-    buttons = [InlineKeyboardButton(f"🔗 {l['title']} ({stats[i]['views']})", callback_data=f'link_action:root:{i}') for i, l in enumerate(link_list)]
-    kb = make_kb(buttons, row_width=1, extra_buttons=[InlineKeyboardButton('📁 Папка', callback_data='select_links_for_group'), InlineKeyboardButton('🏠 Меню', callback_data='menu')])
-    await cb.message.edit_text("🔗 Ссылки:\nВыберите:", parse_mode="HTML", reply_markup=kb)
+    await cb.message.edit_text(text, parse_mode="HTML", reply_markup=kb)
     await cb.answer()
 
-@router.callback_query(F.data.startswith("link_action:"))
+@router.callback_query(F.data.startswith(prefix('pl')) | F.data.startswith(prefix('ps')))
+@handle_error
+async def links_page(cb: types.CallbackQuery, state: FSMContext):
+    logger.info(f"Handling links_page for user {cb.from_user.id}, data={cb.data}")
+    view, (folder_id, cursor, backward) = unpack(cb.data)
+    uid = cb.from_user.id
+    folder = await get_folder(uid, folder_id) if folder_id else None
+    _, text, kb = await render_links_page(uid, view, folder_id, folder, cursor, bool(backward))
+    await cb.message.edit_text(text, parse_mode="HTML", reply_markup=kb)
+    await cb.answer()
+
+@router.callback_query(F.data.startswith(prefix('la')))
 @handle_error
 async def link_action(cb: types.CallbackQuery, state: FSMContext):
     logger.info(f"Handling link_action for user {cb.from_user.id}, data={cb.data}")
     await state.clear()
-    _, scope, idx = cb.data.split(':')
-    idx = int(idx)
-    uid = str(cb.from_user.id)
-    links = db.execute('SELECT title, short, original, group_name FROM links WHERE user_id = ? AND group_name IS NULL', (uid,)) if scope == 'root' else db.execute('SELECT title, short, original, group_name FROM links WHERE user_id = ? AND group_name = ?', (uid, scope))
-    link = {'title': links[idx][0], 'short': links[idx][1], 'original': links[idx][2], 'group_name': links[idx][3]}
-    back_data = 'my_links' if scope == 'root' else f'view_group:{scope}'
-    path = '🔗 Ссылки' if scope == 'root' else f'📁 {scope}'
-    kb = make_kb([InlineKeyboardButton('📊 Статистика', callback_data=f'single_link_stats:{scope}:{idx}'), InlineKeyboardButton('✍ Переименовать', callback_data=f'rename:{scope}:{idx}'), InlineKeyboardButton('🗑 Удалить', callback_data=f'confirm_delete:{scope}:{idx}'), InlineKeyboardButton('📁 Папка', callback_data=f'togroup:{scope}:{idx}'), InlineKeyboardButton('🏠 Меню', callback_data='menu'), InlineKeyboardButton('⬅ Назад', callback_data=back_data)])
+    link = await get_link(cb.from_user.id, cb_ids(cb)[0])
+    if not link:
+        await cb.message.edit_text("❌ Ссылка не найдена.", parse_mode="HTML", reply_markup=get_links_menu())
+        await cb.answer()
+        return
+    link_id = link['id']
+    path = f"📁 {link['folder']}" if link['folder_id'] else '🔗 Ссылки'
+    kb = make_kb([('📊 Статистика', pack('ls', link_id)), ('✍ Переименовать', pack('lr', link_id)), ('🗑 Удалить', pack('ld', link_id)), ('📁 Папка', pack('lg', link_id)), ('🏠 Меню', 'menu'), ('⬅ Назад', folder_back(link['folder_id']))])
     await cb.message.edit_text(f"{path}\n🔗 {link['title']}\n{link['short']}\n{link['original']}\nВыберите:", parse_mode="HTML", reply_markup=kb)
     await cb.answer()
 
-@router.callback_query(F.data.startswith("togroup:"))
+@router.callback_query(F.data.startswith(prefix('lg')))
 @handle_error
 async def togroup(cb: types.CallbackQuery, state: FSMContext):
     logger.info(f"Handling togroup for user {cb.from_user.id}, data={cb.data}")
     await state.clear()
-    _, scope, idx = cb.data.split(':')
-    idx = int(idx)
-    uid = str(cb.from_user.id)
-    links = db.execute('SELECT title, short, original FROM links WHERE user_id = ? AND group_name IS NULL', (uid,)) if scope == 'root' else db.execute('SELECT title, short, original FROM links WHERE user_id = ? AND group_name = ?', (uid, scope))
-    link = {'title': links[idx][0], 'short': links[idx][1], 'original': links[idx][2]}
-    groups = db.execute('SELECT name FROM groups WHERE user_id = ?', (uid,))
+    uid = cb.from_user.id
+    link = await get_link(uid, cb_ids(cb)[0])
+    if not link:
+        await cb.message.edit_text("❌ Ссылка не найдена.", parse_mode="HTML", reply_markup=get_links_menu())
+        await cb.answer()
+        return
+    groups = await get_folders(uid)
     if not groups:
         await cb.message.edit_text("❌ Нет папок.\nСоздайте.", parse_mode="HTML", reply_markup=get_groups_menu())
         await state.clear()
         return
-    await state.update_data(togroup_link=link)
-    kb = make_kb([InlineKeyboardButton(f"📁 {g[0]}", callback_data=f'assign:{g[0]}') for g in groups], row_width=1, extra_buttons=[InlineKeyboardButton('➕ Новая', callback_data='create_group_in_flow'), InlineKeyboardButton('🚫 Отмена', callback_data='cancel')])
+    await state.update_data(togroup_link={'title': link['title'], 'short': link['short'], 'original': link['original']})
+    kb = make_kb([(f"📁 {name}", pack('fa', gid)) for gid, name in groups], row_width=1, extra_buttons=[('➕ Новая', 'create_group_in_flow'), ('🚫 Отмена', 'cancel')])
     await cb.message.edit_text(f"📁 Куда \"{link['title']}\"?", parse_mode="HTML", reply_markup=kb)
     await state.set_state(LinkForm.choosing_group)
     await cb.answer()
 
-@router.callback_query(F.data.startswith("assign:"))
+@router.callback_query(F.data.startswith(prefix('fa')))
 @handle_error
 async def assign_to_group_single(cb: types.CallbackQuery, state: FSMContext):
     logger.info(f"Handling assign for user {cb.from_user.id}, data={cb.data}")
-    group_name = cb.data.split(':')[1]
+    folder_id = cb_ids(cb)[0]
     data = await state.get_data()
     link = data.get('togroup_link')
     if not link:
         await cb.message.edit_text("❌ Ссылка не найдена.", parse_mode="HTML", reply_markup=get_links_menu())
         await state.clear()
         return
-    uid = str(cb.from_user.id)
+    uid = cb.from_user.id
     try:
-        with sqlite3.connect(db.db_name) as conn:
-            c = conn.cursor()
-            c.execute('UPDATE links SET group_name = ? WHERE user_id = ? AND short = ?', (group_name, uid, link['short']))
-            conn.commit()
-            if c.rowcount == 0: raise ValueError
+        group_name = await get_folder(uid, folder_id)
+        if group_name is None or await db.execute(ASSIGN_GROUP_SQL, assign_params(uid, folder_id, link['short'])) == 0: raise ValueError
     except Exception as e:
         logger.error(f"Error assigning link: {e}")
         await cb.message.edit_text("❌ Ошибка.", parse_mode="HTML", reply_markup=get_links_menu())
         await state.clear()
         return
-    links = db.execute('SELECT title, short FROM links WHERE user_id = ? AND group_name = ?', (uid, group_name))
-    text = f"✅ В \"{group_name}\"\n{'\n'.join(f'🔗 {l[0]} → {l[1]}' for l in links) or '📚 Пусто.'}"
-    kb = make_kb([InlineKeyboardButton('📁 Папки', callback_data='menu_groups'), InlineKeyboardButton('🏠 Меню', callback_data='menu')])
+    text = f"✅ В \"{group_name}\"\n" + await format_group_page(uid, folder_id)
+    kb = make_kb([('📁 Папки', 'menu_groups'), ('🏠 Меню', 'menu')])
     await cb.message.edit_text(text, parse_mode="HTML", reply_markup=kb)
     await state.clear()
     await cb.answer()
@@ -678,18 +804,18 @@ async def assign_to_group_single(cb: types.CallbackQuery, state: FSMContext):
 @handle_error
 async def ask_to_group(cb: types.CallbackQuery, state: FSMContext):
     logger.info(f"Handling ask_to_group for user {cb.from_user.id}")
-    uid = str(cb.from_user.id)
+    uid = cb.from_user.id
     data = await state.get_data()
     if not data.get('last_added_entry'):
         await cb.message.edit_text("❌ Ссылка не найдена.", parse_mode="HTML", reply_markup=get_links_menu())
         await state.clear()
         return
-    groups = db.execute('SELECT name FROM groups WHERE user_id = ?', (uid,))
+    groups = await get_folders(uid)
     if not groups:
         await cb.message.edit_text("❌ Нет папок.\nСоздайте.", parse_mode="HTML", reply_markup=get_groups_menu())
         await state.clear()
         return
-    kb = make_kb([InlineKeyboardButton(f"📁 {g[0]}", callback_data=f'single_assign:{g[0]}') for g in groups], row_width=1, extra_buttons=[InlineKeyboardButton('➕ Новая', callback_data='create_group_in_flow'), InlineKeyboardButton('🚫 Пропустить', callback_data='skip_group'), InlineKeyboardButton('🏠 Меню', callback_data='menu')])
+    kb = make_kb([(f"📁 {name}", pack('fn', gid)) for gid, name in groups], row_width=1, extra_buttons=[('➕ Новая', 'create_group_in_flow'), ('🚫 Пропустить', 'skip_group'), ('🏠 Меню', 'menu')])
     await cb.message.edit_text("📁 В папку?\nВыберите:", parse_mode="HTML", reply_markup=kb)
     await cb.answer()
 
@@ -701,32 +827,28 @@ async def skip_group(cb: types.CallbackQuery, state: FSMContext):
     await state.clear()
     await cb.answer()
 
-@router.callback_query(F.data.startswith("single_assign:"))
+@router.callback_query(F.data.startswith(prefix('fn')))
 @handle_error
 async def single_assign_to_group(cb: types.CallbackQuery, state: FSMContext):
     logger.info(f"Handling single_assign for user {cb.from_user.id}, data={cb.data}")
-    group_name = cb.data.split(':')[1]
+    folder_id = cb_ids(cb)[0]
     data = await state.get_data()
     entry = data.get('last_added_entry')
     if not entry:
         await cb.message.edit_text("❌ Ссылка не найдена.", parse_mode="HTML", reply_markup=get_links_menu())
         await state.clear()
         return
-    uid = str(cb.from_user.id)
+    uid = cb.from_user.id
     try:
-        with sqlite3.connect(db.db_name) as conn:
-            c = conn.cursor()
-            c.execute('UPDATE links SET group_name = ? WHERE user_id = ? AND short = ?', (group_name, uid, entry['short']))
-            conn.commit()
-            if c.rowcount == 0: raise ValueError
+        group_name = await get_folder(uid, folder_id)
+        if group_name is None or await db.execute(ASSIGN_GROUP_SQL, assign_params(uid, folder_id, entry['short'])) == 0: raise ValueError
     except Exception as e:
         logger.error(f"Error assigning single link: {e}")
         await cb.message.edit_text("❌ Ошибка.", parse_mode="HTML", reply_markup=get_links_menu())
         await state.clear()
         return
-    links = db.execute('SELECT title, short FROM links WHERE user_id = ? AND group_name = ?', (uid, group_name))
-    text = f"✅ В \"{group_name}\"\n{'\n'.join(f'🔗 {l[0]} → {l[1]}' for l in links) or '📚 Пусто.'}"
-    kb = make_kb([InlineKeyboardButton('📁 Папки', callback_data='menu_groups'), InlineKeyboardButton('🏠 Меню', callback_data='menu')])
+    text = f"✅ В \"{group_name}\"\n" + await format_group_page(uid, folder_id)
+    kb = make_kb([('📁 Папки', 'menu_groups'), ('🏠 Меню', 'menu')])
     await cb.message.edit_text(text, parse_mode="HTML", reply_markup=kb)
     await state.clear()
     await cb.answer()
@@ -747,22 +869,20 @@ async def process_create_group(message: types.Message, state: FSMContext):
     if not name:
         await message.answer("❌ Некорректно.\nПопробуйте:", reply_markup=cancel_kb)
         return
-    uid = str(message.from_user.id)
-    if any(g[0] == name for g in db.execute('SELECT name FROM groups WHERE user_id = ?', (uid,))):
+    uid = message.from_user.id
+    if await db.execute('SELECT 1 FROM groups WHERE user_id = ? AND name = ?', (uid, name)):
         await message.answer("❌ Уже есть.\nВведите другое:", reply_markup=cancel_kb)
         return
-    db.execute('INSERT INTO groups (user_id, name) VALUES (?, ?)', (uid, name))
+    await db.execute('INSERT INTO groups (user_id, name) VALUES (?, ?)', (uid, name))
+    kbs.invalidate(uid)
+    folder_id = (await db.execute('SELECT id FROM groups WHERE user_id = ? AND name = ?', (uid, name)))[0][0]
     data = await state.get_data()
     entry = data.get('last_added_entry') or data.get('togroup_link')
     text = f"✅ Папка \"{name}\" создана."
     if entry:
         try:
-            with sqlite3.connect(db.db_name) as conn:
-                c = conn.cursor()
-                c.execute('UPDATE links SET group_name = ? WHERE user_id = ? AND short = ?', (name, uid, entry['short']))
-                conn.commit()
-                if c.rowcount == 0: raise ValueError
-            stats = await get_link_stats(entry['short'].split('/')[-1])
+            if await db.execute(ASSIGN_GROUP_SQL, assign_params(uid, folder_id, entry['short'])) == 0: raise ValueError
+            stats = (await get_stats_many([entry['short']]))[0]
             text += f"\n🔗 {entry['title']}: {stats['views']}"
         except Exception as e:
             logger.error(f"Error assigning link: {e}")
@@ -771,50 +891,50 @@ async def process_create_group(message: types.Message, state: FSMContext):
     await cleanup_chat(message)
     await state.clear()
 
-@router.callback_query(F.data.startswith("confirm_delete:"))
+@router.callback_query(F.data.startswith(prefix('ld')))
 @handle_error
 async def confirm_delete_link(cb: types.CallbackQuery, state: FSMContext):
     logger.info(f"Handling confirm_delete for user {cb.from_user.id}, data={cb.data}")
     await state.clear()
-    _, scope, idx = cb.data.split(':')
-    idx = int(idx)
-    uid = str(cb.from_user.id)
-    links = db.execute('SELECT title, short FROM links WHERE user_id = ? AND group_name IS NULL', (uid,)) if scope == 'root' else db.execute('SELECT title, short FROM links WHERE user_id = ? AND group_name = ?', (uid, scope))
-    link = {'title': links[idx][0], 'short': links[idx][1]}
-    back_data = 'my_links' if scope == 'root' else f'view_group:{scope}'
-    await state.update_data(delete_scope=scope, delete_idx=idx, delete_short=link['short'])
-    kb = make_kb([InlineKeyboardButton('✅ Удалить', callback_data=f'do_delete:{scope}:{idx}'), InlineKeyboardButton('🚫 Отмена', callback_data=back_data)])
+    link = await get_link(cb.from_user.id, cb_ids(cb)[0])
+    if not link:
+        await cb.message.edit_text("❌ Ссылка не найдена.", parse_mode="HTML", reply_markup=get_links_menu())
+        await cb.answer()
+        return
+    kb = make_kb([('✅ Удалить', pack('lx', link['id'])), ('🚫 Отмена', folder_back(link['folder_id']))])
     await cb.message.edit_text(f"⚠️ Удалить?\n{link['title']}\n{link['short']}", parse_mode="HTML", reply_markup=kb)
     await state.set_state(LinkForm.confirm_delete_link)
     await cb.answer()
 
-@router.callback_query(F.data.startswith("do_delete:"))
+@router.callback_query(F.data.startswith(prefix('lx')))
 @handle_error
 async def do_delete(cb: types.CallbackQuery, state: FSMContext):
     logger.info(f"Handling do_delete for user {cb.from_user.id}, data={cb.data}")
-    _, scope, idx = cb.data.split(':')
-    idx = int(idx)
-    uid = str(cb.from_user.id)
-    data = await state.get_data()
-    db.execute('DELETE FROM links WHERE user_id = ? AND short = ?', (uid, data['delete_short']))
-    stats_cache.pop(data['delete_short'].split('/')[-1], None)
-    back_data = 'my_links' if scope == 'root' else f'view_group:{scope}'
-    kb = make_kb([InlineKeyboardButton('⬅ Назад', callback_data=back_data)])
+    uid = cb.from_user.id
+    link = await get_link(uid, cb_ids(cb)[0])
+    if not link:
+        await cb.message.edit_text("❌ Ссылка не найдена.", parse_mode="HTML", reply_markup=get_links_menu())
+        await state.clear()
+        await cb.answer()
+        return
+    await db.execute('DELETE FROM links WHERE id = ? AND user_id = ?', (link['id'], uid))
+    stats_cache.invalidate(link['short'].split('/')[-1])
+    kb = make_kb([('⬅ Назад', folder_back(link['folder_id']))])
     await cb.message.edit_text("✅ Удалено. Что дальше?", parse_mode="HTML", reply_markup=kb)
     await state.clear()
     await cb.answer()
 
-@router.callback_query(F.data.startswith("rename:"))
+@router.callback_query(F.data.startswith(prefix('lr')))
 @handle_error
 async def rename_link(cb: types.CallbackQuery, state: FSMContext):
     logger.info(f"Handling rename for user {cb.from_user.id}, data={cb.data}")
     await state.clear()
-    _, scope, idx = cb.data.split(':')
-    idx = int(idx)
-    uid = str(cb.from_user.id)
-    links = db.execute('SELECT title, short FROM links WHERE user_id = ? AND group_name IS NULL', (uid,)) if scope == 'root' else db.execute('SELECT title, short FROM links WHERE user_id = ? AND group_name = ?', (uid, scope))
-    link = {'title': links[idx][0], 'short': links[idx][1]}
-    await state.update_data(rename_link_short=link['short'], rename_scope=scope)
+    link = await get_link(cb.from_user.id, cb_ids(cb)[0])
+    if not link:
+        await cb.message.edit_text("❌ Ссылка не найдена.", parse_mode="HTML", reply_markup=get_links_menu())
+        await cb.answer()
+        return
+    await state.update_data(rename_link_id=link['id'], rename_folder_id=link['folder_id'])
     await cb.message.edit_text(f"✍ {link['title']}\n{link['short']}\nВведите новое:", parse_mode="HTML", reply_markup=cancel_kb)
     await state.set_state(LinkForm.rename_link)
     await cb.answer()
@@ -828,11 +948,9 @@ async def process_rename_link(message: types.Message, state: FSMContext):
         await message.answer("❌ Недействительно.\nПопробуйте:", reply_markup=cancel_kb)
         return
     data = await state.get_data()
-    short, scope = data['rename_link_short'], data['rename_scope']
-    uid = str(message.from_user.id)
-    db.execute('UPDATE links SET title = ? WHERE user_id = ? AND short = ?', (title, uid, short))
-    back_data = 'my_links' if scope == 'root' else f'view_group:{scope}'
-    kb = make_kb([InlineKeyboardButton('⬅ Назад', callback_data=back_data)])
+    uid = message.from_user.id
+    await db.execute('UPDATE links SET title = ? WHERE id = ? AND user_id = ?', (title, data['rename_link_id'], uid))
+    kb = make_kb([('⬅ Назад', folder_back(data['rename_folder_id']))])
     await message.answer(f"✅ \"{title}\". Что дальше?", parse_mode="HTML", reply_markup=kb)
     await cleanup_chat(message)
     await state.clear()
@@ -851,38 +969,30 @@ async def create_group(cb: types.CallbackQuery, state: FSMContext):
 async def show_groups(cb: types.CallbackQuery, state: FSMContext):
     logger.info(f"Handling show_groups for user {cb.from_user.id}")
     await state.clear()
-    uid = str(cb.from_user.id)
-    groups = db.execute('SELECT name FROM groups WHERE user_id = ?', (uid,))
+    uid = cb.from_user.id
+    groups = await get_folders(uid)
     if not groups:
         await cb.message.edit_text("📁 Нет папок.\nСоздайте.", parse_mode="HTML", reply_markup=get_groups_menu())
         await cb.answer()
         return
-    buttons = [InlineKeyboardButton(f"📁 {g[0]}", callback_data=f'view_group:{g[0]}') for g in groups]
-    kb = make_kb(buttons, row_width=1, extra_buttons=[InlineKeyboardButton('🔗 Ссылки', callback_data='my_links'), InlineKeyboardButton('🏠 Меню', callback_data='menu')])
+    buttons = [(f"📁 {name}", pack('fv', gid)) for gid, name in groups]
+    kb = make_kb(buttons, row_width=1, extra_buttons=[('🔗 Ссылки', 'my_links'), ('🏠 Меню', 'menu')])
     await cb.message.edit_text("📁 Папки:\nВыберите:", parse_mode="HTML", reply_markup=kb)
     await cb.answer()
 
-@router.callback_query(F.data.startswith("view_group:"))
+@router.callback_query(F.data.startswith(prefix('fv')))
 @handle_error
 async def view_group(cb: types.CallbackQuery, state: FSMContext):
     logger.info(f"Handling view_group for user {cb.from_user.id}, data={cb.data}")
     await state.clear()
-    name = cb.data.split(':')[1]
-    uid = str(cb.from_user.id)
-    groups = db.execute('SELECT name FROM groups WHERE user_id = ? AND name = ?', (uid, name))
-    if not groups:
+    folder_id = cb_ids(cb)[0]
+    uid = cb.from_user.id
+    name = await get_folder(uid, folder_id)
+    if name is None:
         await cb.message.edit_text("❌ Папка не найдена.", parse_mode="HTML", reply_markup=get_groups_menu())
         await cb.answer()
         return
-    text = f"📁 {name}\n"
-    links = db.execute('SELECT title, short FROM links WHERE user_id = ? AND group_name = ?', (uid, name))
-    items = [{'title': l[0], 'short': l[1]} for l in links]
-    buttons = []
-    if not items: text += '📚 Пусто.'
-    else:
-        stats = await asyncio.gather(*(get_link_stats(l['short'].split('/')[-1]) for l in items))
-        buttons.extend(InlineKeyboardButton(f"🔗 {l['title']} ({stats[i]['views']})", callback_data=f'link_action:{name}:{i}') for i, l in enumerate(items))
-    kb = make_kb(buttons, row_width=1, extra_buttons=[InlineKeyboardButton('📊 Статистика', callback_data=f'show_stats:{name}'), InlineKeyboardButton('🏠 Меню', callback_data='menu'), InlineKeyboardButton('⬅ Назад', callback_data='show_groups')])
+    _, text, kb = await render_links_page(uid, 'pl', folder_id, name)
     await cb.message.edit_text(text, parse_mode="HTML", reply_markup=kb)
     await cb.answer()
 
@@ -891,45 +1001,47 @@ async def view_group(cb: types.CallbackQuery, state: FSMContext):
 async def del_group(cb: types.CallbackQuery, state: FSMContext):
     logger.info(f"Handling del_group for user {cb.from_user.id}")
     await state.clear()
-    uid = str(cb.from_user.id)
-    groups = db.execute('SELECT name FROM groups WHERE user_id = ?', (uid,))
+    uid = cb.from_user.id
+    groups = await get_folders(uid)
     if not groups:
         await cb.message.edit_text("📁 Нет папок.\nСоздайте.", parse_mode="HTML", reply_markup=get_groups_menu())
         await cb.answer()
         return
-    kb = make_kb([InlineKeyboardButton(f"🗑 {g[0]}", callback_data=f"confirm_delete_group:{g[0]}") for g in groups], row_width=1, extra_buttons=[InlineKeyboardButton('🏠 Меню', callback_data='menu')])
+    kb = make_kb([(f"🗑 {name}", pack('fd', gid)) for gid, name in groups], row_width=1, extra_buttons=[('🏠 Меню', 'menu')])
     await cb.message.edit_text("📁 Удалить:\nВыберите:", parse_mode="HTML", reply_markup=kb)
     await cb.answer()
 
-@router.callback_query(F.data.startswith("confirm_delete_group:"))
+@router.callback_query(F.data.startswith(prefix('fd')))
 @handle_error
 async def confirm_delete_group(cb: types.CallbackQuery, state: FSMContext):
     logger.info(f"Handling confirm_delete_group for user {cb.from_user.id}, data={cb.data}")
     await state.clear()
-    group_name = cb.data.split(':')[1]
-    uid = str(cb.from_user.id)
-    groups = db.execute('SELECT name FROM groups WHERE user_id = ? AND name = ?', (uid, group_name))
-    if not groups:
+    folder_id = cb_ids(cb)[0]
+    group_name = await get_folder(cb.from_user.id, folder_id)
+    if group_name is None:
         await cb.message.edit_text("❌ Папка не найдена.", parse_mode="HTML", reply_markup=get_groups_menu())
         await cb.answer()
         return
-    await state.update_data(group_to_delete=group_name)
-    kb = make_kb([InlineKeyboardButton('✅ Удалить', callback_data=f'do_delete_group:{group_name}'), InlineKeyboardButton('🚫 Отмена', callback_data='show_groups')])
+    kb = make_kb([('✅ Удалить', pack('fx', folder_id)), ('🚫 Отмена', 'show_groups')])
     await cb.message.edit_text(f"⚠️ Удалить \"{group_name}\"? Ссылки в корень.", parse_mode="HTML", reply_markup=kb)
     await cb.answer()
 
-@router.callback_query(F.data.startswith("do_delete_group:"))
+@router.callback_query(F.data.startswith(prefix('fx')))
 @handle_error
 async def do_delete_group(cb: types.CallbackQuery, state: FSMContext):
     logger.info(f"Handling do_delete_group for user {cb.from_user.id}, data={cb.data}")
-    group_name = cb.data.split(':')[1]
-    uid = str(cb.from_user.id)
+    folder_id = cb_ids(cb)[0]
+    uid = cb.from_user.id
+    group_name = await get_folder(uid, folder_id)
+    if group_name is None:
+        await cb.message.edit_text("❌ Папка не найдена.", parse_mode="HTML", reply_markup=get_groups_menu())
+        await state.clear()
+        await cb.answer()
+        return
     try:
-        with sqlite3.connect(db.db_name) as conn:
-            c = conn.cursor()
-            c.execute('UPDATE links SET group_name = NULL WHERE user_id = ? AND group_name = ?', (uid, group_name))
-            c.execute('DELETE FROM groups WHERE user_id = ? AND name = ?', (uid, group_name))
-            conn.commit()
+        # Ссылки папки возвращаются в корень через ON DELETE SET NULL
+        await db.execute('DELETE FROM groups WHERE id = ? AND user_id = ?', (folder_id, uid))
+        kbs.invalidate(uid)
     except sqlite3.Error as e:
         logger.error(f"Error deleting group: {e}")
         await cb.message.edit_text("❌ Ошибка удаления.", parse_mode="HTML", reply_markup=get_groups_menu())
@@ -939,15 +1051,38 @@ async def do_delete_group(cb: types.CallbackQuery, state: FSMContext):
     await state.clear()
     await cb.answer()
 
+# Кнопки из старых сообщений (прежний формат callback_data) — последним обработчиком
+@router.callback_query()
+@handle_error
+async def stale_button(cb: types.CallbackQuery, state: FSMContext):
+    logger.info(f"Stale callback from user {cb.from_user.id}, data={cb.data}")
+    await state.clear()
+    await cb.message.edit_text("⌛ Кнопка устарела. Выберите:", parse_mode="HTML", reply_markup=get_main_menu())
+    await cb.answer()
+
 async def main():
     logger.info("Starting bot...")
+    await http.start()
+    await cities.load()
+    warehouse.start()
     try:
-        await dp.start_polling()
+        scheduler = setup_scheduler(dp)
+        setup_metrics(dp, scheduler, vk, stats_cache=stats_cache, short_cache=short_cache, titles=titles,
+                      reachability=reachability, warehouse=warehouse, cities=cities, keyboards=kbs)
+        await metrics.start()
+        if BOT_MODE == "webhook": await run_webhook(dp, bot, scheduler)
+        else: await dp.start_polling(bot)
     except Exception as e:
         logger.error(f"Bot failed: {e}")
     finally:
+        await metrics.stop()
+        await warehouse.stop()
+        await http.close()
+        logger.info(f"Short link cache: {short_cache.stats()}")
+        logger.info(f"Keyboard cache: {kbs.stats()}")
+        stats_cache.close()
+        await db.close()
         await dp.storage.close()
-        await dp.storage.wait_closed()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
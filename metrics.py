@@ -0,0 +1,272 @@
+import os
+import time
+import bisect
+import asyncio
+import inspect
+from aiohttp import web
+from aiogram import BaseMiddleware
+from loguru import logger
+
+# Локальный HTTP-эндпоинт /metrics в текстовом формате Prometheus; 0 — не поднимать
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+# Как часто замерять задержку цикла событий, с
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "1"))
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    # bool — подкласс int, но True/False не число в формате Prometheus
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Счётчик с метками: значения по кортежу меток, обновление — одна операция со словарём
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        for label_values, value in self.values.items():
+            yield f"{self.name}{_labels(self.labels, label_values)} {_number(value)}"
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value, *label_values):
+        self.values[label_values] = value
+
+
+class _Timer:
+    __slots__ = ("histogram", "label_values", "started")
+
+    def __init__(self, histogram, label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.label_values)
+
+
+# Гистограмма: счётчики по корзинам копятся без накопления, суммируются при выдаче
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self.values = {}
+
+    def observe(self, value, *label_values):
+        state = self.values.get(label_values)
+        if state is None:
+            state = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+
+    def time(self, *label_values):
+        return _Timer(self, label_values)
+
+    def samples(self):
+        for label_values, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                yield f"{self.name}_bucket{_labels(self.labels, label_values, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, label_values)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.labels, label_values)} {cumulative}"
+
+
+# Метрики, которые считаются только в момент запроса /metrics: функция
+# возвращает число или {(значения меток): число}, может быть корутиной
+class Collected:
+    type = "gauge"
+
+    def __init__(self, name, help, func, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.func = func
+        self.values = {}
+
+    async def collect(self):
+        value = self.func()
+        if inspect.isawaitable(value):
+            value = await value
+        self.values = value if isinstance(value, dict) else {(): value}
+
+    def samples(self):
+        for label_values, value in self.values.items():
+            if isinstance(value, (int, float)):
+                yield f"{self.name}{_labels(self.labels, label_values)} {_number(value)}"
+
+
+# Реестр метрик. Горячий путь только обновляет словари в памяти; текст,
+# статистика кэшей и состояния FSM собираются лишь при запросе /metrics
+class Metrics:
+    def __init__(self):
+        self._metrics = {}
+        self._runner = None
+        self._lag_task = None
+        self.scrapes = 0
+
+    def _register(self, metric):
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self._register(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def collected(self, name, help, func, labels=()):
+        metric = Collected(name, help, func, labels)
+        self._metrics[name] = metric
+        return metric
+
+    # Числовые поля готового stats() (кэши, планировщик) — {prefix}_stats{field="…"}
+    def register_stats(self, prefix, stats, help=""):
+        def collect():
+            return {(key,): value for key, value in stats().items()}
+        return self.collected(f"{prefix}_stats", help or f"{prefix}.stats()", collect, ("field",))
+
+    async def render(self):
+        self.scrapes += 1
+        lines = []
+        for metric in list(self._metrics.values()):
+            if isinstance(metric, Collected):
+                try:
+                    await metric.collect()
+                except Exception as e:
+                    logger.warning(f"Ошибка сбора метрики {metric.name}: {e}")
+                    continue
+            lines.append(f"# HELP {metric.name} {_escape(metric.help)}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+    async def _handle(self, request):
+        return web.Response(text=await self.render(), content_type="text/plain", charset="utf-8")
+
+    async def _watch_loop_lag(self, interval):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(interval)
+            lag = max(0.0, loop.time() - started - interval)
+            LOOP_LAG.observe(lag)
+            LOOP_LAG_LAST.set(lag)
+
+    async def start(self, host=METRICS_HOST, port=METRICS_PORT, lag_interval=LOOP_LAG_INTERVAL):
+        if not port:
+            return
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, host, port).start()
+        except OSError as e:
+            logger.warning(f"Метрики не запущены, {host}:{port} занят: {e}")
+            await runner.cleanup()
+            return
+        self._runner = runner
+        if lag_interval > 0:
+            self._lag_task = asyncio.create_task(self._watch_loop_lag(lag_interval))
+        logger.info(f"Метрики: http://{host}:{port}/metrics")
+
+    async def stop(self):
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            try:
+                await self._lag_task
+            except asyncio.CancelledError:
+                pass
+            self._lag_task = None
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+metrics = Metrics()
+
+HANDLER_SECONDS = metrics.histogram("bot_handler_duration_seconds", "Время обработчика апдейта", ("handler",))
+HANDLER_ERRORS = metrics.counter("bot_handler_errors_total", "Исключения в обработчиках", ("handler",))
+LOOP_LAG = metrics.histogram("event_loop_lag_seconds", "Опоздание пробуждения цикла событий",
+                             buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5))
+LOOP_LAG_LAST = metrics.gauge("event_loop_lag_last_seconds", "Последний замер задержки цикла событий")
+
+
+def handler_name(data):
+    handler = data.get("handler")
+    return getattr(getattr(handler, "callback", None), "__name__", "unknown")
+
+
+# Время каждого обработчика по имени; inner-middleware, поэтому обработчик
+# уже выбран фильтрами и апдейты без обработчика не считаются
+class HandlerMetrics(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(handler_name(data))
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, handler_name(data))
+
+
+# Время обработчиков, очередь апдейтов, состояния FSM, VK и кэши бота
+# (именованные объекты со stats()) — всё, что собирается при запросе /metrics
+def setup_metrics(dp, scheduler, vk, **caches):
+    middleware = HandlerMetrics()
+    dp.message.middleware(middleware)
+    dp.callback_query.middleware(middleware)
+    metrics.register_stats("update_scheduler", scheduler.stats)
+    metrics.register_stats("vk", lambda: {"requests_sent": vk.requests_sent, "deduplicated": vk.deduplicated,
+                                          "granted": vk.scheduler.granted, "throttled": vk.scheduler.throttled,
+                                          "queued": vk.scheduler.queued})
+    for name, cache in caches.items():
+        metrics.register_stats(name, cache.stats)
+    if hasattr(dp.storage, "state_counts"):
+        async def fsm_states():
+            return {(state,): count for state, count in (await dp.storage.state_counts()).items()}
+        metrics.collected("fsm_states", "Записи FSM по состояниям", fsm_states, ("state",))
+    return middleware
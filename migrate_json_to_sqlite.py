@@ -0,0 +1,44 @@
+# Перенос ссылок из links.json (снимок + журнал) в links.db
+# Запуск: python migrate_json_to_sqlite.py [links.json] [links.db]
+import sys
+import asyncio
+import datetime
+import sqlite3
+from loguru import logger
+from storage import JsonStorage, SqliteStorage, LINKS_PATH, DB_PATH
+from short_cache import canonical_url
+
+
+def _timestamp(created):
+    try:
+        return int(datetime.datetime.fromisoformat(created).timestamp())
+    except (TypeError, ValueError):
+        return 0
+
+
+async def migrate(json_path=LINKS_PATH, db_path=DB_PATH):
+    source = JsonStorage(json_path)
+    try:
+        users = dict(source.data)
+    finally:
+        await source.close()
+    conn = sqlite3.connect(db_path)
+    try:
+        SqliteStorage.init_schema(conn)
+        rows = []
+        for user_id, links in users.items():
+            if not user_id.isdigit():
+                logger.warning(f"Пропущен пользователь с нечисловым id: {user_id}")
+                continue
+            rows.extend((int(user_id), link.get('title', ''), link['short'], link.get('original', ''), _timestamp(link.get('created')), canonical_url(link.get('original', ''))) for link in links)
+        # Все ссылки одной транзакцией: при ошибке links.db останется прежним
+        with conn:
+            inserted = conn.executemany('INSERT OR IGNORE INTO links (user_id, title, short, original, created, canonical) VALUES (?, ?, ?, ?, ?, ?)', rows).rowcount
+    finally:
+        conn.close()
+    logger.info(f"Перенесено {inserted} ссылок из {json_path} в {db_path}")
+    return inserted
+
+
+if __name__ == "__main__":
+    asyncio.run(migrate(*sys.argv[1:3]))
@@ -0,0 +1,122 @@
+import sqlite3
+from loguru import logger
+from short_cache import canonical_url
+
+
+# v1: исходная схема — user_id строкой, папки по имени
+def _v1_initial(conn):
+    conn.execute('CREATE TABLE IF NOT EXISTS links (user_id TEXT, title TEXT, short TEXT, original TEXT, group_name TEXT, created TEXT)')
+    conn.execute('CREATE TABLE IF NOT EXISTS groups (user_id TEXT, name TEXT)')
+
+
+# v2: целочисленные ключи, таблица папок с внешним ключом, created в unix-времени
+def _v2_integer_keys(conn):
+    conn.execute('''CREATE TABLE groups_v2 (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        UNIQUE (user_id, name)
+    )''')
+    # Папки берём и из groups, и из links: у части ссылок папка есть только по имени
+    conn.execute('''INSERT OR IGNORE INTO groups_v2 (user_id, name)
+        SELECT CAST(user_id AS INTEGER), name FROM groups WHERE name IS NOT NULL
+        UNION ALL
+        SELECT CAST(user_id AS INTEGER), group_name FROM links WHERE group_name IS NOT NULL''')
+    conn.execute('''CREATE TABLE links_v2 (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        group_id INTEGER REFERENCES groups (id) ON DELETE SET NULL,
+        title TEXT NOT NULL,
+        short TEXT NOT NULL,
+        original TEXT NOT NULL,
+        created INTEGER NOT NULL,
+        UNIQUE (user_id, short)
+    )''')
+    # Повторы одной короткой ссылки у пользователя схлопываются, побеждает последняя
+    conn.execute('''INSERT OR REPLACE INTO links_v2 (user_id, group_id, title, short, original, created)
+        SELECT CAST(l.user_id AS INTEGER), g.id, COALESCE(l.title, ''), l.short, COALESCE(l.original, ''),
+               COALESCE(CAST(strftime('%s', l.created) AS INTEGER), 0)
+        FROM links l
+        LEFT JOIN groups_v2 g ON g.user_id = CAST(l.user_id AS INTEGER) AND g.name = l.group_name
+        WHERE l.short IS NOT NULL
+        ORDER BY l.rowid''')
+    conn.execute('DROP TABLE links')
+    conn.execute('DROP TABLE groups')
+    conn.execute('ALTER TABLE groups_v2 RENAME TO groups')
+    conn.execute('ALTER TABLE links_v2 RENAME TO links')
+    conn.execute('CREATE INDEX idx_links_user_group ON links (user_id, group_id, id)')
+
+
+# v3: канонический адрес для повторного использования коротких ссылок
+def _v3_canonical_url(conn):
+    conn.execute('ALTER TABLE links ADD COLUMN canonical TEXT')
+    rows = conn.execute('SELECT id, original FROM links').fetchall()
+    conn.executemany('UPDATE links SET canonical = ? WHERE id = ?', [(canonical_url(original), id_) for id_, original in rows])
+    conn.execute('CREATE INDEX idx_links_canonical ON links (canonical)')
+
+
+# v4: локальное хранилище дневной статистики ссылок; city_id = 0 — все города
+def _v4_link_stats_daily(conn):
+    conn.execute('''CREATE TABLE link_stats_daily (
+        link TEXT NOT NULL,
+        day TEXT NOT NULL,
+        views INTEGER NOT NULL,
+        city_id INTEGER NOT NULL,
+        PRIMARY KEY (link, day, city_id)
+    ) WITHOUT ROWID''')
+    conn.execute('''CREATE TABLE link_stats_sync (
+        link TEXT PRIMARY KEY,
+        last_day TEXT,
+        synced INTEGER NOT NULL
+    )''')
+
+
+# v5: справочник названий городов VK; title NULL — VK такого города не знает
+def _v5_cities(conn):
+    conn.execute('CREATE TABLE cities (id INTEGER PRIMARY KEY, title TEXT)')
+
+
+# v6: постраничный список всех ссылок пользователя по id без сортировки
+def _v6_links_user_index(conn):
+    conn.execute('CREATE INDEX idx_links_user ON links (user_id, id)')
+
+
+# v7: с какого дня хранилище статистики покрывает ссылку; раньше — живой запрос
+# к VK. Для уже загруженных ссылок берём первый день с данными (не раньше истины)
+def _v7_stats_coverage(conn):
+    conn.execute('ALTER TABLE link_stats_sync ADD COLUMN covered_from TEXT')
+    conn.execute('UPDATE link_stats_sync SET covered_from = (SELECT MIN(day) FROM link_stats_daily d WHERE d.link = link_stats_sync.link)')
+    conn.execute('CREATE INDEX idx_links_short ON links (short)')
+
+
+MIGRATIONS = [
+    (1, _v1_initial),
+    (2, _v2_integer_keys),
+    (3, _v3_canonical_url),
+    (4, _v4_link_stats_daily),
+    (5, _v5_cities),
+    (6, _v6_links_user_index),
+    (7, _v7_stats_coverage),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+# Применяет недостающие миграции, каждую в своей транзакции.
+# Вызывать до PRAGMA foreign_keys=ON: пересборка таблиц идёт без проверок ключей
+def migrate(conn):
+    current = conn.execute('PRAGMA user_version').fetchone()[0]
+    for version, step in MIGRATIONS:
+        if version <= current:
+            continue
+        try:
+            conn.execute('BEGIN')
+            step(conn)
+            conn.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            logger.error(f"Ошибка миграции схемы до v{version}: {e}")
+            raise
+        logger.info(f"Схема БД обновлена до v{version}")
+        current = version
+    return current
@@ -0,0 +1,128 @@
+import os
+import re
+import codecs
+import asyncio
+from html.parser import HTMLParser
+import aiohttp
+from loguru import logger
+from http_client import http
+from reachability import TtlCache
+
+# Заголовок ищется только в начале страницы: дальше этого объёма не читаем
+TITLE_MAX_BYTES = int(os.getenv("TITLE_MAX_BYTES", str(64 * 1024)))
+TITLE_CHUNK = 8192
+TITLE_TIMEOUT = float(os.getenv("TITLE_TIMEOUT", "10"))
+TITLE_CACHE_TTL = int(os.getenv("TITLE_CACHE_TTL", "3600"))
+TITLE_CACHE_MAX = int(os.getenv("TITLE_CACHE_MAX", "10000"))
+
+META_CHARSET_RE = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([\w.:-]+)', re.IGNORECASE)
+STOP_MARKERS = (b"</title>", b"</head>")
+
+
+# Достаёт <title> и og:title из начала HTML-документа
+class _TitleParser(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.title = None
+        self.og_title = None
+        self._in_title = False
+        self._parts = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "title" and self.title is None:
+            self._in_title = True
+        elif tag == "meta":
+            attrs = dict(attrs)
+            if (attrs.get("property") or attrs.get("name")) == "og:title" and self.og_title is None:
+                self.og_title = attrs.get("content")
+
+    def handle_endtag(self, tag):
+        if tag == "title" and self._in_title:
+            self._in_title = False
+            self.title = "".join(self._parts)
+
+    def handle_data(self, data):
+        if self._in_title:
+            self._parts.append(data)
+
+
+def _clean(text):
+    return " ".join(text.split()) if text else ""
+
+
+def sniff_charset(data, declared=None):
+    for name in (declared, *(m.decode("ascii", "ignore") for m in META_CHARSET_RE.findall(data[:4096]))):
+        if not name:
+            continue
+        try:
+            return codecs.lookup(name).name
+        except LookupError:
+            continue
+    return "utf-8"
+
+
+# Разбор уже прочитанного начала страницы; <title> важнее og:title
+def parse_title(data, declared_charset=None):
+    if data.startswith(codecs.BOM_UTF8):
+        text = data[len(codecs.BOM_UTF8):].decode("utf-8", "replace")
+    else:
+        text = data.decode(sniff_charset(data, declared_charset), "replace")
+    parser = _TitleParser()
+    parser.feed(text)
+    # Заголовок мог оборваться на границе лимита
+    if parser._in_title:
+        parser.title = "".join(parser._parts)
+    return _clean(parser.title) or _clean(parser.og_title) or None
+
+
+# Читает ответ по кускам до </title>, </head> или лимита в байтах
+async def read_head(content, max_bytes=TITLE_MAX_BYTES):
+    buf = bytearray()
+    async for chunk in content.iter_chunked(TITLE_CHUNK):
+        start = max(0, len(buf) - 8)
+        buf += chunk
+        tail = bytes(buf[start:]).lower()
+        if any(marker in tail for marker in STOP_MARKERS) or len(buf) >= max_bytes:
+            break
+    return bytes(buf[:max_bytes])
+
+
+# Заголовок страницы с кэшем по адресу; отсутствие заголовка тоже кэшируется
+class TitleFetcher:
+    def __init__(self, max_bytes=TITLE_MAX_BYTES, timeout=TITLE_TIMEOUT, ttl=TITLE_CACHE_TTL, max_entries=TITLE_CACHE_MAX):
+        self.max_bytes = max_bytes
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.ttl = ttl
+        self._cache = TtlCache(max_entries)
+        self.fetched = 0
+        self.cache_hits = 0
+        self.bytes_read = 0
+
+    def stats(self):
+        return {"fetched": self.fetched, "cache_hits": self.cache_hits, "bytes_read": self.bytes_read}
+
+    async def fetch(self, url):
+        cached = self._cache.get(url)
+        if cached is not None:
+            self.cache_hits += 1
+            return cached or None
+        try:
+            title = await self._fetch(url)
+        except Exception as e:
+            logger.error(f"Не удалось получить заголовок {url}: {e}")
+            return None
+        self._cache.set(url, title or "", self.ttl)
+        return title
+
+    async def _fetch(self, url):
+        self.fetched += 1
+        async with http.session.get(url, timeout=self.timeout) as resp:
+            if resp.status != 200:
+                return None
+            if resp.content_type not in ("text/html", "application/xhtml+xml"):
+                return None
+            data = await read_head(resp.content, self.max_bytes)
+            charset = resp.charset
+        self.bytes_read += len(data)
+        # Разбор в пуле потоков, чтобы не держать цикл событий
+        return await asyncio.get_running_loop().run_in_executor(None, parse_title, data, charset)
@@ -0,0 +1,146 @@
+import os
+import re
+import time
+import asyncio
+from collections import OrderedDict
+from urllib.parse import urlsplit
+import aiohttp
+from loguru import logger
+from http_client import http
+
+# Общий бюджет на проверку одной ссылки (HEAD + запасной GET), секунды
+PROBE_BUDGET = float(os.getenv("PROBE_BUDGET", "4"))
+PROBE_TTL = int(os.getenv("PROBE_TTL", "600"))
+# Отрицательный результат живёт меньше: пользователь может поправить сайт и повторить
+PROBE_NEGATIVE_TTL = int(os.getenv("PROBE_NEGATIVE_TTL", "60"))
+PROBE_CACHE_MAX = int(os.getenv("PROBE_CACHE_MAX", "10000"))
+# Домены (и их поддомены), которые не проверяются; PROBE=0 отключает проверку совсем
+PROBE_TRUSTED_DOMAINS = [d.strip().lower() for d in os.getenv("PROBE_TRUSTED_DOMAINS", "vk.com,vk.cc,t.me").split(",") if d.strip()]
+PROBE_ENABLED = os.getenv("PROBE", "1") != "0"
+
+URL_RE = re.compile(r'^https?://[^\s/$.?#].[^\s]*$', re.IGNORECASE)
+# Сервер ответил, но не пускает робота — сама ссылка рабочая
+RESTRICTED = (401, 403, 429)
+# На эти ответы HEAD пробуем GET: часть сайтов не поддерживает HEAD
+HEAD_FALLBACK = (403, 404, 405, 501)
+
+
+# TTL-кэш с LRU-вытеснением
+class TtlCache:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires <= time.monotonic():
+            del self._entries[key]
+            return None
+        return value
+
+    def set(self, key, value, ttl):
+        self._entries[key] = (value, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+# Проверка доступности ссылки: кэш по адресу и по хосту, HEAD с запасным
+# ranged GET, общий бюджет времени и пропуск доверенных доменов.
+# Одновременные проверки одного адреса склеиваются в одну
+class ReachabilityChecker:
+    def __init__(self, budget=PROBE_BUDGET, ttl=PROBE_TTL, negative_ttl=PROBE_NEGATIVE_TTL,
+                 trusted=PROBE_TRUSTED_DOMAINS, enabled=PROBE_ENABLED, max_entries=PROBE_CACHE_MAX):
+        self.budget = budget
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.trusted = tuple(trusted)
+        self.enabled = enabled
+        self._urls = TtlCache(max_entries)
+        self._hosts = TtlCache(max_entries)
+        self._inflight = {}
+        self.probes = 0
+        self.cache_hits = 0
+        self.skipped = 0
+        self.timeouts = 0
+
+    def stats(self):
+        return {"probes": self.probes, "cache_hits": self.cache_hits,
+                "skipped": self.skipped, "timeouts": self.timeouts}
+
+    def is_trusted(self, host):
+        return any(host == d or host.endswith("." + d) for d in self.trusted)
+
+    # Возвращает (ok, причина отказа)
+    async def check(self, url):
+        if not URL_RE.match(url):
+            return False, "Неверный формат URL"
+        host = (urlsplit(url).hostname or "").lower()
+        if not self.enabled or self.is_trusted(host):
+            self.skipped += 1
+            return True, ""
+        cached = self._urls.get(url)
+        if cached is None:
+            # Хост недавно не отвечал — другие адреса на нём не проверяем
+            cached = self._hosts.get(host)
+        if cached is not None:
+            self.cache_hits += 1
+            return cached
+        future = self._inflight.get(url)
+        if future is not None:
+            return await asyncio.shield(future)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[url] = future
+        try:
+            result = await self._probe(url, host)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Ожидающих нет — не даём asyncio ругаться на необработанное исключение
+            future.exception()
+            raise
+        finally:
+            del self._inflight[url]
+
+    async def _probe(self, url, host):
+        self.probes += 1
+        try:
+            async with asyncio.timeout(self.budget):
+                status = await self._request("HEAD", url)
+                if status in HEAD_FALLBACK or status >= 500:
+                    status = await self._request("GET", url, headers={"Range": "bytes=0-0"})
+        except TimeoutError:
+            # Медленный сайт не значит нерабочий: пропускаем без кэширования
+            self.timeouts += 1
+            logger.warning(f"Проверка {url} не уложилась в {self.budget} с")
+            return True, ""
+        except aiohttp.ClientConnectionError as e:
+            logger.error(f"Ошибка проверки URL {url}: {e}")
+            result = (False, "Сайт недоступен")
+            self._hosts.set(host, result, self.negative_ttl)
+            self._urls.set(url, result, self.negative_ttl)
+            return result
+        except aiohttp.ClientError as e:
+            logger.error(f"Ошибка проверки URL {url}: {e}")
+            result = (False, "Сайт недоступен")
+            self._urls.set(url, result, self.negative_ttl)
+            return result
+        if status < 400 or status in RESTRICTED:
+            result = (True, "")
+            self._urls.set(url, result, self.ttl)
+        else:
+            result = (False, f"Сайт ответил {status}")
+            self._urls.set(url, result, self.negative_ttl)
+        return result
+
+    async def _request(self, method, url, headers=None):
+        # Тело не читаем: нужен только статус
+        async with http.session.request(method, url, headers=headers, allow_redirects=False) as resp:
+            return resp.status
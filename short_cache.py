@@ -0,0 +1,83 @@
+import os
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+# SHORT_CACHE=0 отключает повторное использование ссылок vk.cc
+SHORT_CACHE_ENABLED = os.getenv("SHORT_CACHE", "1") != "0"
+SHORT_CACHE_MAX = int(os.getenv("SHORT_CACHE_MAX", "10000"))
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+# Канонический вид адреса для поиска уже сокращённой ссылки: регистр схемы и
+# хоста, порт по умолчанию, завершающий слэш и порядок параметров не важны.
+# Во VK по-прежнему уходит исходный адрес
+def canonical_url(url):
+    try:
+        parts = urlsplit(url.strip())
+        port = parts.port
+    except ValueError:
+        return url.strip()
+    scheme = parts.scheme.lower()
+    netloc = (parts.hostname or "").lower()
+    if port and port != DEFAULT_PORTS.get(scheme):
+        netloc = f"{netloc}:{port}"
+    if parts.username:
+        userinfo = parts.username + (f":{parts.password}" if parts.password else "")
+        netloc = f"{userinfo}@{netloc}"
+    path = parts.path.rstrip("/")
+    # Сортировка только по имени: порядок повторов одного параметра сохраняется
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True), key=lambda p: p[0]))
+    return urlunsplit((scheme, netloc, path, query, parts.fragment))
+
+
+# Кэш адрес -> короткая ссылка: недавние результаты в памяти (LRU),
+# остальное ищется в таблице ссылок через lookup(canonical)
+class ShortLinkCache:
+    def __init__(self, lookup=None, max_entries=SHORT_CACHE_MAX, enabled=SHORT_CACHE_ENABLED):
+        self.lookup = lookup
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    # Каждое попадание — несэкономленный вызов utils.getShortLink
+    def stats(self):
+        return {"enabled": self.enabled, "hits": self.hits, "misses": self.misses,
+                "vk_calls_saved": self.hits, "hit_ratio": round(self.hit_ratio, 3), "size": len(self)}
+
+    async def get(self, url):
+        if not self.enabled:
+            return None
+        key = canonical_url(url)
+        short = self._entries.get(key)
+        if short is None and self.lookup is not None:
+            short = await self.lookup(key)
+            if short:
+                self._store(key, short)
+        elif short is not None:
+            self._entries.move_to_end(key)
+        if short:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return short
+
+    def set(self, url, short):
+        if self.enabled and short:
+            self._store(canonical_url(url), short)
+
+    def _store(self, key, short):
+        self._entries[key] = short
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
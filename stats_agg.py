@@ -0,0 +1,79 @@
+import os
+import heapq
+from array import array
+
+# Сколько городов показывать в сводной статистике
+STATS_TOP_CITIES = int(os.getenv("STATS_TOP_CITIES", "10"))
+
+
+# Итог по набору ссылок: просмотры каждой ссылки (в порядке запроса), общий
+# итог, топ городов и просмотры по дням
+class StatsSummary:
+    def __init__(self, link_views, top_cities, city_count=0, daily=()):
+        self.link_views = link_views
+        self.total = sum(link_views)
+        self.top_cities = top_cities
+        self.city_count = city_count
+        self.daily = list(daily)
+
+
+# Сумма просмотров по городам за один проход; city_rows: (city_id, views),
+# один город может встречаться сколько угодно раз
+def city_totals(city_rows):
+    totals = {}
+    for city_id, views in city_rows:
+        totals[city_id] = totals.get(city_id, 0) + views
+    return totals
+
+
+def top_cities(totals, top_n=STATS_TOP_CITIES):
+    return [(str(city_id), views) for city_id, views in heapq.nlargest(top_n, totals.items(), key=lambda item: item[1])]
+
+
+# Колонки уже сгруппированных сумм: просмотры по ссылкам, по дням и по
+# городам лежат в array('q') и дополняются частями (по кускам IN-списка)
+class StatsColumns:
+    def __init__(self, links):
+        self.links = list(links)
+        self._link_index = {link: i for i, link in enumerate(dict.fromkeys(self.links))}
+        self.link_views = array('q', bytes(8 * len(self._link_index)))
+        self._day_index = {}
+        self.day_views = array('q')
+        self._cities = {}
+
+    # rows: (link, views)
+    def add_links(self, rows):
+        index, views = self._link_index, self.link_views
+        for link, value in rows:
+            i = index.get(link)
+            if i is not None:
+                views[i] += value
+
+    # rows: (day, views)
+    def add_days(self, rows):
+        index, views = self._day_index, self.day_views
+        for day, value in rows:
+            i = index.get(day)
+            if i is None:
+                i = index[day] = len(views)
+                views.append(0)
+            views[i] += value
+
+    # rows: (city_id, views)
+    def add_cities(self, rows):
+        totals = self._cities
+        for city_id, views in rows:
+            totals[city_id] = totals.get(city_id, 0) + views
+
+    def summary(self, top_n=STATS_TOP_CITIES):
+        views = [self.link_views[self._link_index[link]] for link in self.links]
+        daily = sorted(zip(self._day_index, self.day_views))
+        return StatsSummary(views, top_cities(self._cities, top_n), len(self._cities), daily)
+
+
+# Сводка из готовых результатов get_link_stats ({"views", "cities", "daily"}) —
+# для живых запросов к VK; "daily" ({день: просмотры}) может отсутствовать
+def summarize_link_stats(stats, top_n=STATS_TOP_CITIES):
+    totals = city_totals(item for s in stats for item in s['cities'].items())
+    daily = city_totals(item for s in stats for item in s.get('daily', {}).items())
+    return StatsSummary([s['views'] for s in stats], top_cities(totals, top_n), len(totals), sorted(daily.items()))
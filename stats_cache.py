@@ -0,0 +1,147 @@
+import os
+import json
+import time
+import sqlite3
+import datetime
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+
+STATS_CACHE_TTL = int(os.getenv("STATS_CACHE_TTL", "600"))
+# Периоды, целиком лежащие в прошлом, уже не меняются — их можно держать долго
+STATS_CACHE_PAST_TTL = int(os.getenv("STATS_CACHE_PAST_TTL", str(30 * 24 * 3600)))
+STATS_CACHE_MAX = int(os.getenv("STATS_CACHE_MAX", "10000"))
+STATS_CACHE_DB = os.getenv("STATS_CACHE_DB")
+
+
+# Кэш статистики ссылок: TTL на запись, LRU-вытеснение, опционально SQLite.
+# Память — основная копия; запись в SQLite уходит в отдельный поток и не
+# держит цикл событий, порядок записей сохраняет единственный поток
+class StatsCache:
+    def __init__(self, ttl=STATS_CACHE_TTL, past_ttl=STATS_CACHE_PAST_TTL,
+                 max_entries=STATS_CACHE_MAX, db_path=STATS_CACHE_DB):
+        self.ttl = ttl
+        self.past_ttl = past_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._by_link = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._conn = None
+        self._executor = None
+        if db_path:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=type(self).__name__)
+            self._executor.submit(self._open, db_path).result()
+
+    def _open(self, db_path):
+        self._conn = sqlite3.connect(db_path)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        # Потеря хвоста кэша при падении не страшна, fsync на каждую запись не нужен
+        self._conn.execute('PRAGMA synchronous=OFF')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS stats_cache (link TEXT, date_from TEXT, date_to TEXT, value TEXT, expires REAL, PRIMARY KEY (link, date_from, date_to))')
+        now = time.time()
+        self._conn.execute('DELETE FROM stats_cache WHERE expires <= ?', (now,))
+        self._conn.commit()
+        rows = self._conn.execute('SELECT link, date_from, date_to, value, expires FROM stats_cache ORDER BY expires DESC LIMIT ?', (self.max_entries,)).fetchall()
+        for link, date_from, date_to, value, expires in reversed(rows):
+            self._store((link, date_from or None, date_to or None), json.loads(value), expires)
+        logger.info(f"Кэш статистики: загружено {len(rows)} записей из {db_path}")
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+                "hit_ratio": round(self.hit_ratio, 3), "evictions": self.evictions}
+
+    def ttl_for(self, date_from=None, date_to=None):
+        if date_to and date_to < datetime.date.today().isoformat():
+            return self.past_ttl
+        return self.ttl
+
+    def get(self, key, date_from=None, date_to=None):
+        cache_key = (key, date_from, date_to)
+        entry = self._entries.get(cache_key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, expires = entry
+        if expires <= time.time():
+            self._evict(cache_key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(cache_key)
+        self.hits += 1
+        return value
+
+    def set(self, key, date_from, date_to, value, ttl=None):
+        cache_key = (key, date_from, date_to)
+        expires = time.time() + (ttl if ttl is not None else self.ttl_for(date_from, date_to))
+        self._store(cache_key, value, expires)
+        if self._executor is not None:
+            self._persist('INSERT OR REPLACE INTO stats_cache VALUES (?, ?, ?, ?, ?)', (key, date_from or '', date_to or '', json.dumps(value), expires))
+
+    def invalidate(self, key):
+        for cache_key in list(self._by_link.get(key, ())):
+            self._drop(cache_key)
+        if self._executor is not None:
+            self._persist('DELETE FROM stats_cache WHERE link = ?', (key,))
+
+    def clear(self):
+        self._entries.clear()
+        self._by_link.clear()
+        if self._executor is not None:
+            self._persist('DELETE FROM stats_cache', ())
+
+    # Не ждёт записи: задача встаёт в очередь потока кэша
+    def _persist(self, query, params):
+        self._executor.submit(self._write, query, params)
+
+    def _write(self, query, params):
+        try:
+            self._conn.execute(query, params)
+            self._conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Ошибка записи кэша статистики: {e}")
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    # Дожидается записей из очереди и закрывает соединение
+    def close(self):
+        if self._executor is not None:
+            self._executor.submit(self._close).result()
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def _store(self, cache_key, value, expires):
+        self._entries[cache_key] = (value, expires)
+        self._entries.move_to_end(cache_key)
+        self._by_link.setdefault(cache_key[0], set()).add(cache_key)
+        while len(self._entries) > self.max_entries:
+            self._evict(next(iter(self._entries)))
+            self.evictions += 1
+
+    # Просроченная или вытесненная запись уходит и из SQLite, иначе таблица
+    # растёт без предела между перезапусками
+    def _evict(self, cache_key):
+        self._drop(cache_key)
+        if self._executor is not None:
+            link, date_from, date_to = cache_key
+            self._persist('DELETE FROM stats_cache WHERE link = ? AND date_from = ? AND date_to = ?', (link, date_from or '', date_to or ''))
+
+    def _drop(self, cache_key):
+        self._entries.pop(cache_key, None)
+        keys = self._by_link.get(cache_key[0])
+        if keys is not None:
+            keys.discard(cache_key)
+            if not keys:
+                del self._by_link[cache_key[0]]
@@ -0,0 +1,432 @@
+import os
+import abc
+import json
+import time
+import asyncio
+import datetime
+import itertools
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+from migrations import migrate
+from short_cache import canonical_url
+
+# Бэкенд хранилища: json (links.json) или sqlite (links.db)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")
+LINKS_PATH = os.getenv("LINKS_PATH", "links.json")
+DB_PATH = os.getenv("DB_PATH", "links.db")
+# Настройки соединения SQLite
+SQLITE_CACHE_KB = int(os.getenv("SQLITE_CACHE_KB", "8192"))
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_STATEMENT_CACHE = int(os.getenv("SQLITE_STATEMENT_CACHE", "256"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+# Минимум записей в журнале до перезаписи снимка; порог растёт вместе с
+# объёмом данных, чтобы сворачивание оставалось O(1) в пересчёте на вставку
+JOURNAL_COMPACT_EVERY = int(os.getenv("JOURNAL_COMPACT_EVERY", "1000"))
+JOURNAL_FSYNC = os.getenv("JOURNAL_FSYNC", "1") != "0"
+# Сколько последних ссылок хранить на пользователя в links.json; 0 — без ограничения
+LINKS_MAX_PER_USER = int(os.getenv("LINKS_MAX_PER_USER", "0"))
+# Ссылок на странице в списках
+LINKS_PAGE_SIZE = int(os.getenv("LINKS_PAGE_SIZE", "10"))
+
+
+# Страница списка ссылок: prev_cursor листает назад (backward=True),
+# next_cursor — вперёд; None — в эту сторону ссылок больше нет
+class LinkPage:
+    def __init__(self, items, prev_cursor=None, next_cursor=None):
+        self.items = items
+        self.prev_cursor = prev_cursor
+        self.next_cursor = next_cursor
+
+
+# Общий асинхронный интерфейс: дисковые операции идут в отдельном потоке,
+# один поток на хранилище сохраняет порядок записей
+class BaseStorage(abc.ABC):
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=type(self).__name__)
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    @abc.abstractmethod
+    async def get_user_links(self, user_id):
+        ...
+
+    @abc.abstractmethod
+    async def add_link(self, user_id, link_data):
+        ...
+
+    # Страница ссылок после курсора (до него при backward); без курсора — первая.
+    # folder: None — все ссылки, 0 — вне папок, иначе id папки
+    @abc.abstractmethod
+    async def get_links_page(self, user_id, cursor=None, backward=False, limit=LINKS_PAGE_SIZE, folder=None):
+        ...
+
+    # Короткая ссылка, уже выданная на этот канонический адрес любому пользователю
+    @abc.abstractmethod
+    async def find_short(self, canonical):
+        ...
+
+    async def close(self):
+        await self._run(self._close)
+        self._executor.shutdown(wait=True)
+
+    def _close(self):
+        pass
+
+
+# Ссылки одного пользователя в порядке добавления и индекс по короткой
+# ссылке. Вытесненные ссылки вычищаются из начала списка лениво, без сдвига
+# на каждое удаление; номер ссылки (seq) при этом не меняется и служит
+# курсором страниц
+class UserLinks:
+    # Сжимать список, когда вытесненных не меньше этого числа и половины списка
+    COMPACT_MIN = 64
+
+    def __init__(self):
+        self._items = []
+        self._head = 0
+        self._base = 0
+        self.by_short = {}
+
+    def __len__(self):
+        return len(self._items) - self._head
+
+    def __iter__(self):
+        return itertools.islice(self._items, self._head, None)
+
+    def get(self, short):
+        return self.by_short.get(short)
+
+    # Новая ссылка встаёт в конец; повтор короткой ссылки только обновляет
+    # название, как upsert в SqliteStorage. True — ссылка добавлена
+    def add(self, link_data):
+        existing = self.by_short.get(link_data.get('short'))
+        if existing is not None:
+            existing['title'] = link_data.get('title', existing.get('title'))
+            return False
+        self._items.append(link_data)
+        self.by_short[link_data.get('short')] = link_data
+        return True
+
+    def pop_oldest(self):
+        link_data = self._items[self._head]
+        self._items[self._head] = None
+        self._head += 1
+        if self.by_short.get(link_data.get('short')) is link_data:
+            del self.by_short[link_data.get('short')]
+        if self._head >= self.COMPACT_MIN and self._head * 2 >= len(self._items):
+            del self._items[:self._head]
+            self._base += self._head
+            self._head = 0
+        return link_data
+
+    # Курсор — seq граничной ссылки, страница — срез O(limit)
+    def page(self, cursor, backward, limit):
+        first, end = self._base + self._head, self._base + len(self._items)
+        if cursor is None:
+            start, stop = first, min(first + limit, end)
+        elif backward:
+            stop = min(cursor, end)
+            start = max(first, stop - limit)
+        else:
+            start = max(first, cursor + 1)
+            stop = min(start + limit, end)
+        if start >= stop:
+            if cursor is None:
+                return LinkPage([])
+            # Ссылки за курсором пропали — показываем первую страницу
+            return self.page(None, False, limit)
+        items = self._items[start - self._base:stop - self._base]
+        return LinkPage(items, start if start > first else None, stop - 1 if stop < end else None)
+
+
+# Хранилище ссылок: снимок links.json + журнал добавлений links.json.journal
+class JsonStorage(BaseStorage):
+    def __init__(self, file_name=LINKS_PATH, compact_every=JOURNAL_COMPACT_EVERY, fsync=JOURNAL_FSYNC, max_links=LINKS_MAX_PER_USER):
+        super().__init__()
+        self.file_name = file_name
+        self.journal_name = f"{file_name}.journal"
+        self.compact_every = compact_every
+        self.fsync = fsync
+        self.max_links = max_links
+        self.data = {}
+        self.by_canonical = {}
+        self.link_count = 0
+        for user_id, links in self._load_data().items():
+            for link_data in links:
+                self._apply(user_id, link_data)
+        self.journal_size = self._replay_journal()
+        self._journal = open(self.journal_name, 'a', encoding='utf-8')
+
+    def _load_data(self):
+        try:
+            with open(self.file_name, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            logger.info("Файл links.json не найден, создаётся новый")
+            return {}
+        except json.JSONDecodeError as e:
+            logger.error(f"Ошибка чтения JSON: {e}")
+            return {}
+
+    def _replay_journal(self):
+        count = 0
+        valid_size = 0
+        try:
+            with open(self.journal_name, 'rb') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except (json.JSONDecodeError, UnicodeDecodeError):
+                        entry = None
+                    if entry is None or not line.endswith(b"\n"):
+                        # Недописанная при падении строка — последняя в журнале
+                        logger.warning("Пропущена повреждённая запись журнала")
+                        break
+                    self._apply(entry["user_id"], entry["link"])
+                    valid_size += len(line)
+                    count += 1
+                truncated = f.tell() != valid_size
+        except FileNotFoundError:
+            return 0
+        if truncated:
+            # Обрезаем хвост, чтобы новые записи не склеились с битой строкой
+            os.truncate(self.journal_name, valid_size)
+        if count:
+            logger.info(f"Из журнала восстановлено {count} записей")
+        return count
+
+    def _apply(self, user_id, link_data):
+        links = self.data.get(user_id)
+        if links is None:
+            links = self.data[user_id] = UserLinks()
+        if not links.add(link_data):
+            return
+        self._index(link_data)
+        self.link_count += 1
+        while self.max_links and len(links) > self.max_links:
+            self._unindex(links.pop_oldest())
+            self.link_count -= 1
+
+    def _index(self, link_data):
+        if link_data.get('original') and link_data.get('short'):
+            self.by_canonical[canonical_url(link_data['original'])] = link_data['short']
+
+    def _unindex(self, link_data):
+        key = canonical_url(link_data.get('original', ''))
+        if self.by_canonical.get(key) == link_data.get('short'):
+            del self.by_canonical[key]
+
+    def _append_journal(self, user_id, link_data):
+        self._journal.write(json.dumps({"user_id": user_id, "link": link_data}, ensure_ascii=False) + "\n")
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+        self.journal_size += 1
+
+    # Снимок пишется во временный файл и атомарно подменяет links.json
+    def _save_data(self):
+        tmp_name = f"{self.file_name}.tmp"
+        try:
+            with open(tmp_name, 'w', encoding='utf-8') as f:
+                json.dump({user_id: list(links) for user_id, links in self.data.items()}, f, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_name, self.file_name)
+        except Exception as e:
+            logger.error(f"Ошибка записи JSON: {e}")
+            raise
+
+    def _compact(self):
+        self._save_data()
+        self._journal.close()
+        self._journal = open(self.journal_name, 'w', encoding='utf-8')
+        self.journal_size = 0
+        logger.info("Журнал ссылок свёрнут в снимок")
+
+    def _close(self):
+        if self.journal_size:
+            self._compact()
+        self._journal.close()
+
+    def _get_user_links(self, user_id):
+        return list(self.data.get(str(user_id), ()))
+
+    # Папок в links.json нет: все ссылки вне папок, в любой папке пусто
+    def _get_links_page(self, user_id, cursor, backward, limit, folder):
+        links = self.data.get(str(user_id))
+        if folder:
+            return LinkPage([])
+        return links.page(cursor, backward, limit) if links is not None else LinkPage([])
+
+    def _add_link(self, user_id, link_data):
+        user_id = str(user_id)
+        self._append_journal(user_id, link_data)
+        self._apply(user_id, link_data)
+        if self.journal_size >= max(self.compact_every, self.link_count):
+            self._compact()
+
+    async def get_user_links(self, user_id):
+        return await self._run(self._get_user_links, user_id)
+
+    async def add_link(self, user_id, link_data):
+        await self._run(self._add_link, user_id, link_data)
+
+    async def get_links_page(self, user_id, cursor=None, backward=False, limit=LINKS_PAGE_SIZE, folder=None):
+        return await self._run(self._get_links_page, user_id, cursor, backward, limit, folder)
+
+    async def find_short(self, canonical):
+        return self.by_canonical.get(canonical)
+
+
+# Хранилище ссылок в SQLite: одно соединение, живущее в потоке хранилища
+class SqliteStorage(BaseStorage):
+    def __init__(self, db_name=DB_PATH):
+        super().__init__()
+        self.db_name = db_name
+        self._conn = None
+        self._executor.submit(self._connect).result()
+
+    @staticmethod
+    def init_schema(conn):
+        migrate(conn)
+        conn.execute('PRAGMA foreign_keys=ON')
+
+    # Соединение открывается один раз: WAL, synchronous=NORMAL и кэш
+    # подготовленных запросов вместо connect + fsync на каждый запрос
+    def _connect(self):
+        try:
+            self._conn = sqlite3.connect(self.db_name, cached_statements=SQLITE_STATEMENT_CACHE)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(f'PRAGMA synchronous={SQLITE_SYNCHRONOUS}')
+            self._conn.execute(f'PRAGMA cache_size=-{SQLITE_CACHE_KB}')
+            self._conn.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}')
+            self._conn.execute('PRAGMA temp_store=MEMORY')
+            self.init_schema(self._conn)
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка инициализации БД: {e}")
+            raise
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _execute(self, query, params=()):
+        try:
+            c = self._conn.execute(query, params)
+            self._conn.commit()
+            return c.fetchall() if query.lstrip().upper().startswith('SELECT') else c.rowcount
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка запроса к БД: {e}")
+            raise
+
+    async def execute(self, query, params=()):
+        return await self._run(self._execute, query, params)
+
+    def _executemany(self, query, seq_of_params):
+        try:
+            with self._conn:
+                return self._conn.executemany(query, seq_of_params).rowcount
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка запроса к БД: {e}")
+            raise
+
+    async def executemany(self, query, seq_of_params):
+        return await self._run(self._executemany, query, list(seq_of_params))
+
+    # Несколько запросов одной транзакцией
+    def _transaction(self, statements):
+        try:
+            with self._conn:
+                return sum(self._conn.execute(query, params).rowcount for query, params in statements)
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка транзакции БД: {e}")
+            raise
+
+    async def transaction(self, statements):
+        return await self._run(self._transaction, statements)
+
+    # Повторное сохранение той же короткой ссылки обновляет название
+    async def insert_link(self, user_id, title, short, original, created=None):
+        return await self.execute(
+            'INSERT INTO links (user_id, title, short, original, created, canonical) VALUES (?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (user_id, short) DO UPDATE SET title = excluded.title',
+            (int(user_id), title, short, original, int(created if created is not None else time.time()), canonical_url(original))
+        )
+
+    # Пакет ссылок одной транзакцией; entries — словари title/short/original
+    async def insert_links(self, user_id, entries, created=None):
+        created = int(created if created is not None else time.time())
+        return await self.executemany(
+            'INSERT INTO links (user_id, title, short, original, created, canonical) VALUES (?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (user_id, short) DO UPDATE SET title = excluded.title',
+            [(int(user_id), e['title'], e['short'], e['original'], created, canonical_url(e['original'])) for e in entries]
+        )
+
+    async def find_short(self, canonical):
+        rows = await self.execute('SELECT short FROM links WHERE canonical = ? ORDER BY id DESC LIMIT 1', (canonical,))
+        return rows[0][0] if rows else None
+
+    async def get_user_links(self, user_id):
+        rows = await self.execute('SELECT title, short, original, created FROM links WHERE user_id = ? ORDER BY id', (int(user_id),))
+        return [{"title": r[0], "short": r[1], "original": r[2], "created": datetime.datetime.fromtimestamp(r[3]).isoformat()} for r in rows]
+
+    # Keyset-пагинация по id: страница — диапазон индекса (user_id, id) или
+    # (user_id, group_id, id), её цена не зависит от числа ссылок.
+    # folder: None — все ссылки, 0 — вне папок, иначе id папки
+    def _get_links_page(self, user_id, cursor, backward, limit, folder):
+        where, params = 'user_id = ?', (user_id,)
+        if folder == 0:
+            where += ' AND group_id IS NULL'
+        elif folder is not None:
+            where += ' AND group_id = ?'
+            params += (folder,)
+
+        def fetch(op, order, bound):
+            return self._conn.execute(
+                f'SELECT id, title, short, original, created, group_id FROM links WHERE {where} AND id {op} ? ORDER BY id {order} LIMIT ?',
+                (*params, bound, limit + 1)
+            ).fetchall()
+
+        def exists(op, bound):
+            return self._conn.execute(f'SELECT EXISTS (SELECT 1 FROM links WHERE {where} AND id {op} ?)', (*params, bound)).fetchone()[0]
+
+        try:
+            rows = fetch('<', 'DESC', cursor) if backward and cursor is not None else fetch('>', 'ASC', cursor if cursor is not None else -1)
+            if not rows and cursor is not None:
+                # Ссылки за курсором удалены — показываем первую страницу
+                backward = False
+                rows = fetch('>', 'ASC', -1)
+            more = len(rows) > limit
+            rows = rows[:limit]
+            if not rows:
+                return LinkPage([])
+            if backward:
+                rows.reverse()
+                has_prev, has_next = more, exists('>', rows[-1][0])
+            else:
+                has_prev, has_next = exists('<', rows[0][0]), more
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка запроса к БД: {e}")
+            raise
+        items = [{"id": r[0], "title": r[1], "short": r[2], "original": r[3],
+                  "created": datetime.datetime.fromtimestamp(r[4]).isoformat(), "group_id": r[5]} for r in rows]
+        return LinkPage(items, rows[0][0] if has_prev else None, rows[-1][0] if has_next else None)
+
+    async def get_links_page(self, user_id, cursor=None, backward=False, limit=LINKS_PAGE_SIZE, folder=None):
+        return await self._run(self._get_links_page, int(user_id), cursor, backward, limit, folder)
+
+    async def add_link(self, user_id, link_data):
+        created = datetime.datetime.fromisoformat(link_data['created']).timestamp()
+        await self.insert_link(user_id, link_data['title'], link_data['short'], link_data['original'], created)
+
+
+def create_storage(backend=STORAGE_BACKEND):
+    if backend == "sqlite":
+        return SqliteStorage()
+    if backend == "json":
+        return JsonStorage()
+    raise ValueError(f"Неизвестный STORAGE_BACKEND: {backend}")
@@ -0,0 +1,29 @@
+import time
+import asyncio
+from bulk import BulkReport, shorten_bulk
+
+
+def run_bulk(count, interval, delay=0.0):
+    shown = []
+
+    async def shorten(url):
+        await asyncio.sleep(delay)
+        return f"https://vk.cc/{url}", None
+
+    async def progress(done, total):
+        shown.append((time.monotonic(), done, total))
+
+    asyncio.run(shorten_bulk(BulkReport([str(i) for i in range(count)]), shorten, progress, interval=interval))
+    return shown
+
+
+def test_final_progress_is_not_repeated():
+    # Все ссылки готовы сразу: первое же обновление уже итоговое
+    shown = run_bulk(3, interval=0.0)
+    assert [(done, total) for _, done, total in shown] == [(1, 3), (2, 3), (3, 3)]
+
+
+def test_final_progress_waits_for_interval():
+    shown = run_bulk(5, interval=0.3, delay=0.01)
+    assert shown[-1][1:] == (5, 5)
+    assert all(b[0] - a[0] >= 0.3 - 0.01 for a, b in zip(shown, shown[1:]))
@@ -0,0 +1,51 @@
+import asyncio
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import StorageKey
+from fsm_storage import SqliteFsmStorage
+
+
+class Form(StatesGroup):
+    waiting_for_link = State()
+    waiting_for_title = State()
+
+
+KEY = StorageKey(bot_id=1, chat_id=5, user_id=5)
+
+
+def run_with_storage(tmp_path, test):
+    async def run():
+        storage = SqliteFsmStorage(str(tmp_path / "fsm.db"))
+        try:
+            return await test(storage)
+        finally:
+            await storage.close()
+    return asyncio.run(run())
+
+
+def test_update_if_applies_only_when_guard_matches(tmp_path):
+    async def test(storage):
+        await storage.set_state(KEY, Form.waiting_for_link)
+        await storage.set_data(KEY, {"short": "https://vk.cc/a"})
+        stale = await storage.update_if(KEY, Form.waiting_for_link, {"short": "https://vk.cc/old"}, {"suggested_title": "x"})
+        applied = await storage.update_if(KEY, Form.waiting_for_link, {"short": "https://vk.cc/a"}, {"suggested_title": "Title"})
+        return stale, applied, await storage.get_state(KEY), await storage.get_data(KEY)
+    stale, applied, state, data = run_with_storage(tmp_path, test)
+    assert not stale and applied
+    assert state == Form.waiting_for_link.state
+    assert data == {"short": "https://vk.cc/a", "suggested_title": "Title"}
+
+
+def test_update_if_does_not_clear_a_newer_flow(tmp_path):
+    async def test(storage):
+        await storage.set_state(KEY, Form.waiting_for_link)
+        await storage.set_data(KEY, {"short": "https://vk.cc/a"})
+        # Пользователь успел перейти к вводу названия
+        await storage.set_state(KEY, Form.waiting_for_title)
+        cleared = await storage.update_if(KEY, Form.waiting_for_link, {"short": "https://vk.cc/a"}, clear=True)
+        kept = (await storage.get_state(KEY), await storage.get_data(KEY))
+        await storage.set_state(KEY, Form.waiting_for_link)
+        cleared_now = await storage.update_if(KEY, Form.waiting_for_link, {"short": "https://vk.cc/a"}, clear=True)
+        return cleared, kept, cleared_now, await storage.get_state(KEY), await storage.get_data(KEY)
+    cleared, kept, cleared_now, state, data = run_with_storage(tmp_path, test)
+    assert not cleared and kept == (Form.waiting_for_title.state, {"short": "https://vk.cc/a"})
+    assert cleared_now and state is None and data == {}
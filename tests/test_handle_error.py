@@ -0,0 +1,35 @@
+import os
+import sys
+import json
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Модули ботов создают хранилища при импорте — импортируем их в отдельном
+# процессе с рабочим каталогом во временной папке
+CHECK = """
+import json, importlib.util
+from aiogram.dispatcher.event.handler import CallableObject
+spec = importlib.util.spec_from_file_location("bot", {path!r})
+bot = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(bot)
+handler = CallableObject(bot.cmd_start)
+print(json.dumps({{"name": bot.cmd_start.__name__, "varkw": handler.varkw, "params": sorted(handler.params)}}))
+"""
+
+
+def inspect_bot(tmp_path, file_name):
+    env = dict(os.environ, PYTHONPATH=ROOT, DB_PATH=str(tmp_path / "links.db"), LINKS_PATH=str(tmp_path / "links.json"))
+    result = subprocess.run([sys.executable, "-c", CHECK.format(path=os.path.join(ROOT, file_name))],
+                            cwd=tmp_path, env=env, capture_output=True, text=True, timeout=60, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_main_handlers_keep_signature(tmp_path):
+    info = inspect_bot(tmp_path, "main.py")
+    assert info == {"name": "cmd_start", "varkw": False, "params": ["message", "state"]}
+
+
+def test_main_clean_handlers_keep_signature(tmp_path):
+    info = inspect_bot(tmp_path, "main_clean_fixed (1).py")
+    assert info["name"] == "cmd_start" and not info["varkw"]
@@ -0,0 +1,55 @@
+import re
+import asyncio
+from metrics import Metrics, HandlerMetrics
+
+# Строка образца: имя{метки} значение
+SAMPLE_RE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\]|\\.)*"(,[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\]|\\.)*")*\})? (\S+)$')
+
+
+def parse(text):
+    samples = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        match = SAMPLE_RE.match(line)
+        assert match, f"не формат Prometheus: {line!r}"
+        samples[line.rsplit(" ", 1)[0]] = float(match.group(3))
+    return samples
+
+
+def test_render_is_valid_exposition_format():
+    registry = Metrics()
+    registry.counter("calls_total", "Вызовы", ("method",)).inc('utils."get"\nLink')
+    registry.histogram("latency_seconds", "Время", ("method",), buckets=(0.1, 1)).observe(0.5, "m")
+    registry.register_stats("short_cache", lambda: {"enabled": True, "hits": 3, "hit_ratio": 0.75, "last_sync": None})
+    samples = parse(asyncio.run(registry.render()))
+    assert samples['short_cache_stats{field="enabled"}'] == 1
+    assert samples['short_cache_stats{field="hit_ratio"}'] == 0.75
+    assert 'short_cache_stats{field="last_sync"}' not in samples
+    assert samples['latency_seconds_bucket{method="m",le="0.1"}'] == 0
+    assert samples['latency_seconds_bucket{method="m",le="1"}'] == 1
+    assert samples['latency_seconds_bucket{method="m",le="+Inf"}'] == 1
+    assert samples['latency_seconds_count{method="m"}'] == 1
+    assert samples['calls_total{method="utils.\\"get\\"\\nLink"}'] == 1
+
+
+def test_handler_metrics_labels_by_handler_name():
+    class Handler:
+        @staticmethod
+        async def callback():
+            pass
+
+    async def failing(event, data):
+        raise ValueError("boom")
+
+    async def run():
+        middleware = HandlerMetrics()
+        try:
+            await middleware(failing, None, {"handler": Handler()})
+        except ValueError:
+            pass
+    from metrics import metrics
+    asyncio.run(run())
+    samples = parse(asyncio.run(metrics.render()))
+    assert samples['bot_handler_errors_total{handler="callback"}'] >= 1
+    assert samples['bot_handler_duration_seconds_count{handler="callback"}'] >= 1
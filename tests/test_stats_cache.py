@@ -0,0 +1,50 @@
+import threading
+import sqlite3
+from stats_cache import StatsCache
+
+
+def test_entries_survive_restart(tmp_path):
+    db_path = str(tmp_path / "stats.db")
+    cache = StatsCache(db_path=db_path)
+    cache.set("abc", "2025-01-01", "2025-01-31", [{"views": 5}])
+    cache.set("gone", None, None, [{"views": 1}])
+    cache.invalidate("gone")
+    cache.close()
+    reopened = StatsCache(db_path=db_path)
+    assert reopened.get("abc", "2025-01-01", "2025-01-31") == [{"views": 5}]
+    assert reopened.get("gone") is None
+    reopened.close()
+
+
+def test_sqlite_writes_leave_the_calling_thread(tmp_path):
+    cache = StatsCache(db_path=str(tmp_path / "stats.db"))
+    release = threading.Event()
+    threads = []
+    write = cache._write
+
+    def slow_write(query, params):
+        threads.append(threading.current_thread())
+        release.wait(5)
+        write(query, params)
+    cache._write = slow_write
+    # set() возвращается, пока запись в SQLite ещё висит в потоке кэша
+    cache.set("abc", None, None, [{"views": 1}])
+    assert cache.get("abc") == [{"views": 1}]
+    release.set()
+    cache.close()
+    assert threads and threads[0] is not threading.current_thread()
+
+
+def test_evicted_and_expired_entries_leave_sqlite(tmp_path):
+    db_path = str(tmp_path / "stats.db")
+    cache = StatsCache(max_entries=2, db_path=db_path)
+    cache.set("old", None, None, [{"views": 1}])
+    cache.set("a", None, None, [{"views": 2}])
+    cache.set("b", None, None, [{"views": 3}])
+    cache.set("short", "2025-01-01", None, [{"views": 4}], ttl=-1)
+    assert cache.get("short", "2025-01-01") is None
+    cache.close()
+    conn = sqlite3.connect(db_path)
+    links = sorted(link for link, in conn.execute("SELECT link FROM stats_cache"))
+    conn.close()
+    assert links == ["b"]
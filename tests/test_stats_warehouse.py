@@ -0,0 +1,108 @@
+import time
+import asyncio
+import datetime
+from storage import SqliteStorage
+from stats_agg import summarize_link_stats
+from stats_warehouse import StatsWarehouse, STATS_TZ
+
+DAY = 24 * 3600
+
+
+# Поддельный VK: по 10 просмотров (из них 4 — город 1) в каждый из последних
+# days дней, но не раньше создания ссылки
+class FakeVk:
+    def __init__(self, created):
+        self.created = created
+        self.calls = 0
+
+    async def get_link_daily_stats(self, key, days):
+        self.calls += 1
+        now = int(time.time())
+        stats = [{"timestamp": now - i * DAY, "views": 10, "cities": [{"city_id": 1, "views": 4}]}
+                 for i in range(days) if now - i * DAY >= self.created[key] - DAY]
+        return {"stats": stats}
+
+
+async def make_warehouse(tmp_path, links):
+    db = SqliteStorage(str(tmp_path / "links.db"))
+    created = {}
+    for key, age_days in links.items():
+        created[key] = int(time.time()) - age_days * DAY
+        await db.insert_link(1, key, f"https://vk.cc/{key}", f"https://example.com/{key}", created[key])
+    return db, StatsWarehouse(db, FakeVk(created), enabled=True)
+
+
+def day(days_ago):
+    return (datetime.datetime.now(STATS_TZ).date() - datetime.timedelta(days=days_ago)).isoformat()
+
+
+def test_new_link_is_loaded_on_first_view(tmp_path):
+    async def run():
+        db, warehouse = await make_warehouse(tmp_path, {"new": 2})
+        stats = await warehouse.get_stats_many(["https://vk.cc/new"])
+        summary = await warehouse.get_summary(["https://vk.cc/new"])
+        await db.close()
+        return stats, summary, warehouse.vk.calls
+    stats, summary, calls = asyncio.run(run())
+    assert stats[0]["views"] > 0 and stats[0]["cities"]["1"] > 0
+    assert summary.total == stats[0]["views"] and summary.daily
+    assert calls == 1
+
+
+def test_periods_before_coverage_are_left_to_vk(tmp_path):
+    async def run():
+        db, warehouse = await make_warehouse(tmp_path, {"old": 300, "new": 5})
+        shorts = ["https://vk.cc/old", "https://vk.cc/new"]
+        all_time = await warehouse.get_stats_many(shorts)
+        recent = await warehouse.get_stats_many(shorts, day(10), day(0))
+        before = await warehouse.get_stats_many(shorts, day(200), day(0))
+        summaries = [await warehouse.get_summary(shorts), await warehouse.get_summary(shorts, day(10), day(0))]
+        await db.close()
+        return all_time, recent, before, summaries
+    all_time, recent, before, summaries = asyncio.run(run())
+    # Старая ссылка целиком не покрыта, новая — с самого создания
+    assert all_time[0] is None and all_time[1]["views"] > 0
+    assert recent[0]["views"] > 0 and recent[1]["views"] > 0
+    assert before[0] is None and before[1] is not None
+    assert summaries[0] is None and summaries[1].total == recent[0]["views"] + recent[1]["views"]
+
+
+def test_without_vk_client_unsynced_links_are_left_to_caller(tmp_path):
+    async def run():
+        db, warehouse = await make_warehouse(tmp_path, {"new": 1})
+        warehouse.vk = None
+        stats = await warehouse.get_stats_many(["https://vk.cc/new"])
+        await db.close()
+        return stats
+    assert asyncio.run(run()) == [None]
+
+
+def test_requested_links_are_synced_in_background(tmp_path):
+    async def run():
+        db, warehouse = await make_warehouse(tmp_path, {"old": 3})
+        warehouse.interval = 3600
+        warehouse.start()
+        await asyncio.sleep(0.1)
+        warehouse.vk.created["added"] = int(time.time())
+        await db.insert_link(1, "added", "https://vk.cc/added", "https://example.com/added")
+        warehouse.request_sync(["https://vk.cc/added"])
+        await asyncio.sleep(0.1)
+        synced = await db.execute('SELECT link FROM link_stats_sync ORDER BY link')
+        await warehouse.stop()
+        await db.close()
+        return [row[0] for row in synced], warehouse.vk.calls
+    synced, calls = asyncio.run(run())
+    assert synced == ["https://vk.cc/added", "https://vk.cc/old"] and calls == 2
+
+
+def test_daily_series_matches_summary(tmp_path):
+    async def run():
+        db, warehouse = await make_warehouse(tmp_path, {"a": 30, "b": 3})
+        shorts = ["https://vk.cc/a", "https://vk.cc/b"]
+        stats = await warehouse.get_stats_many(shorts, day(10), day(0), daily=True)
+        summary = await warehouse.get_summary(shorts, day(10), day(0))
+        await db.close()
+        return stats, summary
+    stats, summary = asyncio.run(run())
+    live = summarize_link_stats(stats)
+    assert live.daily == list(summary.daily) and live.total == summary.total
@@ -0,0 +1,81 @@
+import asyncio
+import datetime
+from aiogram import Bot, Dispatcher, Router, F
+from aiogram.filters import StateFilter
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.types import Update
+from update_scheduler import setup_scheduler
+
+
+class Form(StatesGroup):
+    waiting_for_link = State()
+    waiting_for_title = State()
+
+
+def message_update(update_id, text, user_id=5):
+    user = {"id": user_id, "is_bot": False, "first_name": "u"}
+    return Update(update_id=update_id, message={
+        "message_id": update_id, "date": int(datetime.datetime.now().timestamp()),
+        "chat": {"id": user_id, "type": "private"}, "from": user, "text": text,
+    })
+
+
+def make_dispatcher(seen):
+    dp = Dispatcher()
+    router = Router()
+
+    @router.message(StateFilter(None), F.text == "/add")
+    async def start(message, state: FSMContext):
+        await state.set_state(Form.waiting_for_link)
+
+    @router.message(Form.waiting_for_link)
+    async def link(message, state: FSMContext):
+        # Обработчик уступает цикл событий до смены состояния
+        await asyncio.sleep(0.01)
+        seen.append(("link", message.text))
+        await state.set_state(Form.waiting_for_title)
+
+    @router.message(Form.waiting_for_title)
+    async def title(message, state: FSMContext):
+        seen.append(("title", message.text))
+        await state.clear()
+
+    dp.include_router(router)
+    return dp
+
+
+def test_back_to_back_updates_see_previous_state():
+    async def run():
+        seen = []
+        dp = make_dispatcher(seen)
+        setup_scheduler(dp)
+        bot = Bot("123:abc")
+        await dp.feed_update(bot, message_update(1, "/add"))
+        await asyncio.gather(dp.feed_update(bot, message_update(2, "https://a")),
+                             dp.feed_update(bot, message_update(3, "My title")))
+        await bot.session.close()
+        return seen
+    assert asyncio.run(run()) == [("link", "https://a"), ("title", "My title")]
+
+
+def test_scheduler_runs_before_fsm_middleware():
+    dp = Dispatcher()
+    scheduler = setup_scheduler(dp)
+    middlewares = list(dp.update.outer_middleware)
+    assert middlewares.index(scheduler) + 1 == middlewares.index(dp.fsm)
+
+
+def test_different_users_run_in_parallel():
+    async def run():
+        seen = []
+        dp = make_dispatcher(seen)
+        scheduler = setup_scheduler(dp)
+        bot = Bot("123:abc")
+        await asyncio.gather(*(dp.feed_update(bot, message_update(uid, "/add", uid)) for uid in (1, 2)))
+        await asyncio.gather(*(dp.feed_update(bot, message_update(10 + uid, f"https://{uid}", uid)) for uid in (1, 2)))
+        await bot.session.close()
+        return seen, scheduler.stats()
+    seen, stats = asyncio.run(run())
+    assert sorted(seen) == [("link", "https://1"), ("link", "https://2")]
+    assert stats["processed"] == 4 and stats["in_flight"] == 0 and stats["queued"] == 0
@@ -0,0 +1,94 @@
+import re
+import asyncio
+from collections import Counter
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from http_client import http
+from vk_api import VkApi, VkScheduler, SingleFlight
+
+
+# Поддельный VK: считает запросы по методам; execute отвечает false на
+# вызовы с ключом bad*, как VK на упавший внутри execute метод
+def make_vk_app(requests, delay=0.0):
+    async def handle(request):
+        method = request.match_info["method"]
+        requests[method] += 1
+        data = await request.post()
+        await asyncio.sleep(delay)
+        if method == "execute":
+            keys = re.findall(r'"key": "([^"]+)"', data["code"])
+            return web.json_response({"response": [False if key.startswith("bad") else {"key": key} for key in keys]})
+        if method == "utils.getLinkStats":
+            return web.json_response({"response": {"key": data["key"]}})
+        if method == "utils.getShortLink":
+            return web.json_response({"response": {"short_url": "https://vk.cc/x", "url": data["url"]}})
+        return web.json_response({"error": {"error_code": 3, "error_msg": "Unknown method"}})
+
+    app = web.Application()
+    app.router.add_post("/{method}", handle)
+    return app
+
+
+async def with_vk(requests, test, delay=0.0):
+    server = TestServer(make_vk_app(requests, delay))
+    await server.start_server()
+    await http.start()
+    try:
+        vk = VkApi("token", base_url=str(server.make_url("/")), scheduler=VkScheduler(rate=1000, burst=1000))
+        return await test(vk)
+    finally:
+        await http.close()
+        await server.close()
+
+
+def test_link_stats_are_batched_into_execute():
+    requests = Counter()
+    keys = [f"bad{i}" if i in (3, 30) else f"key{i}" for i in range(51)]
+
+    async def test(vk):
+        return await asyncio.gather(*(vk.get_link_stats(key) for key in keys))
+
+    results = asyncio.run(with_vk(requests, test))
+    assert [result["key"] for result in results] == keys
+    # 25 + 25 в execute, 51-й одиночным вызовом, плюс повтор двух false по одному
+    assert requests == {"execute": 2, "utils.getLinkStats": 3}
+
+
+def test_identical_in_flight_calls_are_deduplicated():
+    requests = Counter()
+
+    async def test(vk):
+        results = await asyncio.gather(*(vk.get_short_link("https://example.com") for _ in range(10)),
+                                       vk.get_short_link("https://other.example"))
+        return results, vk.deduplicated
+
+    results, deduplicated = asyncio.run(with_vk(requests, test, delay=0.05))
+    assert requests == {"utils.getShortLink": 2}
+    assert deduplicated == 9
+    assert all(result["url"] == "https://example.com" for result in results[:10])
+
+
+def test_finished_call_is_not_reused():
+    requests = Counter()
+
+    async def test(vk):
+        await vk.get_short_link("https://example.com")
+        await vk.get_short_link("https://example.com")
+
+    asyncio.run(with_vk(requests, test))
+    assert requests == {"utils.getShortLink": 2}
+
+
+def test_late_caller_does_not_get_finished_task():
+    async def run():
+        flight = SingleFlight()
+        calls = []
+
+        async def factory():
+            calls.append(1)
+            return len(calls)
+        first = await flight.run("key", factory)
+        # Сразу после завершения, до того как отработали бы done-callback'и
+        second = await flight.run("key", factory)
+        return first, second, flight.deduplicated
+    assert asyncio.run(run()) == (1, 2, 0)
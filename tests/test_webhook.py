@@ -0,0 +1,90 @@
+import asyncio
+import datetime
+from aiohttp.test_utils import TestClient, TestServer
+from aiogram import Bot, Dispatcher, Router
+from update_scheduler import setup_scheduler
+from webhook import build_app
+
+SECRET = "s3cret"
+
+
+def update(update_id, user_id):
+    user = {"id": user_id, "is_bot": False, "first_name": "u"}
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": int(datetime.datetime.now().timestamp()),
+        "chat": {"id": user_id, "type": "private"}, "from": user, "text": "hi",
+    }}
+
+
+# Бот с обработчиком, который ждёт release и запоминает пик одновременных вызовов
+async def run_with_client(test, limit=2):
+    dp = Dispatcher()
+    router = Router()
+    state = {"running": 0, "peak": 0, "done": 0, "release": asyncio.Event()}
+
+    @router.message()
+    async def handler(message):
+        state["running"] += 1
+        state["peak"] = max(state["peak"], state["running"])
+        await state["release"].wait()
+        state["running"] -= 1
+        state["done"] += 1
+
+    dp.include_router(router)
+    scheduler = setup_scheduler(dp, limit=limit)
+    bot = Bot("123:abc")
+    client = TestClient(TestServer(build_app(dp, bot, scheduler, path="/webhook", secret=SECRET)))
+    await client.start_server()
+    try:
+        return await test(client, state, scheduler)
+    finally:
+        state["release"].set()
+        await client.close()
+
+
+def post(client, body, secret=SECRET):
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret is not None else {}
+    return client.post("/webhook", json=body, headers=headers)
+
+
+def test_secret_token_is_checked():
+    async def test(client, state, scheduler):
+        statuses = []
+        for secret in (None, "wrong", SECRET):
+            resp = await post(client, update(len(statuses) + 1, 1), secret)
+            statuses.append(resp.status)
+        return statuses
+    assert asyncio.run(run_with_client(test)) == [401, 401, 200]
+
+
+def test_background_handling_is_capped():
+    async def test(client, state, scheduler):
+        # Telegram получает 200 сразу, не дожидаясь обработчиков
+        for i in range(5):
+            resp = await post(client, update(i + 1, 100 + i))
+            assert resp.status == 200
+        for _ in range(100):
+            if scheduler.stats()["in_flight"] == 2 and scheduler.stats()["queued"] == 3:
+                break
+            await asyncio.sleep(0.01)
+        stats = scheduler.stats()
+        state["release"].set()
+        for _ in range(100):
+            if state["done"] == 5:
+                break
+            await asyncio.sleep(0.01)
+        return stats, state["peak"], state["done"]
+    stats, peak, done = asyncio.run(run_with_client(test, limit=2))
+    assert stats["in_flight"] == 2 and stats["queued"] == 3
+    assert peak == 2 and done == 5
+
+
+def test_health_reports_scheduler_stats():
+    async def test(client, state, scheduler):
+        await post(client, update(1, 1))
+        await asyncio.sleep(0.05)
+        resp = await client.get("/health")
+        return resp.status, await resp.json()
+    status, body = asyncio.run(run_with_client(test))
+    assert status == 200
+    assert body["status"] == "ok" and body["in_flight"] == 1 and body["limit"] == 2
@@ -0,0 +1,95 @@
+import os
+import asyncio
+from aiogram import BaseMiddleware
+
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "100"))
+
+
+# Апдейты разных пользователей обрабатываются параллельно, одного
+# пользователя — строго по очереди (иначе ломаются шаги FSM)
+class UpdateScheduler(BaseMiddleware):
+    def __init__(self, limit=MAX_CONCURRENT_UPDATES):
+        self.limit = limit
+        self.semaphore = asyncio.Semaphore(limit)
+        self._tails = {}
+        self._depth = {}
+        self.in_flight = 0
+        self.queued = 0
+        self.processed = 0
+        self.max_queue_depth = 0
+
+    def stats(self):
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "active_users": len(self._depth),
+            "max_queue_depth": self.max_queue_depth,
+            "processed": self.processed,
+            "limit": self.limit,
+        }
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        self.queued += 1
+        if user is None:
+            return await self._run(handler, event, data)
+        key = user.id
+        # Место в очереди занимается до первого await, поэтому порядок
+        # совпадает с порядком поступления апдейтов
+        previous = self._tails.get(key)
+        done = asyncio.get_running_loop().create_future()
+        self._tails[key] = done
+        self._depth[key] = self._depth.get(key, 0) + 1
+        self.max_queue_depth = max(self.max_queue_depth, self._depth[key])
+        try:
+            if previous is not None and not previous.done():
+                # shield: отмена этого апдейта не должна отменять чужой future
+                try:
+                    await asyncio.shield(previous)
+                except asyncio.CancelledError:
+                    self.queued -= 1
+                    raise
+            return await self._run(handler, event, data)
+        finally:
+            self._release(key, previous, done)
+
+    async def _run(self, handler, event, data):
+        started = False
+        try:
+            await self.semaphore.acquire()
+            self.queued -= 1
+            started = True
+            self.in_flight += 1
+            try:
+                return await handler(event, data)
+            finally:
+                self.in_flight -= 1
+                self.processed += 1
+                self.semaphore.release()
+        finally:
+            if not started:
+                self.queued -= 1
+
+    def _release(self, key, previous, done):
+        self._depth[key] -= 1
+        if not self._depth[key]:
+            del self._depth[key]
+        if self._tails.get(key) is done:
+            del self._tails[key]
+        # Если ожидание отменили, следующий апдейт всё равно ждёт предыдущий
+        if previous is not None and not previous.done():
+            previous.add_done_callback(lambda _: done.done() or done.set_result(None))
+        elif not done.done():
+            done.set_result(None)
+
+
+# Очередь встаёт сразу перед FSMContextMiddleware: пользователь апдейта уже
+# известен, а состояние FSM читается только после ожидания предыдущего апдейта
+def setup_scheduler(dp, limit=MAX_CONCURRENT_UPDATES):
+    scheduler = UpdateScheduler(limit)
+    middlewares = dp.update.outer_middleware._middlewares
+    if dp.fsm in middlewares:
+        middlewares.insert(middlewares.index(dp.fsm), scheduler)
+    else:
+        middlewares.append(scheduler)
+    return scheduler
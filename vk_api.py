@@ -0,0 +1,284 @@
+import os
+import asyncio
+import contextvars
+import json
+import time
+from collections import deque
+import aiohttp
+from loguru import logger
+from http_client import http
+from metrics import metrics
+
+VK_API_URL = os.getenv("VK_API_URL", "https://api.vk.com/method")
+VK_API_VERSION = "5.199"
+# VK разрешает не более 25 обращений к API внутри одного execute
+VK_EXECUTE_LIMIT = 25
+VK_BATCH_DELAY = float(os.getenv("VK_BATCH_DELAY", "0.02"))
+# Бюджет запросов на токен: VK пускает около 3 запросов в секунду
+VK_RPS = float(os.getenv("VK_RPS", "3"))
+VK_BURST = int(os.getenv("VK_BURST", "3"))
+VK_MAX_RETRIES = int(os.getenv("VK_MAX_RETRIES", "5"))
+VK_BACKOFF = float(os.getenv("VK_BACKOFF", "1"))
+VK_TOO_MANY_REQUESTS = 6
+
+# Пользователь, от имени которого идёт вызов (для честной очереди)
+current_user = contextvars.ContextVar("vk_current_user", default=None)
+
+# Вызов — от call() до ответа, с очередью, execute и повторами; запрос — один HTTP-запрос
+VK_CALL_SECONDS = metrics.histogram("vk_call_duration_seconds", "Вызовы VK API до ответа", ("method",))
+VK_REQUEST_SECONDS = metrics.histogram("vk_request_duration_seconds", "HTTP-запросы к VK API", ("method",))
+VK_ERRORS = metrics.counter("vk_errors_total", "Ошибки VK API по коду (network — сетевые)", ("method", "code"))
+
+
+class VkApiError(Exception):
+    def __init__(self, code, msg):
+        super().__init__(f"[{code}] {msg}")
+        self.code = code
+        self.msg = msg
+
+
+# Token bucket: rate токенов в секунду, не больше burst в запасе
+class RateLimiter:
+    def __init__(self, rate=VK_RPS, burst=VK_BURST):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self):
+        now = time.monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds):
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.paused_until = max(self.paused_until, self.updated + seconds)
+
+
+# Планировщик: выдаёт разрешения на запросы по кругу между пользователями
+class VkScheduler:
+    def __init__(self, rate=VK_RPS, burst=VK_BURST):
+        self.limiter = RateLimiter(rate, burst)
+        self._queues = {}
+        self._ring = deque()
+        self._worker = None
+        self.granted = 0
+        self.throttled = 0
+
+    @property
+    def queued(self):
+        return sum(len(q) for q in self._queues.values())
+
+    async def acquire(self, user=None):
+        future = asyncio.get_running_loop().create_future()
+        if user not in self._queues:
+            self._queues[user] = deque()
+            self._ring.append(user)
+        self._queues[user].append(future)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.ensure_future(self._run())
+        await future
+
+    def backoff(self, seconds=VK_BACKOFF):
+        self.throttled += 1
+        self.limiter.pause(seconds)
+
+    async def _run(self):
+        while self._ring:
+            wait = self.limiter.delay()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            user = self._ring.popleft()
+            queue = self._queues[user]
+            future = queue.popleft()
+            if queue:
+                self._ring.append(user)
+            else:
+                del self._queues[user]
+            if future.done():
+                continue
+            self.limiter.take()
+            self.granted += 1
+            future.set_result(None)
+
+
+# Одинаковые вызовы, пришедшие, пока первый ещё выполняется, получают его
+# результат (или исключение) вместо собственного запроса
+class SingleFlight:
+    def __init__(self):
+        self._inflight = {}
+        self.deduplicated = 0
+
+    @staticmethod
+    def make_key(*parts, params):
+        return (*parts, tuple(sorted((k, str(v)) for k, v in params.items())))
+
+    async def _run_and_forget(self, key, factory):
+        # Ключ снимается в самой задаче, а не в done-callback: callback
+        # выполняется позже, и опоздавший вызов успел бы получить готовую задачу
+        try:
+            return await factory()
+        finally:
+            self._inflight.pop(key, None)
+
+    async def run(self, key, factory):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._run_and_forget(key, factory))
+            self._inflight[key] = task
+        else:
+            self.deduplicated += 1
+        # shield: отмена одного ожидающего не отменяет общий запрос
+        return await asyncio.shield(task)
+
+
+# Клиент VK API поверх общей HTTP-сессии
+class VkApi:
+    def __init__(self, token, base_url=VK_API_URL, scheduler=None):
+        self.token = token
+        self.base_url = base_url.rstrip('/')
+        self.scheduler = scheduler or VkScheduler()
+        self.requests_sent = 0
+        self.single_flight = SingleFlight()
+        self.link_stats = ExecuteBatcher(self, "utils.getLinkStats")
+
+    @property
+    def deduplicated(self):
+        return self.single_flight.deduplicated
+
+    async def call(self, method, **params):
+        with VK_CALL_SECONDS.time(method):
+            return await self._shared_call(method, params)
+
+    async def _shared_call(self, method, params):
+        params = {k: v for k, v in params.items() if v is not None}
+        return await self.single_flight.run(SingleFlight.make_key(method, params=params), lambda: self._call(method, params))
+
+    async def _call(self, method, params):
+        params = dict(params)
+        params.update({"access_token": self.token, "v": VK_API_VERSION})
+        for attempt in range(VK_MAX_RETRIES):
+            await self.scheduler.acquire(current_user.get())
+            self.requests_sent += 1
+            try:
+                with VK_REQUEST_SECONDS.time(method):
+                    async with http.session.post(f"{self.base_url}/{method}", data=params, timeout=10) as resp:
+                        data = await resp.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                VK_ERRORS.inc(method, "network")
+                if attempt == VK_MAX_RETRIES - 1:
+                    raise
+                logger.warning(f"Сетевая ошибка VK {method}, повтор: {e}")
+                continue
+            error = data.get("error")
+            if not error:
+                return data.get("response")
+            VK_ERRORS.inc(method, str(error.get("error_code", 0)))
+            # Code 6 — превышен лимит: притормаживаем всю очередь и повторяем
+            if error.get("error_code") == VK_TOO_MANY_REQUESTS and attempt < VK_MAX_RETRIES - 1:
+                self.scheduler.backoff(VK_BACKOFF * (attempt + 1))
+                continue
+            raise VkApiError(error.get("error_code", 0), error.get("error_msg", "Неизвестная ошибка"))
+
+    async def get_short_link(self, url):
+        return await self.call("utils.getShortLink", url=url)
+
+    async def get_cities_by_id(self, city_ids):
+        return await self.call("database.getCitiesById", city_ids=",".join(map(str, city_ids)))
+
+    async def get_link_stats(self, key, date_from=None, date_to=None):
+        params = {"key": key, "extended": 1, "interval": "day"}
+        if date_from and date_to:
+            params.update({"date_from": date_from, "date_to": date_to})
+        return await self.link_stats.submit(params)
+
+    # Статистика по дням за последние days дней (VK отдаёт не больше 100 интервалов)
+    async def get_link_daily_stats(self, key, days):
+        return await self.link_stats.submit({"key": key, "extended": 1, "interval": "day", "intervals_count": days})
+
+
+# Склеивает одновременные вызовы одного метода в один запрос execute
+class ExecuteBatcher:
+    def __init__(self, api, method, max_batch=VK_EXECUTE_LIMIT, delay=VK_BATCH_DELAY):
+        self.api = api
+        self.method = method
+        self.max_batch = min(max_batch, VK_EXECUTE_LIMIT)
+        self.delay = delay
+        self._pending = []
+        self._timer = None
+        # Ссылки на отправки в полёте, чтобы задачи не собрал GC
+        self._tasks = set()
+
+    # Свой префикс ключа: одиночный повтор из _send_single идёт через api._shared_call
+    # с теми же параметрами и не должен ждать сам себя
+    async def submit(self, params):
+        key = SingleFlight.make_key("batch", self.method, params=params)
+        with VK_CALL_SECONDS.time(self.method):
+            return await self.api.single_flight.run(key, lambda: self._submit(params))
+
+    async def _submit(self, params):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((params, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.delay, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending:
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            task = asyncio.ensure_future(self._send(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch):
+        if len(batch) == 1:
+            await self._send_single(*batch[0])
+            return
+        calls = ",".join(f"API.{self.method}({json.dumps(params, ensure_ascii=False)})" for params, _ in batch)
+        try:
+            results = await self.api.call("execute", code=f"return [{calls}];")
+        except Exception as e:
+            logger.warning(f"Ошибка execute для {self.method}, переходим на одиночные вызовы: {e}")
+            results = None
+        if not isinstance(results, list) or len(results) != len(batch):
+            results = [False] * len(batch)
+        # Упавшие внутри execute вызовы возвращаются как false — повторяем их по одному
+        retries = []
+        for (params, future), result in zip(batch, results):
+            if result is False or result is None:
+                retries.append(self._send_single(params, future))
+            elif not future.done():
+                future.set_result(result)
+        if retries:
+            await asyncio.gather(*retries)
+
+    # Мимо call(): вызов уже учтён в метриках через submit
+    async def _send_single(self, params, future):
+        try:
+            result = await self.api._shared_call(self.method, params)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+            return
+        if not future.done():
+            future.set_result(result)
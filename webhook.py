@@ -0,0 +1,47 @@
+import os
+import asyncio
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from loguru import logger
+
+# Режим запуска: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEB_HOST = os.getenv("WEB_HOST", "0.0.0.0")
+WEB_PORT = int(os.getenv("PORT", "8080"))
+
+
+# Параллельность и порядок обработки задаёт UpdateScheduler, подключённый в main()
+def build_app(dp, bot, scheduler, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET):
+    async def health(request):
+        return web.json_response({"status": "ok", **scheduler.stats()})
+
+    app = web.Application()
+    # Telegram получает 200 сразу, апдейт обрабатывается в фоне
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret, handle_in_background=True).register(app, path=path)
+    app.router.add_get("/health", health)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(dp, bot, scheduler, url=WEBHOOK_URL, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET,
+                      host=WEB_HOST, port=WEB_PORT):
+    if not url:
+        raise ValueError("WEBHOOK_URL должен быть установлен в режиме webhook")
+    app = build_app(dp, bot, scheduler, path=path, secret=secret)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    await bot.set_webhook(
+        f"{url.rstrip('/')}{path}",
+        secret_token=secret,
+        drop_pending_updates=True,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+    logger.info(f"Webhook слушает {host}:{port}{path}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()